@@ -15,6 +15,7 @@ class AttentionLinmatrixModel(models.BaseModel):
                    l2_penalty=1e-8,
                    sub_scope="",
                    original_input=None, 
+                   is_training=True,
                    **unused_params):
 
     num_methods = model_input.get_shape().as_list()[-1]
@@ -46,6 +47,7 @@ class AttentionLinmatrixModel(models.BaseModel):
         regularizer=slim.l2_regularizer(l2_penalty))
     ## moe_num_mixtures x num_features x num_methods
     weight_xy = tf.einsum("ijl,ilk->ijk", weight_x, weight_y) + weight_var + b
+    weight_xy = utils.fold_constant(weight_xy, is_training, "folded_weight_xy")
 
     # weight
     gated_weight_xy = tf.einsum("ij,jkl->ikl", gate_activations, weight_xy)
@@ -9,7 +9,7 @@ FLAGS = flags.FLAGS
 class LinearRegressionModel(models.BaseModel):
   """Logistic model with L2 regularization."""
 
-  def create_model(self, model_input, vocab_size, l2_penalty=1e-8, original_input=None, **unused_params):
+  def create_model(self, model_input, vocab_size, l2_penalty=1e-8, original_input=None, is_training=True, **unused_params):
     """Creates a linear regression model.
 
     Args:
@@ -24,7 +24,8 @@ class LinearRegressionModel(models.BaseModel):
     weight = tf.get_variable("ensemble_weight", 
         shape=[num_methods],
         regularizer=slim.l2_regularizer(l2_penalty))
-    weight = tf.nn.softmax(weight)
+    weight = utils.fold_constant(tf.nn.softmax(weight), is_training,
+                                 "folded_weight")
     output = tf.einsum("ijk,k->ij", model_input, weight)
     return {"predictions": output}
 
@@ -9,7 +9,7 @@ FLAGS = flags.FLAGS
 class MatrixRegressionModel(models.BaseModel):
   """Logistic model with L2 regularization."""
 
-  def create_model(self, model_input, vocab_size, l2_penalty=1e-8, original_input=None, **unused_params):
+  def create_model(self, model_input, vocab_size, l2_penalty=1e-8, original_input=None, is_training=True, **unused_params):
     """Creates a matrix regression model.
 
     Args:
@@ -30,6 +30,7 @@ class MatrixRegressionModel(models.BaseModel):
         shape=[num_features, num_methods],
         regularizer=slim.l2_regularizer(10 * l2_penalty))
     weight = tf.nn.softmax(tf.einsum("ij,j->ij", weight2d, weight1d), dim=-1)
+    weight = utils.fold_constant(weight, is_training, "folded_weight")
     output = tf.einsum("ijk,jk->ij", model_input, weight)
     return {"predictions": output}
 
@@ -9,7 +9,7 @@ FLAGS = flags.FLAGS
 class NonunitMatrixRegressionModel(models.BaseModel):
   """Logistic model with L2 regularization."""
 
-  def create_model(self, model_input, vocab_size, l2_penalty=1e-8, original_input=None, epsilon=1e-5, **unused_params):
+  def create_model(self, model_input, vocab_size, l2_penalty=1e-8, original_input=None, epsilon=1e-5, is_training=True, **unused_params):
     """Creates a non-unified matrix regression model.
 
     Args:
@@ -29,7 +29,8 @@ class NonunitMatrixRegressionModel(models.BaseModel):
     weight = tf.get_variable("ensemble_weight", 
         shape=[num_features, num_methods],
         regularizer=slim.l2_regularizer(l2_penalty))
-    weight = tf.nn.softmax(weight)
+    weight = utils.fold_constant(tf.nn.softmax(weight), is_training,
+                                 "folded_weight")
 
     output = tf.nn.sigmoid(tf.einsum("ijk,jk->ij", log_model_input, weight))
     return {"predictions": output}
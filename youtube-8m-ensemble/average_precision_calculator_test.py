@@ -0,0 +1,179 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for average_precision_calculator, against the heap and loop
+implementation it replaces."""
+
+import heapq
+import random
+
+import numpy as np
+import tensorflow as tf
+
+import average_precision_calculator as ap_calculator
+
+
+def loop_ap_at_n(predictions, actuals, n=20, total_num_positives=None):
+  """The former AveragePrecisionCalculator.ap_at_n."""
+  ap = 0.0
+  predictions = np.array(predictions)
+  actuals = np.array(actuals)
+  random.seed(0)
+  suffidx = random.sample(range(len(predictions)), len(predictions))
+  predictions = predictions[suffidx]
+  actuals = actuals[suffidx]
+  sortidx = sorted(
+      range(len(predictions)),
+      key=lambda k: predictions[k],
+      reverse=True)
+  if total_num_positives is None:
+    numpos = np.size(np.where(actuals > 0))
+  else:
+    numpos = total_num_positives
+  if numpos == 0:
+    return 0
+  if n is not None:
+    numpos = min(numpos, n)
+  delta_recall = 1.0 / numpos
+  poscount = 0.0
+  r = len(sortidx)
+  if n is not None:
+    r = min(r, n)
+  for i in range(r):
+    if actuals[sortidx[i]] > 0:
+      poscount += 1
+      ap += poscount / (i + 1) * delta_recall
+  return ap
+
+
+class HeapAveragePrecisionCalculator(object):
+  """The former AveragePrecisionCalculator, keeping a heap of the pairs."""
+
+  def __init__(self, top_n=None):
+    self._top_n = top_n
+    self._total_positives = 0
+    self._heap = []
+
+  def accumulate(self, predictions, actuals, num_positives=None):
+    if num_positives is None:
+      num_positives = np.size(np.where(actuals > 0))
+    self._total_positives += num_positives
+    for i in range(np.size(predictions)):
+      if self._top_n is None or len(self._heap) < self._top_n:
+        heapq.heappush(self._heap, (predictions[i], actuals[i]))
+      elif predictions[i] > self._heap[0][0]:
+        heapq.heappop(self._heap)
+        heapq.heappush(self._heap, (predictions[i], actuals[i]))
+
+  def peek_ap_at_n(self):
+    if not self._heap:
+      return 0
+    predlists = np.array(list(zip(*self._heap)))
+    return loop_ap_at_n(predlists[0], predlists[1], n=self._top_n,
+                        total_num_positives=self._total_positives)
+
+
+def ap_bounds(predictions, actuals, n=None):
+  """Returns the smallest and largest ap over the orders of the ties."""
+  bounds = []
+  for tie_break in [actuals, -actuals]:
+    order = np.lexsort((tie_break, -predictions))
+    bounds.append(loop_ap_at_n(np.arange(len(order), 0, -1),
+                               actuals[order], n=n,
+                               total_num_positives=np.sum(actuals > 0)))
+  return min(bounds), max(bounds)
+
+
+class AveragePrecisionCalculatorTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.random = np.random.RandomState(0)
+
+  def batches(self, num_batches, batch_size, num_values=None):
+    """Returns batches of predictions, tied if num_values is set."""
+    batches = []
+    for _ in range(num_batches):
+      predictions = self.random.rand(batch_size)
+      if num_values:
+        predictions = np.round(predictions * num_values) / num_values
+      actuals = (self.random.rand(batch_size) < predictions).astype(np.int64)
+      batches.append((predictions, actuals))
+    return batches
+
+  def testApAtNMatchesLoop(self):
+    for num_values in [None, 4, 20]:
+      for predictions, actuals in self.batches(5, 300, num_values):
+        for n in [None, 1, 20, 299, 1000]:
+          self.assertAlmostEqual(
+              ap_calculator.AveragePrecisionCalculator.ap_at_n(
+                  predictions, actuals, n=n),
+              loop_ap_at_n(predictions, actuals, n=n))
+
+  def testPeekMatchesHeapWithoutTies(self):
+    for top_n in [None, 1, 20]:
+      calculator = ap_calculator.AveragePrecisionCalculator(top_n)
+      heap_calculator = HeapAveragePrecisionCalculator(top_n)
+      for predictions, actuals in self.batches(20, 200):
+        calculator.accumulate(predictions, actuals)
+        heap_calculator.accumulate(predictions, actuals)
+      self.assertAlmostEqual(calculator.peek_ap_at_n(),
+                             heap_calculator.peek_ap_at_n())
+
+  def testKeepsThePairsOfTheHeap(self):
+    for top_n in [1, 20, 150]:
+      calculator = ap_calculator.AveragePrecisionCalculator(top_n)
+      heap_calculator = HeapAveragePrecisionCalculator(top_n)
+      for predictions, actuals in self.batches(40, 200, num_values=10):
+        calculator.accumulate(predictions, actuals)
+        heap_calculator.accumulate(predictions, actuals)
+      kept = calculator._top_indices()
+      self.assertEqual(
+          sorted(zip(calculator._predictions[kept].tolist(),
+                     calculator._actuals[kept].tolist())),
+          sorted((p, a) for p, a in heap_calculator._heap))
+
+  def testPeekRanksTiesInArrivalOrder(self):
+    batches = self.batches(20, 200, num_values=10)
+    predictions = np.concatenate([p for p, _ in batches])
+    actuals = np.concatenate([a for _, a in batches])
+    calculator = ap_calculator.AveragePrecisionCalculator()
+    heap_calculator = HeapAveragePrecisionCalculator()
+    for batch_predictions, batch_actuals in batches:
+      calculator.accumulate(batch_predictions, batch_actuals)
+      heap_calculator.accumulate(batch_predictions, batch_actuals)
+    ap = calculator.peek_ap_at_n()
+    self.assertAlmostEqual(ap, loop_ap_at_n(predictions, actuals, n=None))
+
+    # the heap ranks the ties in another order, within the same bounds
+    heap_ap = heap_calculator.peek_ap_at_n()
+    self.assertNotAlmostEqual(ap, heap_ap)
+    lower, upper = ap_bounds(predictions, actuals)
+    self.assertTrue(lower <= ap <= upper)
+    self.assertTrue(lower <= heap_ap <= upper)
+
+  def testMerge(self):
+    for top_n in [None, 20]:
+      batches = self.batches(10, 200, num_values=10)
+      calculator = ap_calculator.AveragePrecisionCalculator(top_n)
+      shards = [ap_calculator.AveragePrecisionCalculator(top_n)
+                for _ in range(2)]
+      for index, (predictions, actuals) in enumerate(batches):
+        calculator.accumulate(predictions, actuals)
+        shards[index * 2 // len(batches)].accumulate(predictions, actuals)
+      shards[0].merge(shards[1])
+      self.assertAlmostEqual(shards[0].peek_ap_at_n(),
+                             calculator.peek_ap_at_n())
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,123 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for measuring the ensemble GAP and size of top-k prediction files.
+
+A synthetic prediction set of several models is written as prediction store
+files keeping the top k predictions of every video, read back densified and
+averaged (as the MeanModel does). The GAP of the averaged predictions is
+compared with that of the dense float32 predictions for every k.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import logging
+
+import eval_util
+import prediction_store
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_integer("num_videos", 4096,
+                       "Number of synthetic videos.")
+  flags.DEFINE_integer("num_models", 4,
+                       "Number of synthetic models in the ensemble.")
+  flags.DEFINE_integer("num_classes", 4716,
+                       "Number of classes.")
+  flags.DEFINE_string("top_k_list", "20,50,100,200,500,1000",
+                      "Comma separated list of the k to measure.")
+  flags.DEFINE_string("dtype", "float16",
+                      "The dtype of the stored predictions.")
+  flags.DEFINE_float("noise", 0.8,
+                     "Standard deviation of the logit noise of each model.")
+
+
+def synthetic_predictions(num_videos, num_models, num_classes, noise):
+  """Returns video ids, labels and the predictions of num_models models.
+
+  The label frequencies follow a power law as in YouTube-8M and every model
+  sees the labels through a shared and an individual gaussian noise on the
+  logits, so that the models are correlated but not identical.
+  """
+  rng = np.random.RandomState(0)
+  class_freq = 1.0 / np.arange(1, num_classes + 1) ** 0.8
+  class_freq /= class_freq.sum()
+  labels = np.zeros([num_videos, num_classes], dtype=np.float32)
+  for i in range(num_videos):
+    labels[i, rng.choice(num_classes, rng.randint(1, 6), replace=False,
+                         p=class_freq)] = 1
+  prior = np.log(class_freq * 3)[None, :]
+  shared = rng.randn(num_videos, num_classes).astype(np.float32) * noise
+  all_predictions = []
+  for _ in range(num_models):
+    logits = (4.0 * labels + prior + shared +
+              rng.randn(num_videos, num_classes).astype(np.float32) * noise)
+    all_predictions.append((1.0 / (1.0 + np.exp(-logits))).astype(np.float32))
+  video_ids = ["%08d" % i for i in range(num_videos)]
+  return video_ids, labels, all_predictions
+
+
+def ensemble_gap(filenames, labels):
+  """Returns the GAP of the mean of the predictions stored in the files."""
+  predictions = np.mean([prediction_store.PredictionStore(f).get_predictions()
+                         for f in filenames], axis=0)
+  return eval_util.calculate_gap(predictions, labels)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  video_ids, labels, all_predictions = synthetic_predictions(
+      FLAGS.num_videos, FLAGS.num_models, FLAGS.num_classes, FLAGS.noise)
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    results = []
+    for top_k in [0] + map(int, FLAGS.top_k_list.split(",")):
+      dtype = FLAGS.dtype if top_k else "float32"
+      filenames = []
+      for model_index, predictions in enumerate(all_predictions):
+        filename = os.path.join(temp_dir, "model%d-top%d%s" % (
+            model_index, top_k, prediction_store.FILE_EXTENSION))
+        prediction_store.write_predictions(filename, video_ids, labels,
+                                           predictions, dtype=dtype,
+                                           top_k=top_k)
+        filenames.append(filename)
+      bytes_per_video = prediction_store.record_bytes(FLAGS.num_classes, dtype,
+                                                      top_k)
+      gap = ensemble_gap(filenames, labels)
+      logging.info("top_k %d: %d bytes/video, GAP %.6f", top_k,
+                   bytes_per_video, gap)
+      results.append((top_k, dtype, bytes_per_video, gap))
+      for filename in filenames:
+        os.remove(filename)
+  finally:
+    shutil.rmtree(temp_dir)
+
+  dense_bytes, dense_gap = results[0][2], results[0][3]
+  print("%-6s %-8s %12s %8s %10s %10s" % (
+      "top_k", "dtype", "bytes/video", "ratio", "GAP", "dGAP"))
+  for top_k, dtype, bytes_per_video, gap in results:
+    print("%-6s %-8s %12d %7.1fx %10.6f %+10.6f" % (
+        top_k or "dense", dtype, bytes_per_video,
+        float(dense_bytes) / bytes_per_video, gap, gap - dense_gap))
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,21 @@
+# fits the weights of a LinearRegressionModel in one streaming pass
+# instead of train-linear_model.sh, writing
+# ../model/${model}/model.ckpt-0 for the infer scripts
+model=$1
+conf=$2
+
+train_path=/Youtube-8M/model_predictions/ensemble_train
+validate_path=/Youtube-8M/model_predictions/ensemble_validate
+train_data_patterns=""
+validate_data_patterns=""
+for d in $(cat $conf); do
+  train_data_patterns="${train_path}/${d}/*.tfrecord${train_data_patterns:+,$train_data_patterns}"
+  validate_data_patterns="${validate_path}/${d}/*.tfrecord${validate_data_patterns:+,$validate_data_patterns}"
+done
+echo $train_data_patterns
+
+python fit-ensemble-weights.py \
+      --train_dir="../model/${model}" \
+      --train_data_patterns="$train_data_patterns" \
+      --eval_data_patterns="$validate_data_patterns" \
+      --model=LinearRegressionModel
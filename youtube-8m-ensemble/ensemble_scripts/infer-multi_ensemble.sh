@@ -0,0 +1,26 @@
+# infers the ensembles of a conf file in a single pass over their members,
+# one ensemble per line, e.g.
+#   model=MatrixRegressionModel checkpoint=../model/matrix_model/model.ckpt-1000 members=ensemble_scripts/ensemble_no1.conf output_file=../model/matrix_model/predictions.csv
+#   model=AttentionMatrixModel checkpoint=../model/attention_matrix_model/model.ckpt-2000 members=ensemble_scripts/ensemble_no1.conf output_file=../model/attention_matrix_model/predictions.csv moe_num_mixtures=4 attention_matrix_rank=8
+ensembles_conf=$1
+# the original input of the attention models, e.g.
+# /Youtube-8M/model_predictions/test/model_input/*.tfrecord, only given when
+# an ensemble needs it
+input_data_pattern=$2
+
+DEFAULT_GPU_ID=0
+if [ -z ${CUDA_VISIBLE_DEVICES+x} ]; then
+  GPU_ID=$DEFAULT_GPU_ID
+  echo "set CUDA_VISIBLE_DEVICES to default('$GPU_ID')"
+else
+  GPU_ID=$CUDA_VISIBLE_DEVICES
+  echo "set CUDA_VISIBLE_DEVICES to external('$GPU_ID')"
+fi
+
+test_path=/Youtube-8M/model_predictions/test
+
+CUDA_VISIBLE_DEVICES="$GPU_ID" python inference-multi-ensemble.py \
+      --ensembles_conf="$ensembles_conf" \
+      --input_path="$test_path" \
+      ${input_data_pattern:+--input_data_pattern="$input_data_pattern"} \
+      --batch_size=1024
@@ -0,0 +1,8 @@
+
+# scores every model of ensemble_validate without building a graph, as
+# eval.py with the MeanModel of a single model would
+validate_path=/Youtube-8M/model_predictions/ensemble_validate
+
+python score-predictions.py \
+      --prediction_dirs="${validate_path}/*" \
+      --num_workers=4
@@ -15,6 +15,7 @@
 
 import time
 
+import numpy
 import eval_util
 import losses
 import ensemble_level_models
@@ -25,6 +26,7 @@ from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
 import utils
+import video_id_join
 
 FLAGS = flags.FLAGS
 
@@ -43,6 +45,11 @@ if __name__ == "__main__":
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_boolean(
+      "join_by_video_id", False,
+      "If set, the data patterns (and input_data_pattern) are joined on their "
+      "common video ids instead of being read in lockstep. Videos that are "
+      "not in every source are left out.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -56,7 +63,27 @@ if __name__ == "__main__":
   # Other flags.
   flags.DEFINE_boolean("run_once", True, "Whether to run eval only once.")
   flags.DEFINE_boolean("echo_gap", False, "Whether to echo GAP at the end.")
+  flags.DEFINE_integer(
+      "bootstrap_resamples", 0,
+      "If positive, the bootstrap confidence interval of the GAP is computed "
+      "from this many resamples of the videos, and echoed with the GAP.")
+  flags.DEFINE_float("bootstrap_confidence", 0.95,
+                     "The confidence of the bootstrap interval of the GAP.")
+  flags.DEFINE_string(
+      "bootstrap_replicates_file", "",
+      "If set, the bootstrap replicates of the GAP are saved to this .npy "
+      "file, to be paired with the ones of other candidates by get_top_k.py.")
   flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+  flags.DEFINE_integer(
+      "metric_queue_size", 2,
+      "How many batches may wait for the thread accumulating the metrics, "
+      "which overlaps with the inference of the next batches. 0 accumulates "
+      "them synchronously.")
+  flags.DEFINE_integer(
+      "gap_histogram_bins", 0,
+      "If positive, estimate the GAP from histograms of this many bins of the "
+      "predictions, in bounded memory, instead of computing it exactly. The "
+      "memory of the MAP still grows with the number of videos.")
 
 def find_class_by_name(name, modules):
   """Searches the provided modules for the named class and returns it."""
@@ -107,29 +134,43 @@ def build_graph(all_readers,
 
   global_step = tf.Variable(0, trainable=False, name="global_step")
 
-  model_input_raw_tensors = []
-  labels_batch_tensor = None
-  video_id_batch = None
-  for reader, data_pattern in zip(all_readers, all_eval_data_patterns):
-    unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_evaluation_tensors(
-            reader,
-            data_pattern,
-            batch_size=batch_size))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    if video_id_batch is None:
-      video_id_batch = unused_video_id
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-
-  original_input = None
-  if input_data_pattern is not None:
-    unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_evaluation_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size))
-  
+  if FLAGS.join_by_video_id:
+    video_id_batch, all_model_input_raw, labels_batch_tensor, original_input = (
+        video_id_join.get_joined_input_tensors(
+            all_readers,
+            all_eval_data_patterns,
+            input_reader=input_reader,
+            input_data_pattern=input_data_pattern,
+            batch_size=batch_size,
+            num_epochs=1,
+            allow_missing_videos=True))
+    model_input_raw_tensors = [tf.expand_dims(model_input_raw, axis=2)
+                               for model_input_raw in all_model_input_raw]
+    reader = all_readers[-1]
+  else:
+    model_input_raw_tensors = []
+    labels_batch_tensor = None
+    video_id_batch = None
+    for reader, data_pattern in zip(all_readers, all_eval_data_patterns):
+      unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_evaluation_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      if video_id_batch is None:
+        video_id_batch = unused_video_id
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
+
+    original_input = None
+    if input_data_pattern is not None:
+      unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_evaluation_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size))
+
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
 
@@ -155,6 +196,28 @@ def build_graph(all_readers,
   tf.add_to_collection("summary_op", tf.summary.merge_all())
 
 
+def log_iteration_infos(summary_writer, global_step_val, iteration_info_dicts):
+  """Writes the summaries of the accumulated batches and logs them.
+
+  Returns:
+    The seconds spent accumulating the batches and blocked handing them over.
+  """
+  accumulate_seconds, wait_seconds = 0.0, 0.0
+  for iteration_info_dict in iteration_info_dicts:
+    iterinfo = utils.AddGlobalStepSummary(
+        summary_writer,
+        global_step_val,
+        iteration_info_dict,
+        summary_scope="Eval")
+    logging.info("examples_processed: %d | %s | Metrics: %.3fs, %.0f%% "
+                 "overlapped", iteration_info_dict["examples_processed"],
+                 iterinfo, iteration_info_dict["accumulate_seconds"],
+                 100 * iteration_info_dict["overlap"])
+    accumulate_seconds += iteration_info_dict["accumulate_seconds"]
+    wait_seconds += iteration_info_dict["wait_seconds"]
+  return accumulate_seconds, wait_seconds
+
+
 def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                     summary_op, saver, summary_writer, evl_metrics,
                     last_global_step_val):
@@ -193,6 +256,12 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
 
     # Start the queue runners.
     fetches = [video_id_batch, prediction_batch, label_batch, loss, summary_op]
+    async_metrics = eval_util.AsyncEvaluationMetrics(
+        evl_metrics, FLAGS.metric_queue_size)
+    if FLAGS.bootstrap_resamples > 0:
+      gap_bootstrap = eval_util.GapBootstrap(FLAGS.top_k)
+    else:
+      gap_bootstrap = None
     coord = tf.train.Coordinator()
     try:
       threads = []
@@ -204,35 +273,42 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                    global_step_val)
 
       evl_metrics.clear()
+      accumulate_seconds, wait_seconds = 0.0, 0.0
 
       examples_processed = 0
       while not coord.should_stop():
         batch_start_time = time.time()
 
-        _, predictions_val, labels_val, loss_val, summary_val = sess.run(fetches)
+        video_id_val, predictions_val, labels_val, loss_val, summary_val = sess.run(fetches)
+        if gap_bootstrap is not None:
+          gap_bootstrap.accumulate(video_id_val, predictions_val, labels_val)
 
         seconds_per_batch = time.time() - batch_start_time
         example_per_second = labels_val.shape[0] / seconds_per_batch
         examples_processed += labels_val.shape[0]
 
-        iteration_info_dict = evl_metrics.accumulate(predictions_val,
-                                                     labels_val, loss_val)
-        iteration_info_dict["examples_per_second"] = example_per_second
-
-        iterinfo = utils.AddGlobalStepSummary(
-            summary_writer,
-            global_step_val,
-            iteration_info_dict,
-            summary_scope="Eval")
-        logging.info("examples_processed: %d | %s", examples_processed,
-                     iterinfo)
+        async_metrics.accumulate(
+            predictions_val, labels_val, loss_val,
+            {"examples_per_second": example_per_second,
+             "examples_processed": examples_processed})
+        seconds = log_iteration_infos(summary_writer, global_step_val,
+                                      async_metrics.pop_finished())
+        accumulate_seconds += seconds[0]
+        wait_seconds += seconds[1]
 
     except tf.errors.OutOfRangeError as e:
       logging.info(
           "Done with batched inference. Now calculating global performance "
           "metrics.")
+      seconds = log_iteration_infos(summary_writer, global_step_val,
+                                    async_metrics.pop_finished(wait=True))
+      accumulate_seconds += seconds[0]
+      wait_seconds += seconds[1]
+      logging.info("Metrics: %.2fs, %.0f%% overlapped with the inference.",
+                   accumulate_seconds, 100 * max(
+                       0.0, 1.0 - wait_seconds / max(accumulate_seconds, 1e-9)))
       # calculate the metrics for the entire epoch
-      epoch_info_dict = evl_metrics.get()
+      epoch_info_dict = async_metrics.get()
       epoch_info_dict["epoch_id"] = global_step_val
 
       summary_writer.add_summary(summary_val, global_step_val)
@@ -241,7 +317,18 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
           global_step_val,
           epoch_info_dict,
           summary_scope="Eval")
-      if FLAGS.echo_gap:
+      if gap_bootstrap is not None:
+        _, replicates = gap_bootstrap.get_replicates(FLAGS.bootstrap_resamples)
+        lower, upper = eval_util.bootstrap_interval(
+            replicates, FLAGS.bootstrap_confidence)
+        logging.info("GAP %.0f%% bootstrap interval: [%.6f, %.6f]",
+                     100 * FLAGS.bootstrap_confidence, lower, upper)
+        if FLAGS.bootstrap_replicates_file:
+          with gfile.Open(FLAGS.bootstrap_replicates_file, "wb") as f:
+            numpy.save(f, replicates)
+      if FLAGS.echo_gap and gap_bootstrap is not None:
+        print "GAP =", epoch_info_dict["gap"], "| CI =", lower, upper
+      elif FLAGS.echo_gap:
         print "GAP =", epoch_info_dict["gap"]
       logging.info(epochinfo)
       evl_metrics.clear()
@@ -251,6 +338,7 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
 
     coord.request_stop()
     coord.join(threads, stop_grace_period_secs=10)
+    async_metrics.close()
 
     return global_step_val
 
@@ -268,8 +356,8 @@ def evaluate():
     all_patterns = FLAGS.eval_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      reader = readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes)
+      reader = readers.get_prediction_reader(
+          all_patterns[i], feature_names, feature_sizes)
       all_readers.append(reader)
 
     input_reader = None
@@ -306,7 +394,8 @@ def evaluate():
     summary_writer = tf.summary.FileWriter(
         FLAGS.train_dir, graph=tf.get_default_graph())
 
-    evl_metrics = eval_util.EvaluationMetrics(FLAGS.num_classes, FLAGS.top_k)
+    evl_metrics = eval_util.EvaluationMetrics(FLAGS.num_classes, FLAGS.top_k,
+                                              FLAGS.gap_histogram_bins)
 
     last_global_step_val = -1
     last_global_step_val = evaluation_loop(video_id_batch, prediction_batch,
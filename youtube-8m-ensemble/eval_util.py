@@ -14,6 +14,11 @@
 
 """Provides functions to help with evaluating models."""
 import datetime
+import io
+import Queue
+import threading
+import time
+import zlib
 import numpy
 
 from tensorflow.python.platform import gfile
@@ -42,6 +47,115 @@ def calculate_hit_at_one(predictions, actuals):
   return numpy.average(hits)
 
 
+def _top_k_hits(predictions, actuals, k=None, num_groups=64):
+  """Returns the sums of the labels of the top k positive predictions of rows.
+
+  The top k[i] predictions of the row i are the ones numpy.argpartition would
+  select, and only the positive ones are counted. No row is sorted: the
+  classes are split in num_groups groups of consecutive classes, and the k-th
+  largest maximum of the groups of a row is not above its k-th prediction.
+  So only the predictions of the groups reaching it, and not lower than the
+  lowest label, can outrank a label of the top k. The candidates above and
+  equal to every label are counted by binary searches in the candidates
+  sorted by row and prediction, in memory linear in the number of candidates
+  and labels. The rows where ties at the k-th prediction make the selection
+  depend on argpartition are done with it.
+
+  Args:
+    predictions: Matrix containing the outputs of the model.
+      Dimensions are 'batch' x 'num_classes'.
+    actuals: Matrix containing the ground truth labels.
+      Dimensions are 'batch' x 'num_classes'.
+    k: An integer array of the number of top predictions of every row, or
+      None for the number of labels of every row.
+    num_groups: The number of groups of classes.
+
+  Returns:
+    A tuple of float64 arrays, the sums of the labels of the top k positive
+    predictions and the sums of all the labels of every row.
+  """
+  num_videos, num_classes = predictions.shape
+  hits = numpy.zeros([num_videos])
+
+  # the positively predicted labels, in row major order
+  label_index = numpy.flatnonzero(actuals != 0)
+  label_sums = numpy.bincount(label_index // num_classes,
+                              weights=actuals.ravel()[label_index],
+                              minlength=num_videos)
+  if k is None:
+    k = label_sums.astype(numpy.int64)
+  label_index = label_index[predictions.ravel()[label_index] > 0]
+  label_index = label_index[k[label_index // num_classes] > 0]
+  if label_index.size == 0:
+    return hits, label_sums
+  label_predictions = predictions.ravel()[label_index]
+  label_values = actuals.ravel()[label_index]
+  label_rows = label_index // num_classes
+  row_starts = numpy.concatenate(
+      [[0], numpy.flatnonzero(label_rows[1:] != label_rows[:-1]) + 1])
+  rows = label_rows[row_starts]
+
+  # the predictions which can outrank a label of the top k are not lower
+  # than the threshold
+  threshold = numpy.full([num_videos], numpy.inf, dtype=predictions.dtype)
+  threshold[rows] = numpy.minimum.reduceat(label_predictions, row_starts)
+  num_groups = min(num_groups, num_classes)
+  group_size = num_classes // num_groups
+  grouped = num_groups * group_size
+  group_max = numpy.max(predictions[:, :grouped].reshape(
+      [num_videos, num_groups, group_size]), axis=2)
+  bounded = rows[k[rows] <= num_groups]
+  if bounded.size:
+    max_k = numpy.max(k[bounded])
+    top_group_max = numpy.sort(numpy.partition(
+        group_max[bounded], num_groups - max_k, axis=1)[:, num_groups - max_k:])
+    threshold[bounded] = numpy.maximum(
+        threshold[bounded], top_group_max[numpy.arange(len(bounded)),
+                                          max_k - k[bounded]])
+
+  # the candidates, in the groups reaching the threshold and out of groups
+  group_index = numpy.flatnonzero(group_max >= threshold[:, numpy.newaxis])
+  group_rows, groups = numpy.divmod(group_index, num_groups)
+  candidate_index = (group_rows * num_classes + groups * group_size)[
+      :, numpy.newaxis] + numpy.arange(group_size)
+  rest = numpy.flatnonzero(
+      predictions[:, grouped:] >= threshold[:, numpy.newaxis])
+  rest_rows, rest_columns = numpy.divmod(rest, num_classes - grouped)
+  candidate_index = numpy.concatenate([
+      candidate_index[predictions.ravel()[candidate_index] >=
+                      threshold[group_rows][:, numpy.newaxis]],
+      rest_rows * num_classes + grouped + rest_columns])
+  candidate_rows = candidate_index // num_classes
+  candidate_predictions = predictions.ravel()[candidate_index]
+
+  # the number of candidates above and equal to every label of their row,
+  # with the predictions replaced by their rank among the distinct ones
+  values = numpy.unique(numpy.concatenate([candidate_predictions,
+                                           label_predictions]))
+  num_values = len(values)
+  candidate_keys = numpy.sort(
+      candidate_rows * num_values +
+      numpy.searchsorted(values, candidate_predictions))
+  label_keys = (label_rows * num_values +
+                numpy.searchsorted(values, label_predictions))
+  equal_end = numpy.searchsorted(candidate_keys, label_keys, side="right")
+  greater = numpy.searchsorted(candidate_keys,
+                               (label_rows + 1) * num_values) - equal_end
+  equal = equal_end - numpy.searchsorted(candidate_keys, label_keys)
+
+  # the labels under the threshold have at least k candidates above them
+  label_k = k[label_rows]
+  selected = ((greater + equal <= label_k) &
+              (label_predictions >= threshold[label_rows]))
+  hits = numpy.bincount(label_rows, weights=label_values * selected,
+                        minlength=num_videos)
+  for row in numpy.unique(label_rows[~selected & (greater < label_k)]):
+    top_indices = numpy.argpartition(predictions[row], -k[row])[-k[row]:]
+    top_predictions = predictions[row][top_indices]
+    hits[row] = numpy.sum(actuals[row][top_indices][top_predictions > 0])
+  return hits, label_sums
+
+
 def calculate_recall_at_n(predictions, actuals, n):
   """Performs a local (numpy) calculation of the recall@n
 
@@ -55,20 +169,12 @@ def calculate_recall_at_n(predictions, actuals, n):
   Returns:
     float: The recall at n across the entire batch.
   """
-  aggregated_recall = 0.0
   num_videos = actuals.shape[0]
-  for row in numpy.arange(num_videos):
-    num_labels = int(numpy.sum(actuals[row]))
-    top_indices = numpy.argpartition(predictions[row],
-                                     -n)[-n:]
-    item_recall = 0.0
-    for label_index in top_indices:
-      if predictions[row][label_index] > 0:
-        item_recall += actuals[row][label_index]
-    item_recall /= num_labels
-    aggregated_recall += item_recall
-  aggregated_recall /= num_videos
-  return aggregated_recall
+  hits, label_sums = _top_k_hits(
+      predictions, actuals, numpy.full([num_videos], n, dtype=numpy.int64))
+  num_labels = label_sums.astype(numpy.int64)
+  # summed in row order, as the loop it replaces
+  return numpy.cumsum(hits / num_labels)[-1] / num_videos
 
 
 def calculate_precision_at_equal_recall_rate(predictions, actuals):
@@ -83,20 +189,14 @@ def calculate_precision_at_equal_recall_rate(predictions, actuals):
   Returns:
     float: The average precision at equal recall rate across the entire batch.
   """
-  aggregated_precision = 0.0
   num_videos = actuals.shape[0]
-  for row in numpy.arange(num_videos):
-    num_labels = int(numpy.sum(actuals[row]))
-    top_indices = numpy.argpartition(predictions[row],
-                                     -num_labels)[-num_labels:]
-    item_precision = 0.0
-    for label_index in top_indices:
-      if predictions[row][label_index] > 0:
-        item_precision += actuals[row][label_index]
-    item_precision /= top_indices.size
-    aggregated_precision += item_precision
-  aggregated_precision /= num_videos
-  return aggregated_precision
+  hits, label_sums = _top_k_hits(predictions, actuals)
+  num_labels = label_sums.astype(numpy.int64)
+  precision = numpy.zeros([num_videos])
+  labeled = num_labels > 0
+  precision[labeled] = hits[labeled] / num_labels[labeled]
+  # summed in row order, as the loop it replaces
+  return numpy.cumsum(precision)[-1] / num_videos
 
 
 def calculate_gap(predictions, actuals, top_k=20):
@@ -115,8 +215,12 @@ def calculate_gap(predictions, actuals, top_k=20):
     float: The global average precision.
   """
   gap_calculator = ap_calculator.AveragePrecisionCalculator()
-  sparse_predictions, sparse_labels, num_positives = top_k_by_class(predictions, actuals, top_k)
-  gap_calculator.accumulate(flatten(sparse_predictions), flatten(sparse_labels), sum(num_positives))
+  classes, top_predictions, top_labels = top_k_by_video(predictions, actuals,
+                                                        top_k)
+  # by class, as flatten(top_k_by_class(...))
+  order = numpy.argsort(classes, axis=None, kind="mergesort")
+  gap_calculator.accumulate(top_predictions.ravel()[order],
+                            top_labels.ravel()[order], numpy.sum(actuals))
   return gap_calculator.peek_ap_at_n()
 
 
@@ -140,22 +244,42 @@ def top_k_by_class(predictions, labels, k=20):
   Raises:
     ValueError: An error occurred when the k is not a positive integer.
   """
-  if k <= 0:
-    raise ValueError("k must be a positive integer.")
-  k = min(k, predictions.shape[1])
   num_classes = predictions.shape[1]
-  prediction_triplets= []
-  for video_index in range(predictions.shape[0]):
-    prediction_triplets.extend(top_k_triplets(predictions[video_index],labels[video_index], k))
-  out_predictions = [[] for v in range(num_classes)]
-  out_labels = [[] for v in range(num_classes)]
-  for triplet in prediction_triplets:
-    out_predictions[triplet[0]].append(triplet[1])
-    out_labels[triplet[0]].append(triplet[2])
-  out_true_positives = [numpy.sum(labels[:,i]) for i in range(num_classes)]
+  classes, top_predictions, top_labels = top_k_by_video(predictions, labels, k)
+  order = numpy.argsort(classes, axis=None, kind="mergesort")
+  splits = numpy.cumsum(numpy.bincount(classes.ravel(),
+                                       minlength=num_classes))[:-1]
+  out_predictions = numpy.split(top_predictions.ravel()[order], splits)
+  out_labels = numpy.split(top_labels.ravel()[order], splits)
+  out_true_positives = list(numpy.sum(labels, axis=0))
 
   return out_predictions, out_labels, out_true_positives
 
+def top_k_by_video(predictions, labels, k=20):
+  """Extracts the top k predictions for each video.
+
+  Args:
+    predictions: A numpy matrix containing the outputs of the model.
+      Dimensions are 'batch' x 'num_classes'.
+    labels: A numpy matrix containing the ground truth labels.
+      Dimensions are 'batch' x 'num_classes'.
+    k: the top k entries to preserve in each prediction.
+
+  Returns:
+    A tuple (classes, predictions, labels) of 'batch' x 'k' matrices, the
+    classes of the top k predictions of every video (in no particular order),
+    the predictions and their ground truth labels.
+
+  Raises:
+    ValueError: An error occurred when the k is not a positive integer.
+  """
+  if k <= 0:
+    raise ValueError("k must be a positive integer.")
+  k = min(k, predictions.shape[1])
+  classes = numpy.argpartition(predictions, -k, axis=1)[:, -k:]
+  rows = numpy.arange(predictions.shape[0])[:, numpy.newaxis]
+  return classes, predictions[rows, classes], labels[rows, classes]
+
 def top_k_triplets(predictions, labels, k=20):
   """Get the top_k for a 1-d numpy array. Returns a sparse list of tuples in
   (prediction, class) format"""
@@ -167,12 +291,18 @@ def top_k_triplets(predictions, labels, k=20):
 class EvaluationMetrics(object):
   """A class to store the evaluation metrics."""
 
-  def __init__(self, num_class, top_k):
+  def __init__(self, num_class, top_k, gap_bins=0):
     """Construct an EvaluationMetrics object to store the evaluation metrics.
 
     Args:
       num_class: A positive integer specifying the number of classes.
       top_k: A positive integer specifying how many predictions are considered per video.
+      gap_bins: If positive, the gap is estimated from histograms of that many
+        bins (see HistogramAveragePrecisionCalculator) instead of keeping
+        every prediction. This only bounds the memory of the gap: the
+        MeanAveragePrecisionCalculator still keeps the top_k (class,
+        prediction, actual) triplets of every video, i.e. 9 * top_k bytes per
+        video with float32 predictions, growing with the evaluated set.
 
     Raises:
       ValueError: An error occurred when MeanAveragePrecisionCalculator cannot
@@ -182,7 +312,11 @@ class EvaluationMetrics(object):
     self.sum_perr = 0.0
     self.sum_loss = 0.0
     self.map_calculator = map_calculator.MeanAveragePrecisionCalculator(num_class)
-    self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
+    if gap_bins > 0:
+      self.global_ap_calculator = (
+          ap_calculator.HistogramAveragePrecisionCalculator(gap_bins))
+    else:
+      self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
     self.top_k = top_k
     self.num_examples = 0
 
@@ -209,9 +343,12 @@ class EvaluationMetrics(object):
     mean_loss = numpy.mean(loss)
 
     # Take the top 20 predictions.
-    sparse_predictions, sparse_labels, num_positives = top_k_by_class(predictions, labels, self.top_k)
-    self.map_calculator.accumulate(sparse_predictions, sparse_labels, num_positives)
-    self.global_ap_calculator.accumulate(flatten(sparse_predictions), flatten(sparse_labels), sum(num_positives))
+    classes, top_predictions, top_labels = top_k_by_video(predictions, labels, self.top_k)
+    num_positives = numpy.sum(labels, axis=0)
+    self.map_calculator.accumulate_top_k(classes, top_predictions, top_labels, num_positives)
+    # by class, as flatten(top_k_by_class(...))
+    order = numpy.argsort(classes, axis=None, kind="mergesort")
+    self.global_ap_calculator.accumulate(top_predictions.ravel()[order], top_labels.ravel()[order], numpy.sum(num_positives))
 
     self.num_examples += batch_size
     self.sum_hit_at_one += mean_hit_at_one * batch_size
@@ -244,6 +381,69 @@ class EvaluationMetrics(object):
     return {"avg_hit_at_one": avg_hit_at_one, "avg_perr": avg_perr,
             "avg_loss": avg_loss, "aps": aps, "gap": gap}
 
+  def get_state(self):
+    """Gets the accumulated state, as a dict of numpy arrays.
+
+    The keys of the calculator states are prefixed by map_ and gap_. It can be
+    written by write_metric_state, and restored by set_state.
+    """
+    state = {"top_k": numpy.array(self.top_k),
+             "num_examples": numpy.array(self.num_examples),
+             "sum_hit_at_one": numpy.array(self.sum_hit_at_one),
+             "sum_perr": numpy.array(self.sum_perr),
+             "sum_loss": numpy.array(self.sum_loss)}
+    for prefix, calculator in [("map_", self.map_calculator),
+                               ("gap_", self.global_ap_calculator)]:
+      for key, value in calculator.get_state().items():
+        state[prefix + key] = value
+    return state
+
+  def set_state(self, state):
+    """Restores the state returned by get_state.
+
+    The gap calculator is replaced by one of the kind the state was
+    accumulated with.
+    """
+    if "gap_positives" in state:
+      self.global_ap_calculator = (
+          ap_calculator.HistogramAveragePrecisionCalculator())
+    else:
+      self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
+    for prefix, calculator in [("map_", self.map_calculator),
+                               ("gap_", self.global_ap_calculator)]:
+      calculator.set_state(dict((key[len(prefix):], value)
+                                for key, value in state.items()
+                                if key.startswith(prefix)))
+    self.top_k = int(state["top_k"])
+    self.num_examples = int(state["num_examples"])
+    self.sum_hit_at_one = float(state["sum_hit_at_one"])
+    self.sum_perr = float(state["sum_perr"])
+    self.sum_loss = float(state["sum_loss"])
+
+  def merge(self, other):
+    """Merges the metrics accumulated by another EvaluationMetrics.
+
+    The batches of other are taken as accumulated after the ones of this
+    object, so merging the metrics of consecutive shards of the data in order
+    gives the same gap and aps as evaluating all of it, and merges are
+    associative. The averages of hit_at_one, perr and loss may differ in the
+    last bits, as they are summed in a different order.
+
+    Raises:
+      ValueError: An error occurred when the metrics have a different top_k
+        or calculators that cannot be merged.
+    """
+    if self.top_k != other.top_k:
+      raise ValueError("the metrics have different top_k.")
+    if type(self.global_ap_calculator) != type(other.global_ap_calculator):
+      raise ValueError("the metrics have different gap calculators.")
+    self.map_calculator.merge(other.map_calculator)
+    self.global_ap_calculator.merge(other.global_ap_calculator)
+    self.num_examples += other.num_examples
+    self.sum_hit_at_one += other.sum_hit_at_one
+    self.sum_perr += other.sum_perr
+    self.sum_loss += other.sum_loss
+
   def clear(self):
     """Clear the evaluation metrics and reset the EvaluationMetrics object."""
     self.sum_hit_at_one = 0.0
@@ -252,3 +452,302 @@ class EvaluationMetrics(object):
     self.map_calculator.clear()
     self.global_ap_calculator.clear()
     self.num_examples = 0
+
+
+def write_metric_state(filename, evl_metrics):
+  """Writes the state of an EvaluationMetrics to an .npz file.
+
+  Args:
+    filename: The path of the file, which may be on GCS.
+    evl_metrics: The EvaluationMetrics object.
+  """
+  buf = io.BytesIO()
+  numpy.savez(buf, **evl_metrics.get_state())
+  with gfile.Open(filename, "wb") as f:
+    f.write(buf.getvalue())
+
+
+def read_metric_state(filename):
+  """Reads an EvaluationMetrics written by write_metric_state.
+
+  Args:
+    filename: The path of the file, which may be on GCS.
+
+  Returns:
+    An EvaluationMetrics object holding the state of the file.
+  """
+  with gfile.Open(filename, "rb") as f:
+    data = numpy.load(io.BytesIO(f.read()))
+    state = dict((key, data[key]) for key in data.files)
+  evl_metrics = EvaluationMetrics(len(state["map_total_positives"]),
+                                  int(state["top_k"]))
+  evl_metrics.set_state(state)
+  return evl_metrics
+
+
+class GapBootstrap(object):
+  """Bootstrap confidence intervals of the GAP, over the videos.
+
+  The GAP is the ap of the top_k predictions of all the videos ranked
+  together, i.e. sum_v a_v / sum_v n_v, where n_v is the number of labels of
+  the video v, and a_v the sum of the precisions at the ranks of its positive
+  top predictions. The precisions are computed once, on all the videos, and
+  held fixed in the resamples (a first order bootstrap), so a resample is a
+  weighted sum of the cached a_v and n_v, and 1000 resamples cost about as
+  much as the GAP itself.
+
+  The videos are hashed by their id into num_blocks blocks, and the
+  non-empty blocks are resampled. So the replicates of a seed resample the
+  same videos for every candidate scored on the same videos, whatever their
+  order, and the replicates of two candidates can be compared by
+  paired_bootstrap_interval.
+  """
+
+  def __init__(self, top_k=20, num_blocks=4096):
+    """Construct a GapBootstrap.
+
+    Args:
+      top_k: A positive integer specifying how many predictions are
+        considered per video.
+      num_blocks: A positive integer, the number of blocks of videos.
+    """
+    self.top_k = top_k
+    self.num_blocks = num_blocks
+    self.clear()
+
+  def accumulate(self, video_ids, predictions, labels):
+    """Accumulates the top_k predictions of a mini-batch.
+
+    Args:
+      video_ids: A numpy array of the video ids of the mini-batch.
+      predictions: A numpy matrix containing the outputs of the model.
+        Dimensions are 'batch' x 'num_classes'.
+      labels: A numpy matrix containing the ground truth labels.
+        Dimensions are 'batch' x 'num_classes'.
+    """
+    _, top_predictions, top_labels = top_k_by_video(predictions, labels,
+                                                    self.top_k)
+    self._predictions.append(top_predictions.astype(numpy.float32))
+    self._labels.append(top_labels > 0)
+    self._num_labels.append(numpy.sum(labels > 0, axis=1))
+    self._blocks.append(numpy.array(
+        [(zlib.crc32(video_id) & 0xffffffff) % self.num_blocks
+         for video_id in video_ids], dtype=numpy.int64))
+
+  def get_contributions(self):
+    """Returns the a_v and n_v of the videos, summed by non-empty block."""
+    predictions = numpy.concatenate(self._predictions)
+    labels = numpy.concatenate(self._labels)
+    num_labels = numpy.concatenate(self._num_labels)
+    blocks = numpy.concatenate(self._blocks)
+
+    order = numpy.argsort(-predictions, axis=None, kind="mergesort")
+    positives = labels.ravel()[order]
+    precisions = (numpy.cumsum(positives) /
+                  numpy.arange(1.0, len(positives) + 1))
+    videos = order // predictions.shape[1]
+    contributions = numpy.bincount(videos, weights=positives * precisions,
+                                   minlength=len(blocks))
+    _, blocks = numpy.unique(blocks, return_inverse=True)
+    return (numpy.bincount(blocks, weights=contributions),
+            numpy.bincount(blocks, weights=num_labels))
+
+  def get_replicates(self, num_resamples=1000, seed=0):
+    """Returns the GAP and its bootstrap replicates.
+
+    Args:
+      num_resamples: How many resamples of the blocks of videos.
+      seed: The seed of the resamples. The replicates of a seed can be paired
+        with the ones of other candidates.
+
+    Returns:
+      A tuple of the GAP and a numpy array of num_resamples replicates.
+
+    Raises:
+      ValueError: If no examples were accumulated.
+    """
+    if not self._predictions:
+      raise ValueError("total_sample must be positive.")
+    contributions, num_labels = self.get_contributions()
+    # how many times every block is drawn in every resample
+    num_blocks = len(contributions)
+    draws = numpy.random.RandomState(seed).randint(
+        num_blocks, size=[num_resamples, num_blocks])
+    draws += numpy.arange(num_resamples)[:, numpy.newaxis] * num_blocks
+    weights = numpy.bincount(draws.ravel(),
+                             minlength=num_resamples * num_blocks).reshape(
+                                 [num_resamples, num_blocks]).astype(
+                                     numpy.float64)
+    replicates = (weights.dot(contributions) /
+                  numpy.maximum(weights.dot(num_labels), 1.0))
+    gap = numpy.sum(contributions) / max(numpy.sum(num_labels), 1.0)
+    return gap, replicates
+
+  def clear(self):
+    """Clears the accumulated predictions."""
+    self._predictions = []
+    self._labels = []
+    self._num_labels = []
+    self._blocks = []
+
+
+def bootstrap_interval(replicates, confidence=0.95):
+  """Returns the percentile interval of bootstrap replicates.
+
+  Args:
+    replicates: A numpy array of the bootstrap replicates of a metric.
+    confidence: The probability covered by the interval.
+
+  Returns:
+    A tuple of the lower and upper bounds.
+  """
+  alpha = 100 * (1.0 - confidence) / 2
+  lower, upper = numpy.percentile(replicates, [alpha, 100 - alpha])
+  return lower, upper
+
+
+def paired_bootstrap_interval(replicates, other_replicates, confidence=0.95):
+  """Returns the interval of the difference of two paired metrics.
+
+  Args:
+    replicates: The bootstrap replicates of a candidate.
+    other_replicates: The replicates of another candidate, on the same
+      resamples (see GapBootstrap).
+    confidence: The probability covered by the interval.
+
+  Returns:
+    A tuple of the lower and upper bounds of replicates - other_replicates.
+    The first candidate is significantly better when the lower bound is
+    positive.
+  """
+  return bootstrap_interval(numpy.asarray(replicates) -
+                            numpy.asarray(other_replicates), confidence)
+
+
+class AsyncEvaluationMetrics(object):
+  """Accumulates the batches of an EvaluationMetrics in a worker thread.
+
+  accumulate() hands a batch over to the worker and returns at once, unless
+  max_pending batches are already waiting, so that the next batch is inferred
+  while the metrics of the previous ones are computed. The worker accumulates
+  the batches in order, so the metrics are the same as those of the
+  EvaluationMetrics alone.
+  """
+
+  def __init__(self, evl_metrics, max_pending=2):
+    """Construct an AsyncEvaluationMetrics object.
+
+    Args:
+      evl_metrics: The EvaluationMetrics object owned by the worker.
+      max_pending: How many batches may wait for the worker. If 0, the
+        batches are accumulated synchronously, without a worker.
+    """
+    self.evl_metrics = evl_metrics
+    self.max_pending = max_pending
+    self.finished = Queue.Queue()
+    self.error = None
+    self.num_batches = 0
+    self.wait_seconds = {}
+    if max_pending > 0:
+      self.pending = Queue.Queue(max_pending)
+      self.worker = threading.Thread(target=self._run)
+      self.worker.daemon = True
+      self.worker.start()
+
+  def _accumulate(self, batch_index, predictions, labels, loss, info):
+    start_time = time.time()
+    iteration_info_dict = self.evl_metrics.accumulate(predictions, labels, loss)
+    iteration_info_dict["accumulate_seconds"] = time.time() - start_time
+    iteration_info_dict["batch_index"] = batch_index
+    iteration_info_dict.update(info or {})
+    self.finished.put(iteration_info_dict)
+
+  def _run(self):
+    while True:
+      batch = self.pending.get()
+      try:
+        if batch is None:
+          return
+        if self.error is None:
+          self._accumulate(*batch)
+      except Exception as e:  # pylint: disable=broad-except
+        self.error = e
+      finally:
+        self.pending.task_done()
+
+  def _check_error(self):
+    if self.error is not None:
+      error, self.error = self.error, None
+      raise error
+
+  def accumulate(self, predictions, labels, loss, info=None):
+    """Accumulates the metrics of a mini-batch, in the worker.
+
+    Args:
+      predictions: A numpy matrix containing the outputs of the model.
+        Dimensions are 'batch' x 'num_classes'.
+      labels: A numpy matrix containing the ground truth labels.
+        Dimensions are 'batch' x 'num_classes'.
+      loss: A numpy array containing the loss for each sample.
+      info: An optional dictionary added to the iteration_info_dict of the
+        batch.
+    """
+    self._check_error()
+    batch = (self.num_batches, predictions, labels, loss, info)
+    start_time = time.time()
+    if self.max_pending > 0:
+      self.pending.put(batch)
+    else:
+      self._accumulate(*batch)
+    self.wait_seconds[self.num_batches] = time.time() - start_time
+    self.num_batches += 1
+
+  def wait(self):
+    """Waits for the worker to accumulate every batch handed over."""
+    if self.max_pending > 0:
+      self.pending.join()
+    self._check_error()
+
+  def pop_finished(self, wait=False):
+    """Returns the iteration_info_dict of the batches accumulated since.
+
+    Besides the metrics of the mini-batch, it has the seconds the worker took
+    to accumulate the batch (accumulate_seconds), the seconds accumulate()
+    was blocked handing it over (wait_seconds), and the fraction of the first
+    that did not block (overlap).
+
+    Args:
+      wait: Whether to wait for the batches handed over but not accumulated.
+    """
+    if wait:
+      self.wait()
+    iteration_info_dicts = []
+    while True:
+      try:
+        iteration_info_dict = self.finished.get_nowait()
+      except Queue.Empty:
+        break
+      wait_seconds = self.wait_seconds.pop(iteration_info_dict["batch_index"])
+      accumulate_seconds = iteration_info_dict["accumulate_seconds"]
+      iteration_info_dict["wait_seconds"] = wait_seconds
+      iteration_info_dict["overlap"] = max(
+          0.0, 1.0 - wait_seconds / max(accumulate_seconds, 1e-9))
+      iteration_info_dicts.append(iteration_info_dict)
+    return iteration_info_dicts
+
+  def get(self):
+    """Waits for the pending batches and returns EvaluationMetrics.get()."""
+    self.wait()
+    return self.evl_metrics.get()
+
+  def clear(self):
+    """Waits for the pending batches and clears the evaluation metrics."""
+    self.wait()
+    self.pop_finished()
+    self.evl_metrics.clear()
+
+  def close(self):
+    """Stops the worker once the pending batches are accumulated."""
+    if self.max_pending > 0 and self.worker.is_alive():
+      self.pending.put(None)
+      self.worker.join()
@@ -0,0 +1,207 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for eval_util, against the loops it replaces."""
+
+import numpy as np
+import tensorflow as tf
+
+from average_precision_calculator_test import HeapAveragePrecisionCalculator
+from average_precision_calculator_test import loop_ap_at_n
+import eval_util
+
+
+def loop_top_k_hits(predictions, actuals, k):
+  """The per-row loop of the former recall@n and PERR."""
+  hits = []
+  for row in np.arange(actuals.shape[0]):
+    top_indices = np.argpartition(predictions[row], -k[row])[-k[row]:]
+    hit = 0.0
+    for label_index in top_indices:
+      if predictions[row][label_index] > 0:
+        hit += actuals[row][label_index]
+    hits.append(hit)
+  return np.array(hits)
+
+
+def loop_recall_at_n(predictions, actuals, n):
+  """The former calculate_recall_at_n."""
+  aggregated_recall = 0.0
+  num_videos = actuals.shape[0]
+  hits = loop_top_k_hits(predictions, actuals, [n] * num_videos)
+  for row in np.arange(num_videos):
+    aggregated_recall += hits[row] / int(np.sum(actuals[row]))
+  return aggregated_recall / num_videos
+
+
+def loop_precision_at_equal_recall_rate(predictions, actuals):
+  """The former calculate_precision_at_equal_recall_rate."""
+  aggregated_precision = 0.0
+  num_videos = actuals.shape[0]
+  num_labels = [int(np.sum(actuals[row])) for row in range(num_videos)]
+  hits = loop_top_k_hits(predictions, actuals, num_labels)
+  for row in np.arange(num_videos):
+    if num_labels[row] > 0:
+      aggregated_precision += hits[row] / num_labels[row]
+  return aggregated_precision / num_videos
+
+
+def loop_top_k_by_class(predictions, labels, k=20):
+  """The former top_k_by_class."""
+  num_classes = predictions.shape[1]
+  out_predictions = [[] for _ in range(num_classes)]
+  out_labels = [[] for _ in range(num_classes)]
+  for video_index in range(predictions.shape[0]):
+    indices = np.argpartition(predictions[video_index], -k)[-k:]
+    for index in indices:
+      out_predictions[index].append(predictions[video_index][index])
+      out_labels[index].append(labels[video_index][index])
+  return out_predictions, out_labels
+
+
+class EvalUtilTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.random = np.random.RandomState(0)
+    self.num_classes = 500
+
+  def data(self, num_videos, num_values=None, label_rate=0.01):
+    """Returns predictions, tied if num_values is set, and their labels."""
+    predictions = self.random.rand(num_videos, self.num_classes) ** 4
+    if num_values:
+      predictions = np.round(predictions * num_values) / num_values
+    predictions = predictions.astype(np.float32)
+    labels = (self.random.rand(num_videos, self.num_classes) <
+              label_rate).astype(np.float32)
+    labels[:, 0] = 1
+    # some labels among the top predictions
+    labels[np.arange(num_videos),
+           np.argmax(predictions, axis=1)] = self.random.rand(num_videos) < 0.5
+    return predictions, labels
+
+  def testTopKHitsMatchesLoop(self):
+    for num_values in [None, 5, 50]:
+      predictions, labels = self.data(200, num_values)
+      for k in [1, 3, 20, 100]:
+        k = np.full([200], k, dtype=np.int64)
+        hits, _ = eval_util._top_k_hits(predictions, labels, k)
+        self.assertAllEqual(hits, loop_top_k_hits(predictions, labels, k))
+      num_labels = np.sum(labels, axis=1).astype(np.int64)
+      hits, label_sums = eval_util._top_k_hits(predictions, labels)
+      self.assertAllEqual(label_sums, num_labels)
+      self.assertAllEqual(hits,
+                          loop_top_k_hits(predictions, labels, num_labels))
+
+  def testDenselyLabelledRow(self):
+    predictions, labels = self.data(60)
+    labels[7] = 1
+    self.assertAlmostEqual(
+        eval_util.calculate_precision_at_equal_recall_rate(predictions, labels),
+        loop_precision_at_equal_recall_rate(predictions, labels))
+
+  def testRecallAtN(self):
+    for num_values in [None, 5]:
+      predictions, labels = self.data(200, num_values)
+      for n in [1, 20]:
+        self.assertAlmostEqual(
+            eval_util.calculate_recall_at_n(predictions, labels, n),
+            loop_recall_at_n(predictions, labels, n))
+
+  def testPrecisionAtEqualRecallRate(self):
+    for num_values in [None, 5]:
+      predictions, labels = self.data(200, num_values)
+      labels[3] = 0  # a video without labels
+      self.assertAlmostEqual(
+          eval_util.calculate_precision_at_equal_recall_rate(predictions,
+                                                             labels),
+          loop_precision_at_equal_recall_rate(predictions, labels))
+
+  def testHitAtOne(self):
+    predictions, labels = self.data(200, 5)
+    expected = np.mean([labels[row, np.argmax(predictions[row])]
+                        for row in range(200)])
+    self.assertAlmostEqual(
+        eval_util.calculate_hit_at_one(predictions, labels), expected)
+
+  def testTopKByClassMatchesLoop(self):
+    predictions, labels = self.data(100, 5)
+    out_predictions, out_labels, _ = eval_util.top_k_by_class(predictions,
+                                                              labels, 20)
+    loop_predictions, loop_labels = loop_top_k_by_class(predictions, labels,
+                                                        20)
+    for i in range(self.num_classes):
+      self.assertAllEqual(out_predictions[i], loop_predictions[i])
+      self.assertAllEqual(out_labels[i], loop_labels[i])
+
+  def testGap(self):
+    for num_values in [None, 5]:
+      predictions, labels = self.data(200, num_values)
+      loop_predictions, loop_labels = loop_top_k_by_class(predictions, labels,
+                                                          20)
+      flat_predictions = np.concatenate(loop_predictions)
+      flat_labels = np.concatenate(loop_labels)
+      gap = eval_util.calculate_gap(predictions, labels, 20)
+      if num_values is None:
+        heap = HeapAveragePrecisionCalculator()
+        heap.accumulate(flat_predictions, flat_labels, np.sum(labels))
+        self.assertAlmostEqual(gap, heap.peek_ap_at_n())
+      # the ties are ranked in the order of the predictions by class
+      self.assertAlmostEqual(gap, loop_ap_at_n(
+          flat_predictions, flat_labels, n=None,
+          total_num_positives=np.sum(labels)))
+
+  def testGapBootstrapMatchesEvaluationMetrics(self):
+    metrics = eval_util.EvaluationMetrics(self.num_classes, 20)
+    bootstrap = eval_util.GapBootstrap(20)
+    for batch in range(4):
+      predictions, labels = self.data(100)
+      video_ids = ["video%d_%d" % (batch, i) for i in range(100)]
+      metrics.accumulate(predictions, labels, np.zeros([100]))
+      bootstrap.accumulate(video_ids, predictions, labels)
+    gap, replicates = bootstrap.get_replicates(200)
+    self.assertAlmostEqual(gap, metrics.get()["gap"])
+    self.assertEqual(replicates.shape, (200,))
+    lower, upper = eval_util.bootstrap_interval(replicates)
+    self.assertTrue(lower < gap < upper)
+
+  def testGapBootstrapPairsTheVideos(self):
+    predictions, labels = self.data(300)
+    other_predictions = predictions + self.random.rand(
+        *predictions.shape).astype(np.float32) * 0.1
+    video_ids = ["video%d" % i for i in range(300)]
+    order = self.random.permutation(300)
+
+    bootstraps = [eval_util.GapBootstrap(20) for _ in range(3)]
+    bootstraps[0].accumulate(video_ids, predictions, labels)
+    # the same videos in another order and batches
+    for rows in np.array_split(order, 3):
+      bootstraps[1].accumulate([video_ids[i] for i in rows],
+                               predictions[rows], labels[rows])
+    bootstraps[2].accumulate(video_ids, other_predictions, labels)
+    gap, replicates = bootstraps[0].get_replicates(100, seed=1)
+    shuffled_gap, shuffled_replicates = bootstraps[1].get_replicates(100,
+                                                                     seed=1)
+    # up to the order of the sums
+    self.assertAllClose(gap, shuffled_gap, rtol=1e-5)
+    self.assertAllClose(replicates, shuffled_replicates, rtol=1e-5)
+
+    other_gap, other_replicates = bootstraps[2].get_replicates(100, seed=1)
+    lower, upper = eval_util.paired_bootstrap_interval(replicates,
+                                                       other_replicates)
+    self.assertTrue(lower <= gap - other_gap <= upper)
+    self.assertEqual(eval_util.paired_bootstrap_interval(replicates,
+                                                         replicates), (0, 0))
+
+
+if __name__ == "__main__":
+  tf.test.main()
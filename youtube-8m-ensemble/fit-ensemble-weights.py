@@ -0,0 +1,354 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for fitting the weights of the linear ensemble models in NumPy.
+
+LinearRegressionModel, MatrixRegressionModel and NonunitMatrixRegressionModel
+mix the predictions of their members with convex weights: one simplex vector
+for all the classes, or one per class. Instead of training them with the
+queues and the optimizer of train.py for several epochs, this binary streams
+the predictions of --train_data_patterns (read in lockstep, as train.py does)
+and accumulates their sufficient statistics, then solves for the weights:
+
+  LinearRegressionModel, MatrixRegressionModel: the least squares weights on
+    the simplex, from the Gram matrices of the member predictions of every
+    class (and their sum over the classes), in one pass.
+  NonunitMatrixRegressionModel: the cross entropy of a sigmoid of the convex
+    combination of the member logits is minimized by projected Newton steps,
+    one pass over the data each, from the Hessians and gradients of every
+    class at the current weights.
+
+The simplex constrained quadratic problems of all the classes are solved at
+once by accelerated projected gradient. The weights of a class are shrunk
+towards the weights shared by all the classes (the LinearRegressionModel
+solution of the same loss) by --shrinkage times the statistics of an average
+class, so that rare classes do not overfit.
+
+The weights are written as the variables of the model, as a model.ckpt-0 in
+--train_dir, to be loaded by inference-pre-ensemble.py, inference.py and
+eval.py with the same --model and member patterns.
+"""
+
+import itertools
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+
+import eval_util
+import prediction_files
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("train_dir", "",
+                      "The directory the checkpoint is written to.")
+  flags.DEFINE_string(
+      "train_data_patterns", "",
+      "Comma separated file globs of the predictions of the members, in the "
+      "order of the model input, as given to train.py.")
+  flags.DEFINE_string(
+      "eval_data_patterns", "",
+      "If set, the same for validation predictions, on which the GAP of the "
+      "fitted ensemble and of the mean of the members are logged.")
+  flags.DEFINE_string("model", "MatrixRegressionModel",
+                      "LinearRegressionModel, MatrixRegressionModel or "
+                      "NonunitMatrixRegressionModel.")
+  flags.DEFINE_string("feature_name", "predictions",
+                      "The feature of the Examples holding the predictions.")
+  flags.DEFINE_integer("num_classes", 4716, "Number of classes.")
+  flags.DEFINE_integer("batch_size", 256,
+                       "How many videos to read at a time. A batch takes "
+                       "4 x batch_size x classes x members bytes.")
+  flags.DEFINE_float("shrinkage", 0.01,
+                     "How many average classes the weights of every class "
+                     "are shrunk towards the shared weights with.")
+  flags.DEFINE_integer("num_passes", 3,
+                       "The number of Newton steps (passes over the data) of "
+                       "NonunitMatrixRegressionModel.")
+  flags.DEFINE_integer("solver_iterations", 300,
+                       "The number of iterations of the simplex solver.")
+  flags.DEFINE_float("epsilon", 1e-5,
+                     "The epsilon of the logits of "
+                     "NonunitMatrixRegressionModel, as in the model.")
+  flags.DEFINE_integer("top_k", 20, "The top_k of the GAP.")
+
+# the smallest weight, as the variables are its logarithm
+MIN_WEIGHT = 1e-8
+
+
+def rebatch(batches, batch_size):
+  """Yields the (video_ids, predictions, labels) of batches by batch_size.
+
+  The batches of prediction store files end with their files, unlike the
+  ones of tfrecords, so the members are re-batched to be read in lockstep.
+  """
+  buffered = []
+  num_rows = 0
+  for video_ids, predictions, labels in batches:
+    buffered.append((list(video_ids), np.array(predictions, dtype=np.float32),
+                     np.array(labels, dtype=np.float32)))
+    num_rows += len(video_ids)
+    while num_rows >= batch_size:
+      video_ids = sum([batch[0] for batch in buffered], [])
+      predictions = np.concatenate([batch[1] for batch in buffered])
+      labels = np.concatenate([batch[2] for batch in buffered])
+      yield (video_ids[:batch_size], predictions[:batch_size],
+             labels[:batch_size])
+      buffered = [(video_ids[batch_size:], predictions[batch_size:],
+                   labels[batch_size:])]
+      num_rows -= batch_size
+  if num_rows > 0:
+    yield (sum([batch[0] for batch in buffered], []),
+           np.concatenate([batch[1] for batch in buffered]),
+           np.concatenate([batch[2] for batch in buffered]))
+
+
+def get_member_batches(data_patterns, feature_name, num_classes, batch_size):
+  """Yields the predictions of the members in lockstep.
+
+  Yields:
+    Tuples of the batch x classes x members predictions and the batch x
+    classes labels (of the first member).
+
+  Raises:
+    ValueError: If the members do not have the same videos in the same
+      order.
+  """
+  all_batches = []
+  for data_pattern in data_patterns:
+    files = sorted(gfile.Glob(data_pattern))
+    if not files:
+      raise IOError("Unable to find the prediction files. data_pattern='" +
+                    data_pattern + "'.")
+    all_batches.append(rebatch(prediction_files.get_prediction_batches(
+        files, feature_name, num_classes, batch_size), batch_size))
+  for member_batches in itertools.izip_longest(*all_batches):
+    if (any(batch is None for batch in member_batches) or
+        len(set(len(batch[0]) for batch in member_batches)) > 1):
+      raise ValueError("The prediction files of the members do not have the "
+                       "same number of videos.")
+    video_ids = member_batches[0][0]
+    for other_video_ids, _, _ in member_batches[1:]:
+      if list(other_video_ids) != list(video_ids):
+        raise ValueError("The prediction files of the members are not in the "
+                         "same video order.")
+    predictions = np.stack([batch[1] for batch in member_batches], axis=2)
+    yield predictions, member_batches[0][2]
+
+
+def project_to_simplex(v):
+  """Returns the euclidean projections of the rows of v on the simplex."""
+  u = np.sort(v, axis=-1)[..., ::-1]
+  cumsum = np.cumsum(u, axis=-1) - 1
+  indices = np.arange(1, v.shape[-1] + 1)
+  rho = np.sum(u - cumsum / indices > 0, axis=-1) - 1
+  theta = np.take_along_axis(cumsum, rho[..., None], axis=-1) / (rho[..., None] + 1)
+  return np.maximum(v - theta, 0)
+
+
+def solve_simplex_qp(a, c, w, iterations):
+  """Minimizes 0.5 w'aw - c'w for w on the simplex, for every row.
+
+  Args:
+    a: problems x members x members positive semi-definite matrices.
+    c: problems x members vectors.
+    w: problems x members starting points on the simplex.
+    iterations: The number of iterations of the accelerated projected
+      gradient.
+
+  Returns:
+    The problems x members solutions.
+  """
+  lipschitz = np.maximum(np.linalg.eigvalsh(a)[:, -1], 1e-12)[:, None]
+  y = w
+  t = 1.0
+  for _ in range(iterations):
+    gradient = np.matmul(a, y[:, :, None])[:, :, 0] - c
+    next_w = project_to_simplex(y - gradient / lipschitz)
+    next_t = (1 + np.sqrt(1 + 4 * t * t)) / 2
+    y = next_w + (t - 1) / next_t * (next_w - w)
+    w, t = next_w, next_t
+  return w
+
+
+def get_logits(predictions, epsilon):
+  return np.log((epsilon + predictions) / (1.0 + epsilon - predictions))
+
+
+def fit_least_squares(data_patterns, num_classes, per_class):
+  """Returns the least squares weights of every class, or shared ones.
+
+  One pass accumulates the Gram matrix of the member predictions and their
+  products with the labels, for every class.
+  """
+  gram = None
+  for predictions, labels in get_member_batches(
+      data_patterns, FLAGS.feature_name, num_classes, FLAGS.batch_size):
+    if gram is None:
+      num_members = predictions.shape[2]
+      gram = np.zeros([num_classes, num_members, num_members])
+      products = np.zeros([num_classes, num_members])
+    by_class = predictions.transpose(1, 0, 2)
+    gram += np.matmul(by_class.transpose(0, 2, 1), by_class)
+    products += np.einsum("bcm,bc->cm", predictions, labels)
+
+  uniform = np.ones([1, num_members]) / num_members
+  shared = solve_simplex_qp(gram.sum(axis=0)[None], products.sum(axis=0)[None],
+                            uniform, FLAGS.solver_iterations)
+  logging.info("shared weights: %s", shared[0])
+  if not per_class:
+    return shared[0]
+  prior = FLAGS.shrinkage * gram.mean(axis=0)
+  return solve_simplex_qp(gram + prior, products + np.dot(prior, shared[0]),
+                          np.tile(shared, [num_classes, 1]),
+                          FLAGS.solver_iterations)
+
+
+def fit_logistic(data_patterns, num_classes):
+  """Returns the weights of the member logits of every class.
+
+  Every pass over the data accumulates the Hessian and the gradient of the
+  cross entropy at the current weights of every class, and at the shared
+  weights, then takes a projected Newton step.
+  """
+  weights = None
+  for step in range(FLAGS.num_passes):
+    start_time = time.time()
+    hessian = None
+    for predictions, labels in get_member_batches(
+        data_patterns, FLAGS.feature_name, num_classes, FLAGS.batch_size):
+      if weights is None:
+        num_members = predictions.shape[2]
+        shared = np.ones([num_members]) / num_members
+        weights = np.tile(shared, [num_classes, 1])
+      if hessian is None:
+        hessian = np.zeros([num_classes, num_members, num_members])
+        gradient = np.zeros([num_classes, num_members])
+        shared_hessian = np.zeros([num_members, num_members])
+        shared_gradient = np.zeros([num_members])
+      logits = get_logits(predictions, FLAGS.epsilon)
+      by_class = logits.transpose(1, 0, 2)
+      # at the weights of every class
+      p = 1 / (1 + np.exp(-np.einsum("bcm,cm->bc", logits, weights)))
+      weighted = by_class * (p * (1 - p)).T[:, :, None]
+      hessian += np.matmul(weighted.transpose(0, 2, 1), by_class)
+      gradient += np.einsum("bcm,bc->cm", logits, p - labels)
+      # at the shared weights
+      p = 1 / (1 + np.exp(-np.dot(logits, shared)))
+      weighted = logits * (p * (1 - p))[:, :, None]
+      shared_hessian += np.tensordot(weighted, logits, axes=([0, 1], [0, 1]))
+      shared_gradient += np.einsum("bcm,bc->m", logits, p - labels)
+
+    shared = solve_simplex_qp(
+        shared_hessian[None],
+        (np.dot(shared_hessian, shared) - shared_gradient)[None],
+        shared[None], FLAGS.solver_iterations)[0]
+    prior = FLAGS.shrinkage * shared_hessian / num_classes
+    weights = solve_simplex_qp(
+        hessian + prior,
+        np.einsum("cmn,cn->cm", hessian, weights) - gradient +
+        np.dot(prior, shared),
+        weights, FLAGS.solver_iterations)
+    logging.info("Newton step %d in %.1fs, shared weights: %s", step + 1,
+                 time.time() - start_time, shared)
+  return weights
+
+
+def get_variables(model, weights, num_members):
+  """Returns the variables of the model, as (name, value) pairs.
+
+  The models take the softmax of their variables, so the variables are the
+  logarithms of the weights.
+  """
+  log_weights = np.log(np.maximum(weights, MIN_WEIGHT)).astype(np.float32)
+  if model == "LinearRegressionModel":
+    return [("ensemble_weight", log_weights)]
+  if model == "MatrixRegressionModel":
+    return [("ensemble_weight1d", np.ones([num_members], dtype=np.float32)),
+            ("ensemble_weight2d", log_weights)]
+  return [("ensemble_weight", log_weights)]
+
+
+def combine(model, predictions, weights):
+  """The predictions of the model with the weights, in NumPy."""
+  if model == "LinearRegressionModel":
+    return np.dot(predictions, weights)
+  if model == "MatrixRegressionModel":
+    return np.einsum("bcm,cm->bc", predictions, weights)
+  logits = get_logits(predictions, FLAGS.epsilon)
+  return 1 / (1 + np.exp(-np.einsum("bcm,cm->bc", logits, weights)))
+
+
+def write_checkpoint(train_dir, variables):
+  """Writes the variables and a global_step as model.ckpt-0."""
+  if not gfile.Exists(train_dir):
+    gfile.MakeDirs(train_dir)
+  with tf.Graph().as_default():
+    tf.Variable(0, trainable=False, name="global_step")
+    for name, value in variables:
+      tf.Variable(value, name=name)
+    saver = tf.train.Saver()
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      return saver.save(sess, os.path.join(train_dir, "model.ckpt"),
+                        global_step=0)
+
+
+def evaluate(model, weights, data_patterns, num_classes):
+  """Logs the GAP of the weights and of the mean of the members."""
+  fitted_metrics = eval_util.EvaluationMetrics(num_classes, FLAGS.top_k)
+  mean_metrics = eval_util.EvaluationMetrics(num_classes, FLAGS.top_k)
+  for predictions, labels in get_member_batches(
+      data_patterns, FLAGS.feature_name, num_classes, FLAGS.batch_size):
+    loss = np.zeros(len(labels))
+    fitted_metrics.accumulate(combine(model, predictions, weights), labels,
+                              loss)
+    mean_metrics.accumulate(predictions.mean(axis=2), labels, loss)
+  logging.info("GAP: %f fitted, %f mean of the members",
+               fitted_metrics.get()["gap"], mean_metrics.get()["gap"])
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  data_patterns = [pattern.strip() for pattern in
+                   FLAGS.train_data_patterns.strip().strip(",").split(",")]
+  start_time = time.time()
+  if FLAGS.model == "LinearRegressionModel":
+    weights = fit_least_squares(data_patterns, FLAGS.num_classes, False)
+  elif FLAGS.model == "MatrixRegressionModel":
+    weights = fit_least_squares(data_patterns, FLAGS.num_classes, True)
+  elif FLAGS.model == "NonunitMatrixRegressionModel":
+    weights = fit_logistic(data_patterns, FLAGS.num_classes)
+  else:
+    raise ValueError("Unable to fit the weights of " + FLAGS.model)
+  logging.info("Fitted %s in %.1fs", FLAGS.model, time.time() - start_time)
+
+  checkpoint = write_checkpoint(
+      FLAGS.train_dir, get_variables(FLAGS.model, weights, len(data_patterns)))
+  logging.info("Wrote %s", checkpoint)
+
+  if FLAGS.eval_data_patterns:
+    evaluate(FLAGS.model, weights,
+             [pattern.strip() for pattern in
+              FLAGS.eval_data_patterns.strip().strip(",").split(",")],
+             FLAGS.num_classes)
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,365 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for the greedy selection of a mean ensemble, in memory.
+
+It runs the search of model_selection_scripts/greedy-selection-mean_model.sh
+without a Tensorflow graph per candidate. The validation predictions of every
+model of --all_models_conf (a directory of --train_path) are read once into a
+models x videos x classes float16 matrix, aligned on the videos all the models
+have in common, and optionally memory-mapped from --prediction_cache.
+
+At every step, every model is added to every ensemble of the beam (the top
+ensembles of the previous step). Since the GAP only depends on the ranking of
+the predictions, a candidate is scored on the sum of the predictions of its
+members, which is the float32 running sum of its ensemble in the beam plus
+the predictions of the new member. The candidates are scored by --num_workers
+processes, forked after the running sums of the step are computed, so they
+share the matrix and the sums.
+
+Every step writes the same files as the shell loop in --model_path:
+len_<step>_models.conf (the candidates), len_<step>_models.log (the
+candidates and their "GAP = ..."), len_<step>_models.sorted.log and
+top_<step>_models.conf (the beam). With --score_cache, the candidates already
+scored on the same videos of --train_path by an earlier step or run are read
+from the cache instead of being scored again, and the hits and misses of
+every step are logged. Their scores are not shared with eval.py, which scores
+float32 predictions on all the videos of the members.
+"""
+
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+import tensorflow as tf
+
+import average_precision_calculator as ap_calculator
+import eval_util
+import prediction_files
+import score_cache
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string(
+      "train_path", "/Youtube-8M/model_predictions_for_selection/ensemble_train",
+      "The directory of the prediction directories of the models.")
+  flags.DEFINE_string("all_models_conf", "",
+                      "The file of the models to select from, one per line.")
+  flags.DEFINE_string("model_path", "",
+                      "The directory where the files of every step are written.")
+  flags.DEFINE_string(
+      "prediction_cache", "",
+      "If set, the local .npy file where the prediction matrix is "
+      "memory-mapped. It is reused by the next runs over the same models, "
+      "--train_path and --num_classes.")
+  flags.DEFINE_string("feature_name", "predictions",
+                      "The feature of the Examples holding the predictions.")
+  flags.DEFINE_integer("num_classes", 4716, "Number of classes.")
+  flags.DEFINE_integer("top_k", 20,
+                       "How many predictions per video are used for the GAP.")
+  flags.DEFINE_integer("beam_size", 2,
+                       "How many ensembles of a step are extended at the next.")
+  flags.DEFINE_integer("start_step", 1,
+                       "The first step. After 1, the beam is read from "
+                       "top_<start_step - 1>_models.conf in --model_path.")
+  flags.DEFINE_integer("num_steps", 30, "The last step.")
+  flags.DEFINE_integer("batch_size", 1024,
+                       "How many videos to score at a time.")
+  flags.DEFINE_integer("num_workers", 4,
+                       "How many processes score the candidates.")
+  flags.DEFINE_integer(
+      "bootstrap_resamples", 0,
+      "If positive, the candidates significantly worse than the best one by "
+      "a paired bootstrap of the GAP with this many resamples are not kept in "
+      "the beam, and the search stops when the best candidate is not "
+      "significantly better than the best of the previous step, as "
+      "get_top_k.py does.")
+  flags.DEFINE_float("bootstrap_confidence", 0.95,
+                     "The confidence of the bootstrap intervals.")
+  flags.DEFINE_string(
+      "score_cache", "",
+      "If set, the local sqlite file caching the scores of the candidates.")
+
+# set before the workers of a step are forked, and shared with them
+_predictions = None
+_labels = None
+_video_ids = None
+_running_sums = None
+
+
+def read_models(filename):
+  """Returns the models of a conf file, one model or ensemble per line."""
+  with gfile.Open(filename) as F:
+    return [line.strip() for line in F.readlines() if line.strip()]
+
+
+def load_predictions(models, train_path, feature_name, num_classes,
+                     batch_size, cache_file=""):
+  """Loads the predictions of the models, aligned on their common videos.
+
+  The cache file is reused when its index (cache_file + ".index.npz") exists
+  and was written for the same models, train_path and num_classes. Both files
+  are written under a temporary name and renamed, the index last, so that an
+  interrupted run leaves no index and the next run loads the predictions
+  again.
+
+  Returns:
+    A tuple of the models x videos x classes float16 predictions, the
+    videos x classes bool labels and the sorted video ids.
+  """
+  index_file = cache_file + ".index.npz"
+  if cache_file and os.path.exists(cache_file) and os.path.exists(index_file):
+    index = np.load(index_file)
+    if ("train_path" in index.files and
+        list(index["models"]) == list(models) and
+        str(index["train_path"]) == train_path and
+        int(index["num_classes"]) == num_classes):
+      logging.info("Memory-mapping the predictions from %s", cache_file)
+      return (np.load(cache_file, mmap_mode="r"), index["labels"],
+              index["video_ids"])
+  if cache_file and os.path.exists(index_file):
+    # the index must not outlive the predictions it was written for
+    os.remove(index_file)
+
+  all_files = []
+  video_ids = None
+  for model in models:
+    files = prediction_files.get_prediction_files(
+        os.path.join(train_path, model))
+    if not files:
+      raise IOError("Unable to find the predictions of " + model)
+    all_files.append(files)
+    model_video_ids = np.unique(prediction_files.get_video_ids(files))
+    if video_ids is None:
+      video_ids = model_video_ids
+    else:
+      video_ids = np.intersect1d(video_ids, model_video_ids)
+  logging.info("%d videos in common to the %d models", len(video_ids),
+               len(models))
+
+  shape = (len(models), len(video_ids), num_classes)
+  if cache_file:
+    predictions = np.lib.format.open_memmap(cache_file + ".tmp", mode="w+",
+                                            dtype=np.float16, shape=shape)
+  else:
+    predictions = np.zeros(shape, dtype=np.float16)
+  labels = np.zeros([len(video_ids), num_classes], dtype=np.bool_)
+  for index, (model, files) in enumerate(zip(models, all_files)):
+    start_time = time.time()
+    for batch_video_ids, batch_predictions, batch_labels in (
+        prediction_files.get_prediction_batches(
+            files, feature_name, num_classes, batch_size)):
+      batch_video_ids = np.array(batch_video_ids)
+      rows = np.minimum(np.searchsorted(video_ids, batch_video_ids),
+                        len(video_ids) - 1)
+      common = video_ids[rows] == batch_video_ids
+      predictions[index, rows[common]] = batch_predictions[common]
+      if index == 0:
+        labels[rows[common]] = batch_labels[common] > 0
+    logging.info("Loaded %s in %.1fs", model, time.time() - start_time)
+
+  if cache_file:
+    predictions.flush()
+    with open(index_file + ".tmp", "wb") as F:
+      np.savez(F, models=np.array(models), train_path=np.array(train_path),
+               num_classes=np.array(num_classes), labels=labels,
+               video_ids=video_ids)
+    os.rename(cache_file + ".tmp", cache_file)
+    os.rename(index_file + ".tmp", index_file)
+  return predictions, labels, video_ids
+
+
+def score_candidate(args):
+  """Returns the GAP of a candidate, and its bootstrap replicates (or None).
+
+  Args:
+    args: a tuple of the ensemble of the beam it extends (None at the first
+      step), the index of the new member, the top_k, the batch size and the
+      number of bootstrap resamples, so that it can be mapped by a
+      multiprocessing.Pool.
+  """
+  parent, model, top_k, batch_size, bootstrap_resamples = args
+  calculator = ap_calculator.AveragePrecisionCalculator()
+  gap_bootstrap = eval_util.GapBootstrap(top_k)
+  for start in range(0, _labels.shape[0], batch_size):
+    end = start + batch_size
+    predictions = _predictions[model, start:end].astype(np.float32)
+    if parent is not None:
+      predictions += _running_sums[parent][start:end]
+    labels = _labels[start:end]
+    # as EvaluationMetrics.accumulate
+    classes, top_predictions, top_labels = eval_util.top_k_by_video(
+        predictions, labels, top_k)
+    order = np.argsort(classes, axis=None, kind="mergesort")
+    calculator.accumulate(top_predictions.ravel()[order],
+                          top_labels.ravel()[order],
+                          np.count_nonzero(labels))
+    if bootstrap_resamples > 0:
+      gap_bootstrap.accumulate(_video_ids[start:end], predictions, labels)
+  replicates = None
+  if bootstrap_resamples > 0:
+    _, replicates = gap_bootstrap.get_replicates(bootstrap_resamples)
+  return calculator.peek_ap_at_n(), replicates
+
+
+def get_running_sum(members, predictions, running_sums):
+  """Returns the float32 sum of the predictions of the members (indices).
+
+  It is a running sum of the previous step plus the predictions of one
+  member, if the members but one are in running_sums.
+  """
+  for i, member in enumerate(members):
+    parent = tuple(sorted(members[:i] + members[i + 1:]))
+    if parent in running_sums:
+      return running_sums[parent] + predictions[member]
+  running_sum = np.zeros(predictions.shape[1:], dtype=np.float32)
+  for member in members:
+    running_sum += predictions[member]
+  return running_sum
+
+
+def get_beam(scores, beam_size, previous_best):
+  """Returns the beam of the scored candidates of a step.
+
+  With bootstrap replicates, the candidates significantly worse than the best
+  are left out, and the beam is empty when the best is not significantly
+  better than previous_best (a (gap, replicates) tuple, or None).
+  """
+  ranked = sorted(scores, key=lambda name: -scores[name][0])
+  best_gap, best_replicates = scores[ranked[0]]
+  if best_replicates is None:
+    return ranked[:beam_size]
+  confidence = FLAGS.bootstrap_confidence
+  if previous_best is not None and eval_util.paired_bootstrap_interval(
+      best_replicates, previous_best[1], confidence)[0] <= 0:
+    logging.info("%s is not significantly better than the previous step.",
+                 ranked[0])
+    return []
+  beam = []
+  for name in ranked[:beam_size]:
+    if eval_util.paired_bootstrap_interval(
+        best_replicates, scores[name][1], confidence)[0] > 0:
+      logging.info("%s is significantly worse than %s, not extended.", name,
+                   ranked[0])
+      continue
+    beam.append(name)
+  return beam
+
+
+def main(unused_argv):
+  global _predictions, _labels, _video_ids, _running_sums
+  logging.set_verbosity(tf.logging.INFO)
+  all_models = read_models(FLAGS.all_models_conf)
+  model_indices = dict((model, index) for index, model in enumerate(all_models))
+  _predictions, _labels, _video_ids = load_predictions(
+      all_models, FLAGS.train_path, FLAGS.feature_name, FLAGS.num_classes,
+      FLAGS.batch_size, FLAGS.prediction_cache)
+
+  if FLAGS.start_step > 1:
+    beam = read_models(os.path.join(
+        FLAGS.model_path, "top_%d_models.conf" % (FLAGS.start_step - 1)))
+  else:
+    beam = []
+  _running_sums = {}
+  previous_best = None
+  cache = None
+  if FLAGS.score_cache:
+    # the sums of float16 predictions, on the videos common to all_models
+    cache = score_cache.ScoreCache(FLAGS.score_cache,
+                                   FLAGS.train_path.rstrip("/"),
+                                   "greedy-mean-float16",
+                                   score_cache.fingerprint(_video_ids))
+
+  for step in range(FLAGS.start_step, FLAGS.num_steps + 1):
+    start_time = time.time()
+    # the running sums of the beam, indexed by sorted member indices
+    running_sums = {}
+    for ensemble in beam:
+      members = [model_indices[model] for model in ensemble.split(",")]
+      running_sums[tuple(sorted(members))] = get_running_sum(
+          members, _predictions, _running_sums)
+    _running_sums = running_sums
+
+    # the candidates, by sorted names as get_extend_candidates.py
+    tasks = {}
+    if step == 1:
+      for model in all_models:
+        tasks[model] = (None, model_indices[model])
+    for ensemble in beam:
+      members = ensemble.split(",")
+      parent = tuple(sorted(model_indices[model] for model in members))
+      for model in all_models:
+        if model not in members:
+          name = ",".join(sorted(members + [model]))
+          tasks.setdefault(name, (parent, model_indices[model]))
+    names = sorted(tasks)
+    if not names:
+      break
+    scores = {}
+    if cache is not None:
+      cache.reset_counts()
+      for name in names:
+        score = cache.get(name.split(","), FLAGS.top_k,
+                          FLAGS.bootstrap_resamples)
+        if score is not None:
+          scores[name] = score
+    missing = [name for name in names if name not in scores]
+    args = [tasks[name] + (FLAGS.top_k, FLAGS.batch_size,
+                           FLAGS.bootstrap_resamples) for name in missing]
+    num_workers = min(FLAGS.num_workers, len(args))
+    if num_workers > 1:
+      pool = multiprocessing.Pool(num_workers)
+      results = pool.map(score_candidate, args, chunksize=1)
+      pool.close()
+      pool.join()
+    else:
+      results = map(score_candidate, args)
+    for name, (gap, replicates) in zip(missing, results):
+      scores[name] = (gap, replicates)
+      if cache is not None:
+        cache.put(name.split(","), FLAGS.top_k, gap, replicates)
+    if cache is not None:
+      logging.info("step %d: score cache %d hits, %d misses", step,
+                   cache.hits, cache.misses)
+
+    prefix = os.path.join(FLAGS.model_path, "len_%d_models" % step)
+    with gfile.Open(prefix + ".conf", "w") as F:
+      F.write("".join("%s\n" % name for name in names))
+    with gfile.Open(prefix + ".log", "w") as F:
+      F.write("".join("%s\nGAP = %f\n" % (name, scores[name][0])
+                      for name in names))
+    ranked = sorted(names, key=lambda name: -scores[name][0])
+    with gfile.Open(prefix + ".sorted.log", "w") as F:
+      F.write("".join("%f\t%s\n" % (scores[name][0], name)
+                      for name in ranked))
+
+    beam = get_beam(scores, FLAGS.beam_size, previous_best)
+    with gfile.Open(os.path.join(FLAGS.model_path,
+                                 "top_%d_models.conf" % step), "w") as F:
+      F.write("".join("%s\n" % name for name in beam))
+    logging.info("step %d: %d candidates in %.1fs, best GAP %f: %s", step,
+                 len(names), time.time() - start_time, scores[ranked[0]][0],
+                 ranked[0])
+    if not beam:
+      break
+    previous_best = scores[ranked[0]]
+
+
+if __name__ == "__main__":
+  app.run()
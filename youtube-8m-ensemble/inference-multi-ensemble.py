@@ -0,0 +1,318 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for the inference of several ensembles in a single pass.
+
+Every infer-*.sh script of ensemble_scripts runs inference.py for one
+ensemble, which reads the predictions of all its members again. This binary
+builds the ensembles of --ensembles_conf side by side in one graph, each under
+its own variable scope, reads the predictions of every member once, whatever
+the number of ensembles using it, and writes the predictions of every
+ensemble to its own file, in the format of inference.py.
+
+Every line of --ensembles_conf is an ensemble, as space separated key=value
+pairs:
+  model: The class of the ensemble model, e.g. AttentionMatrixModel.
+  checkpoint: The checkpoint of the ensemble, e.g. ../model/x/model.ckpt-100.
+  members: The conf file of its member models, one per line, as given to the
+    infer-*.sh scripts. As these scripts, the prediction directories of the
+    members (in --input_path) are given to the model in reverse order.
+  output_file: The file the predictions are written to.
+Every other key is a model flag set while the ensemble is built, e.g.
+moe_num_mixtures=4 attention_matrix_rank=8; the other flags are those of the
+command line. Lines starting with '#' are ignored.
+"""
+
+import time
+
+import ensemble_level_models
+import inference
+import readers
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+import utils
+import video_id_join
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("ensembles_conf", "",
+                      "The file of the ensembles, one per line.")
+  flags.DEFINE_string("input_path", "/Youtube-8M/model_predictions/test",
+                      "The directory of the prediction directories of the "
+                      "member models.")
+  flags.DEFINE_string("input_file_pattern", "*.tfrecord",
+                      "The pattern of the prediction files in a directory.")
+  flags.DEFINE_string(
+      "input_data_pattern", None,
+      "File globs for original model input.")
+  flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
+                      "to use for training.")
+  flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_boolean(
+      "join_by_video_id", False,
+      "If set, the data patterns (and input_data_pattern) are joined on their "
+      "common video ids instead of being read in lockstep. It fails if some "
+      "videos are not in every source, see --allow_missing_videos.")
+  flags.DEFINE_boolean(
+      "allow_missing_videos", False,
+      "If set with --join_by_video_id, the videos that are not in every "
+      "source are left out of the predictions instead of failing.")
+  flags.DEFINE_integer("batch_size", 256,
+                       "How many examples to process per batch.")
+  flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+
+ENSEMBLE_KEYS = ("model", "checkpoint", "members", "output_file")
+
+
+def parse_flag_value(name, value):
+  """Converts a string to the type of the flag name."""
+  if not hasattr(FLAGS, name):
+    raise ValueError("Unknown flag in ensembles_conf: " + name)
+  default = getattr(FLAGS, name)
+  if isinstance(default, bool):
+    return value.lower() in ("true", "1")
+  if isinstance(default, int):
+    return int(value)
+  if isinstance(default, float):
+    return float(value)
+  return value
+
+
+def read_ensembles(filename):
+  """Returns the ensembles of a conf file, as dicts.
+
+  Every dict has the keys of ENSEMBLE_KEYS, with the members as a list in the
+  order of the model input, and a "flags" dict of the flags to set.
+  """
+  ensembles = []
+  with gfile.Open(filename) as F:
+    for line in F.readlines():
+      line = line.strip()
+      if not line or line.startswith("#"):
+        continue
+      ensemble = {"flags": {}}
+      for pair in line.split():
+        if "=" not in pair:
+          raise ValueError("Not a key=value pair in ensembles_conf: " + pair)
+        key, value = pair.split("=", 1)
+        if key in ENSEMBLE_KEYS:
+          ensemble[key] = value
+        else:
+          ensemble["flags"][key] = parse_flag_value(key, value)
+      for key in ENSEMBLE_KEYS:
+        if key not in ensemble:
+          raise ValueError("No %s in ensembles_conf line: %s" % (key, line))
+      with gfile.Open(ensemble["members"]) as M:
+        members = [member.strip() for member in M.readlines() if member.strip()]
+      ensemble["members"] = members[::-1]
+      ensembles.append(ensemble)
+  if not ensembles:
+    raise IOError("No ensemble in " + filename)
+  return ensembles
+
+
+def get_member_inputs(members, all_readers, all_data_patterns,
+                      input_reader, input_data_pattern, batch_size):
+  """Creates the input section of the graph, one source per member.
+
+  Returns:
+    A tuple of the video_id batch, a dict of the batch x classes x 1 input
+    of every member, the labels batch (of the first member, as
+    inference.build_graph) and the original input batch (or None).
+  """
+  if FLAGS.join_by_video_id:
+    video_id_batch, all_model_input_raw, labels_batch, original_input = (
+        video_id_join.get_joined_input_tensors(
+            all_readers,
+            all_data_patterns,
+            input_reader=input_reader,
+            input_data_pattern=input_data_pattern,
+            batch_size=batch_size,
+            num_epochs=1,
+            allow_missing_videos=FLAGS.allow_missing_videos))
+  else:
+    all_model_input_raw = []
+    labels_batch = None
+    video_id_batch = None
+    for reader, data_pattern in zip(all_readers, all_data_patterns):
+      unused_video_id, model_input_raw, member_labels, unused_num_frames = (
+          inference.get_input_data_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size))
+      if labels_batch is None:
+        labels_batch = member_labels
+      if video_id_batch is None:
+        video_id_batch = unused_video_id
+      all_model_input_raw.append(model_input_raw)
+
+    original_input = None
+    if input_data_pattern is not None:
+      unused_video_id, original_input, unused_labels, unused_num_frames = (
+          inference.get_input_data_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size))
+
+  member_inputs = dict(
+      (member, tf.expand_dims(model_input_raw, axis=2))
+      for member, model_input_raw in zip(members, all_model_input_raw))
+  return video_id_batch, member_inputs, labels_batch, original_input
+
+
+def build_ensemble(scope, ensemble, member_inputs, labels_batch,
+                   original_input, num_classes):
+  """Builds an ensemble in its variable scope.
+
+  The flags of the ensemble are set while its model is built, as the models
+  read them in create_model, and restored afterwards.
+
+  Returns:
+    A tuple of the predictions and the saver restoring its checkpoint, or
+    None when the model has no variables (e.g. MeanModel).
+  """
+  model = inference.find_class_by_name(ensemble["model"],
+                                       [ensemble_level_models])()
+  model_input = tf.concat(
+      [member_inputs[member] for member in ensemble["members"]], axis=2)
+  saved_flags = dict((name, getattr(FLAGS, name))
+                     for name in ensemble["flags"])
+  for name, value in ensemble["flags"].items():
+    setattr(FLAGS, name, value)
+  try:
+    with tf.variable_scope(scope):
+      with tf.name_scope("model"):
+        result = model.create_model(model_input,
+                                    labels=labels_batch,
+                                    vocab_size=num_classes,
+                                    original_input=original_input,
+                                    is_training=False)
+  finally:
+    for name, value in saved_flags.items():
+      setattr(FLAGS, name, value)
+
+  # the variables as named in the checkpoint, i.e. without the scope
+  prefix = scope + "/"
+  var_list = dict(
+      (variable.op.name[len(prefix):], variable)
+      for variable in tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+      if variable.op.name.startswith(prefix))
+  saver = tf.train.Saver(var_list) if var_list else None
+  return result["predictions"], saver
+
+
+def inference_loop(video_id_batch, prediction_batches, savers, ensembles):
+  top_k = FLAGS.top_k
+  with tf.Session() as sess:
+    for saver, ensemble in zip(savers, ensembles):
+      if saver is not None:
+        logging.info("Loading checkpoint for eval: " + ensemble["checkpoint"])
+        saver.restore(sess, ensemble["checkpoint"])
+
+    sess.run([tf.local_variables_initializer()])
+
+    out_files = [gfile.Open(ensemble["output_file"], "w+")
+                 for ensemble in ensembles]
+    for out_file in out_files:
+      out_file.write("VideoId,LabelConfidencePairs\n")
+
+    # Start the queue runners.
+    fetches = [video_id_batch] + prediction_batches
+    coord = tf.train.Coordinator()
+    try:
+      threads = []
+      for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
+        threads.extend(qr.create_threads(
+            sess, coord=coord, daemon=True,
+            start=True))
+
+      num_examples_processed = 0
+      start_time = time.time()
+
+      while not coord.should_stop():
+        values = sess.run(fetches)
+        video_id_val = values[0]
+
+        now = time.time()
+        num_examples_processed += len(video_id_val)
+        logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
+        for out_file, predictions_val in zip(out_files, values[1:]):
+          for line in inference.format_lines(video_id_val, predictions_val,
+                                             top_k):
+            out_file.write(line)
+          out_file.flush()
+
+    except tf.errors.OutOfRangeError as e:
+      logging.info("Done with inference. The output files were written to " +
+                   ", ".join(ensemble["output_file"] for ensemble in ensembles))
+    except Exception as e:  # pylint: disable=broad-except
+      logging.info("Unexpected exception: " + str(e))
+      coord.request_stop(e)
+    finally:
+      for out_file in out_files:
+        out_file.close()
+
+    coord.request_stop()
+    coord.join(threads, stop_grace_period_secs=10)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  ensembles = read_ensembles(FLAGS.ensembles_conf)
+  with tf.Graph().as_default():
+    feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
+        FLAGS.feature_names, FLAGS.feature_sizes)
+
+    # every member is read once, whatever the number of ensembles using it
+    members = sorted(set(member for ensemble in ensembles
+                         for member in ensemble["members"]))
+    all_data_patterns = ["%s/%s/%s" % (FLAGS.input_path, member,
+                                       FLAGS.input_file_pattern)
+                         for member in members]
+    all_readers = [readers.get_prediction_reader(
+        data_pattern, feature_names, feature_sizes)
+                   for data_pattern in all_data_patterns]
+    logging.info("%d ensembles of %d distinct models", len(ensembles),
+                 len(members))
+
+    input_reader = None
+    input_data_pattern = None
+    if FLAGS.input_data_pattern is not None:
+      input_reader = readers.EnsembleReader(
+          feature_names=["input"], feature_sizes=[1024+128])
+      input_data_pattern = FLAGS.input_data_pattern
+
+    video_id_batch, member_inputs, labels_batch, original_input = (
+        get_member_inputs(
+            members, all_readers, all_data_patterns, input_reader,
+            input_data_pattern, FLAGS.batch_size))
+
+    prediction_batches = []
+    savers = []
+    for index, ensemble in enumerate(ensembles):
+      predictions, saver = build_ensemble(
+          "ensemble_%d" % index, ensemble, member_inputs, labels_batch,
+          original_input, all_readers[0].num_classes)
+      prediction_batches.append(predictions)
+      savers.append(saver)
+    logging.info("built inference graph")
+
+    inference_loop(video_id_batch, prediction_batches, savers, ensembles)
+
+
+if __name__ == "__main__":
+  app.run()
@@ -26,8 +26,10 @@ from tensorflow import gfile
 from tensorflow import logging
 
 import utils
+import video_id_join
 import eval_util
 import losses
+import prediction_store
 import readers
 import ensemble_level_models
 
@@ -49,6 +51,15 @@ if __name__ == '__main__':
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_boolean(
+      "join_by_video_id", False,
+      "If set, the data patterns (and input_data_pattern) are joined on their "
+      "common video ids instead of being read in lockstep. It fails if some "
+      "videos are not in every source, see --allow_missing_videos.")
+  flags.DEFINE_boolean(
+      "allow_missing_videos", False,
+      "If set with --join_by_video_id, the videos that are not in every "
+      "source are left out of the predictions instead of failing.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -60,6 +71,15 @@ if __name__ == '__main__':
                       "Loss computed on validation data")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_string("output_format", "tfrecord",
+                      "Format of the prediction files, either tfrecord "
+                      "(tf.train.Example protos) or a prediction store "
+                      "dtype (float32, float16 or uint8), see "
+                      "prediction_store.py.")
+  flags.DEFINE_integer("output_top_k", 0,
+                       "If positive, prediction store files only hold the top "
+                       "k predictions of each video, the other classes are "
+                       "read as a floor value of the model.")
 
 def find_class_by_name(name, modules):
   """Searches the provided modules for the named class and returns it."""
@@ -107,28 +127,42 @@ def build_graph(all_readers,
 
   global_step = tf.Variable(0, trainable=False, name="global_step")
 
-  model_input_raw_tensors = []
-  labels_batch_tensor = None
-  video_id_batch = None
-  for reader, data_pattern in zip(all_readers, all_data_patterns):
-    unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            reader,
-            data_pattern,
-            batch_size=batch_size))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    if video_id_batch is None:
-      video_id_batch = unused_video_id
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-
-  original_input = None
-  if input_data_pattern is not None:
-    unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size))
+  if FLAGS.join_by_video_id:
+    video_id_batch, all_model_input_raw, labels_batch_tensor, original_input = (
+        video_id_join.get_joined_input_tensors(
+            all_readers,
+            all_data_patterns,
+            input_reader=input_reader,
+            input_data_pattern=input_data_pattern,
+            batch_size=batch_size,
+            num_epochs=1,
+            allow_missing_videos=FLAGS.allow_missing_videos))
+    model_input_raw_tensors = [tf.expand_dims(model_input_raw, axis=2)
+                               for model_input_raw in all_model_input_raw]
+    reader = all_readers[-1]
+  else:
+    model_input_raw_tensors = []
+    labels_batch_tensor = None
+    video_id_batch = None
+    for reader, data_pattern in zip(all_readers, all_data_patterns):
+      unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      if video_id_batch is None:
+        video_id_batch = unused_video_id
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
+
+    original_input = None
+    if input_data_pattern is not None:
+      unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size))
 
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
@@ -213,7 +247,8 @@ def inference_loop(video_id_batch, prediction_batch,
           video_ids = np.concatenate(video_ids, axis=0)
           video_labels = np.concatenate(video_labels, axis=0)
           video_features = np.concatenate(video_features, axis=0)
-          write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed)
+          write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed,
+                          checkpoint=checkpoint)
 
           video_ids = []
           video_labels = []
@@ -236,7 +271,8 @@ def inference_loop(video_id_batch, prediction_batch,
         video_ids = np.concatenate(video_ids, axis=0)
         video_labels = np.concatenate(video_labels, axis=0)
         video_features = np.concatenate(video_features, axis=0)
-        write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed)
+        write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed,
+                        checkpoint=checkpoint)
         total_num_examples_processed += num_examples_processed
 
         now = time.time()
@@ -251,8 +287,22 @@ def inference_loop(video_id_batch, prediction_batch,
 
     coord.join(threads, stop_grace_period_secs=10)
 
-
-def write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed):
+    if FLAGS.output_format != "tfrecord" and FLAGS.output_top_k:
+      # every file was written with the floor of its own rows
+      prediction_store.set_model_floor(gfile.Glob(
+          FLAGS.output_dir + "/*" + prediction_store.FILE_EXTENSION))
+
+
+def write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed,
+                    checkpoint=""):
+    if FLAGS.output_format != "tfrecord":
+        prediction_store.write_predictions(
+            FLAGS.output_dir + '/' + 'predictions-%04d' % filenum + prediction_store.FILE_EXTENSION,
+            video_ids[:num_examples_processed], video_labels[:num_examples_processed],
+            video_features[:num_examples_processed], dtype=FLAGS.output_format,
+            model=FLAGS.model, checkpoint=checkpoint,
+            top_k=FLAGS.output_top_k)
+        return
     writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
     for i in range(num_examples_processed):
         video_id = video_ids[i]
@@ -285,8 +335,8 @@ def main(unused_argv):
     all_patterns = FLAGS.input_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      reader = readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes)
+      reader = readers.get_prediction_reader(
+          all_patterns[i], feature_names, feature_sizes)
       all_readers.append(reader)
 
     input_reader = None
@@ -25,6 +25,7 @@ from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
 import utils
+import video_id_join
 
 FLAGS = flags.FLAGS
 
@@ -43,6 +44,15 @@ if __name__ == "__main__":
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_boolean(
+      "join_by_video_id", False,
+      "If set, the data patterns (and input_data_pattern) are joined on their "
+      "common video ids instead of being read in lockstep. It fails if some "
+      "videos are not in every source, see --allow_missing_videos.")
+  flags.DEFINE_boolean(
+      "allow_missing_videos", False,
+      "If set with --join_by_video_id, the videos that are not in every "
+      "source are left out of the predictions instead of failing.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -111,28 +121,42 @@ def build_graph(all_readers,
 
   global_step = tf.Variable(0, trainable=False, name="global_step")
 
-  model_input_raw_tensors = []
-  labels_batch_tensor = None
-  video_id_batch = None
-  for reader, data_pattern in zip(all_readers, all_data_patterns):
-    unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            reader,
-            data_pattern,
-            batch_size=batch_size))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    if video_id_batch is None:
-      video_id_batch = unused_video_id
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-
-  original_input = None
-  if input_data_pattern is not None:
-    unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size))
+  if FLAGS.join_by_video_id:
+    video_id_batch, all_model_input_raw, labels_batch_tensor, original_input = (
+        video_id_join.get_joined_input_tensors(
+            all_readers,
+            all_data_patterns,
+            input_reader=input_reader,
+            input_data_pattern=input_data_pattern,
+            batch_size=batch_size,
+            num_epochs=1,
+            allow_missing_videos=FLAGS.allow_missing_videos))
+    model_input_raw_tensors = [tf.expand_dims(model_input_raw, axis=2)
+                               for model_input_raw in all_model_input_raw]
+    reader = all_readers[-1]
+  else:
+    model_input_raw_tensors = []
+    labels_batch_tensor = None
+    video_id_batch = None
+    for reader, data_pattern in zip(all_readers, all_data_patterns):
+      unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      if video_id_batch is None:
+        video_id_batch = unused_video_id
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
+
+    original_input = None
+    if input_data_pattern is not None:
+      unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size))
 
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
@@ -219,8 +243,8 @@ def inference():
     all_patterns = FLAGS.input_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      reader = readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes)
+      reader = readers.get_prediction_reader(
+          all_patterns[i], feature_names, feature_sizes)
       all_readers.append(reader)
 
     input_reader = None
@@ -35,6 +35,15 @@ calculator = mean_average_precision_calculator.MeanAveragePrecisionCalculator(
 calculator.accumulate(p, a)
 aps = calculator.peek_map_at_n()
 ```
+
+The predictions of all the classes are kept in a single buffer of (class,
+prediction, actual) triplets, which accumulate_top_k fills directly from the
+top k classes of every video (see eval_util.top_k_by_video). The classes are
+only grouped when the aps are computed, and the aps are the ones the
+AveragePrecisionCalculator of every class would give. As its peek_ap_at_n,
+the tied predictions of a class are ranked in arrival order, not in the
+layout order of the heaps of the former per-class calculators, so the aps of
+the classes with tied positives and negatives may differ from theirs.
 """
 
 import numpy
@@ -50,23 +59,22 @@ class MeanAveragePrecisionCalculator(object):
 
     Args:
       num_class: A positive Integer specifying the number of classes.
-      top_n_array: A list of positive integers specifying the top n for each
-      class. The top n in each class will be used to calculate its average
-      precision at n.
-      The size of the array must be num_class.
 
     Raises:
-      ValueError: An error occurred when num_class is not a positive integer;
-      or the top_n_array is not a list of positive integers.
+      ValueError: An error occurred when num_class is not a positive integer.
     """
     if not isinstance(num_class, int) or num_class <= 1:
       raise ValueError("num_class must be a positive integer.")
 
-    self._ap_calculators = []  # member of AveragePrecisionCalculator
     self._num_class = num_class  # total number of classes
-    for i in range(num_class):
-      self._ap_calculators.append(
-          average_precision_calculator.AveragePrecisionCalculator())
+    # total number of positives have seen, for each class
+    self._total_positives = numpy.zeros([num_class], dtype=numpy.float64)
+    # accumulated (class, prediction, actual) triplets in arrival order, in
+    # buffers doubled when full
+    self._classes = numpy.zeros([0], dtype=numpy.int32)
+    self._predictions = numpy.zeros([0], dtype=numpy.bool_)
+    self._actuals = numpy.zeros([0], dtype=numpy.bool_)
+    self._size = 0
 
   def accumulate(self, predictions, actuals, num_positives=None):
     """Accumulate the predictions and their ground truth labels.
@@ -85,28 +93,191 @@ class MeanAveragePrecisionCalculator(object):
       ValueError: An error occurred when the shape of predictions and actuals
       does not match.
     """
-    if not num_positives:
-      num_positives = [None for i in predictions.shape[1]]
+    if len(predictions) != len(actuals):
+      raise ValueError("the shape of predictions and actuals does not match.")
+    lengths = [len(class_predictions) for class_predictions in predictions]
+    if lengths != [len(class_actuals) for class_actuals in actuals]:
+      raise ValueError("the shape of predictions and actuals does not match.")
+
+    classes = numpy.repeat(numpy.arange(len(predictions)), lengths)
+    predictions = numpy.concatenate(
+        [numpy.asarray(class_predictions) for class_predictions in predictions])
+    actuals = numpy.concatenate(
+        [numpy.asarray(class_actuals) for class_actuals in actuals])
+    if num_positives is not None:
+      num_positives = numpy.array([
+          numpy.count_nonzero(numpy.asarray(actuals_i) > 0) if n is None else n
+          for n, actuals_i in zip(num_positives, numpy.split(
+              actuals, numpy.cumsum(lengths)[:-1]))])
+    self._append(classes, predictions, actuals, num_positives)
+
+  def accumulate_top_k(self, classes, predictions, actuals, num_positives=None):
+    """Accumulate the top k predictions of a batch of videos.
+
+    Args:
+      classes: A numpy 'batch' x 'k' matrix of the classes of the predictions.
+      predictions: A numpy 'batch' x 'k' matrix storing the prediction scores.
+      actuals: A numpy 'batch' x 'k' matrix storing the ground truth labels of
+        the predictions. Any value larger than 0 will be treated as
+        positives, otherwise as negatives.
+      num_positives: If provided, a numpy array of the number of true
+        positives of the batch for each class, which may include positives
+        out of the top k. If not provided, the number of true positives will
+        be inferred from the 'actuals' array.
+
+    Raises:
+      ValueError: An error occurred when the shape of classes, predictions
+      and actuals does not match.
+    """
+    classes = numpy.asarray(classes)
+    predictions = numpy.asarray(predictions)
+    actuals = numpy.asarray(actuals)
+    if not classes.shape == predictions.shape == actuals.shape:
+      raise ValueError("the shape of predictions and actuals does not match.")
+    self._append(classes.ravel(), predictions.ravel(), actuals.ravel(),
+                 num_positives)
+
+  def _append(self, classes, predictions, actuals, num_positives):
+    """Appends triplets to the buffers and counts the positives."""
+    if num_positives is None:
+      num_positives = numpy.bincount(classes[actuals > 0],
+                                     minlength=self._num_class)
+    self._total_positives += num_positives
+
+    count = len(classes)
+    for name, values in [("_classes", classes),
+                         ("_predictions", predictions),
+                         ("_actuals", actuals)]:
+      buf = getattr(self, name)
+      # the buffers take a dtype holding every accumulated value
+      if name == "_classes":
+        dtype = buf.dtype
+      else:
+        dtype = numpy.promote_types(buf.dtype, values.dtype)
+      if self._size + count > len(buf) or dtype != buf.dtype:
+        capacity = len(buf)
+        if self._size + count > capacity:
+          capacity = max(2 * capacity, self._size + count)
+        new_buf = numpy.zeros([capacity], dtype=dtype)
+        new_buf[:self._size] = buf[:self._size]
+        setattr(self, name, new_buf)
+      getattr(self, name)[self._size:self._size + count] = values
+    self._size += count
+
+  def get_state(self):
+    """Gets the accumulated state, as a dict of numpy arrays.
+
+    It can be saved by numpy.savez, and restored by set_state.
+    """
+    return {"total_positives": self._total_positives.copy(),
+            "classes": self._classes[:self._size].copy(),
+            "predictions": self._predictions[:self._size].copy(),
+            "actuals": self._actuals[:self._size].copy()}
+
+  def set_state(self, state):
+    """Restores the state returned by get_state."""
+    self._num_class = len(state["total_positives"])
+    self._total_positives = numpy.zeros([self._num_class],
+                                        dtype=numpy.float64)
+    self.clear()
+    self._append(state["classes"], state["predictions"], state["actuals"],
+                 state["total_positives"])
 
-    calculators = self._ap_calculators
-    for i in range(len(predictions)):
-      calculators[i].accumulate(predictions[i], actuals[i], num_positives[i])
+  def merge(self, other):
+    """Merges the triplets accumulated by another calculator into this one.
+
+    The triplets of other are taken as accumulated after the ones of this
+    calculator, so merging the calculators of consecutive parts of the data in
+    order gives the same aps as accumulating all of it, and merges are
+    associative.
+
+    Raises:
+      ValueError: An error occurred when the calculators have a different
+        number of classes.
+    """
+    state = other.get_state()
+    if len(state["total_positives"]) != self._num_class:
+      raise ValueError("the calculators have a different number of classes.")
+    self._append(state["classes"], state["predictions"], state["actuals"],
+                 state["total_positives"])
 
   def clear(self):
-    for calculator in self._ap_calculators:
-      calculator.clear()
+    self._total_positives[:] = 0
+    self._classes = numpy.zeros([0], dtype=numpy.int32)
+    self._predictions = numpy.zeros([0], dtype=numpy.bool_)
+    self._actuals = numpy.zeros([0], dtype=numpy.bool_)
+    self._size = 0
 
   def is_empty(self):
-    return ([calculator.heap_size for calculator in self._ap_calculators] ==
-            [0 for _ in range(self._num_class)])
+    return self._size == 0
 
   def peek_map_at_n(self):
     """Peek the non-interpolated mean average precision at n.
 
+    All the triplets are ranked by class then by decreasing prediction in a
+    single sort, so the aps of every class are found from cumulative sums.
+    Only the classes with ties of both positives and negatives are ranked
+    again by AveragePrecisionCalculator, to break the ties as it does, i.e.
+    from the triplets of the class in arrival order (see
+    AveragePrecisionCalculator.peek_ap_at_n).
+
     Returns:
       An array of non-interpolated average precision at n (default 0) for each
       class.
     """
-    aps = [self._ap_calculators[i].peek_ap_at_n()
-           for i in range(self._num_class)]
+    aps = [0] * self._num_class
+    if self._size == 0:
+      return aps
+    classes = self._classes[:self._size]
+    predictions = self._predictions[:self._size]
+    actuals = self._actuals[:self._size]
+    if predictions.dtype.kind == "f":
+      keys = -predictions
+    else:
+      keys = -predictions.astype(numpy.float64)
+
+    counts = numpy.bincount(classes, minlength=self._num_class)
+    starts = numpy.cumsum(counts) - counts
+    sortidx = numpy.lexsort((keys, classes))
+
+    # classes with tied predictions of both positives and negatives
+    sorted_classes = classes[sortidx]
+    sorted_keys = keys[sortidx]
+    group = numpy.concatenate([[0], numpy.cumsum(
+        (sorted_keys[1:] != sorted_keys[:-1]) |
+        (sorted_classes[1:] != sorted_classes[:-1]))])
+    group_sizes = numpy.bincount(group)
+    group_positives = numpy.bincount(group, weights=actuals[sortidx] > 0)
+    mixed = (group_positives > 0) & (group_positives < group_sizes)
+    if mixed.any():
+      # every class in arrival order
+      by_class = numpy.argsort(classes, kind="mergesort")
+      for i in numpy.unique(sorted_classes[mixed[group]]):
+        indices = by_class[starts[i]:starts[i] + counts[i]]
+        ranked = average_precision_calculator.AveragePrecisionCalculator._rank(
+            predictions[indices], actuals[indices])
+        sortidx[starts[i]:starts[i] + counts[i]] = indices[ranked]
+
+    # the ap of every class, from its positives in rank order
+    positives = actuals[sortidx] > 0
+    poscount = numpy.cumsum(positives)
+    poscount_before = numpy.concatenate([[0], poscount])[starts]
+    poscount = (poscount - numpy.repeat(poscount_before, counts)).astype(
+        numpy.float64)
+    ranks = numpy.arange(1, self._size + 1) - numpy.repeat(starts, counts)
+    class_of_positives = sorted_classes[positives]
+    delta_recall = numpy.zeros([self._num_class])
+    has_positives = self._total_positives > 0
+    delta_recall[has_positives] = 1.0 / self._total_positives[has_positives]
+    terms = (poscount[positives] / ranks[positives] *
+             delta_recall[class_of_positives])
+    ends = numpy.cumsum(numpy.bincount(class_of_positives,
+                                       minlength=self._num_class))
+    for i in numpy.nonzero(has_positives)[0]:
+      begin = ends[i - 1] if i > 0 else 0
+      if ends[i] > begin:
+        # summed in rank order, as AveragePrecisionCalculator.ap_at_n
+        aps[i] = float(numpy.cumsum(terms[begin:ends[i]])[-1])
+      else:
+        aps[i] = 0.0
     return aps
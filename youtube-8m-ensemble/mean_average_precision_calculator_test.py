@@ -0,0 +1,99 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for mean_average_precision_calculator, against the per-class heaps
+it replaces."""
+
+import numpy as np
+import tensorflow as tf
+
+from average_precision_calculator_test import HeapAveragePrecisionCalculator
+from average_precision_calculator_test import loop_ap_at_n
+import mean_average_precision_calculator as map_calculator
+
+
+class MeanAveragePrecisionCalculatorTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.random = np.random.RandomState(0)
+    self.num_class = 8
+
+  def batches(self, num_batches, batch_size, num_values=None):
+    """Returns batches of class x video predictions, tied if num_values."""
+    batches = []
+    for _ in range(num_batches):
+      predictions = self.random.rand(self.num_class, batch_size)
+      if num_values:
+        predictions = np.round(predictions * num_values) / num_values
+      actuals = (self.random.rand(self.num_class, batch_size) <
+                 predictions).astype(np.int64)
+      batches.append((predictions, actuals))
+    return batches
+
+  def testMatchesHeapsWithoutTies(self):
+    calculator = map_calculator.MeanAveragePrecisionCalculator(self.num_class)
+    heaps = [HeapAveragePrecisionCalculator() for _ in range(self.num_class)]
+    for predictions, actuals in self.batches(10, 100):
+      calculator.accumulate(predictions, actuals)
+      for i in range(self.num_class):
+        heaps[i].accumulate(predictions[i], actuals[i])
+    self.assertAllClose(calculator.peek_map_at_n(),
+                        [heap.peek_ap_at_n() for heap in heaps])
+
+  def testRanksTiesInArrivalOrder(self):
+    batches = self.batches(10, 100, num_values=10)
+    calculator = map_calculator.MeanAveragePrecisionCalculator(self.num_class)
+    for predictions, actuals in batches:
+      calculator.accumulate(predictions, actuals)
+    predictions = np.concatenate([p for p, _ in batches], axis=1)
+    actuals = np.concatenate([a for _, a in batches], axis=1)
+    self.assertAllClose(calculator.peek_map_at_n(), [
+        loop_ap_at_n(predictions[i], actuals[i], n=None)
+        for i in range(self.num_class)])
+
+  def testAccumulateTopK(self):
+    num_videos, top_k = 300, 3
+    predictions = np.round(
+        self.random.rand(num_videos, self.num_class) * 10) / 10
+    actuals = (self.random.rand(num_videos, self.num_class) <
+               predictions).astype(np.int64)
+    classes = np.argsort(-predictions, axis=1, kind="mergesort")[:, :top_k]
+    rows = np.arange(num_videos)[:, None]
+    calculator = map_calculator.MeanAveragePrecisionCalculator(self.num_class)
+    calculator.accumulate_top_k(classes, predictions[rows, classes],
+                                actuals[rows, classes],
+                                num_positives=actuals.sum(axis=0))
+
+    # the former eval_util.top_k_by_class, one calculator per class
+    expected = []
+    for i in range(self.num_class):
+      in_top_k = np.any(classes == i, axis=1)
+      expected.append(loop_ap_at_n(predictions[in_top_k, i],
+                                   actuals[in_top_k, i], n=None,
+                                   total_num_positives=actuals[:, i].sum()))
+    self.assertAllClose(calculator.peek_map_at_n(), expected)
+
+  def testMerge(self):
+    calculator = map_calculator.MeanAveragePrecisionCalculator(self.num_class)
+    shards = [map_calculator.MeanAveragePrecisionCalculator(self.num_class)
+              for _ in range(2)]
+    batches = self.batches(10, 100, num_values=10)
+    for index, (predictions, actuals) in enumerate(batches):
+      calculator.accumulate(predictions, actuals)
+      shards[index * 2 // len(batches)].accumulate(predictions, actuals)
+    shards[0].merge(shards[1])
+    self.assertAllClose(shards[0].peek_map_at_n(), calculator.peek_map_at_n())
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,61 @@
+import glob
+import os
+import sys
+import numpy
+from tensorflow import flags
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import eval_util
+import score_cache
+
+FLAGS = flags.FLAGS
+
+if __name__=="__main__":
+  flags.DEFINE_string("score_cache", "", "The sqlite file caching the scores of the candidates.")
+  flags.DEFINE_string("train_path", "", "The validation split the candidates are scored on.")
+  flags.DEFINE_string("scorer", "eval-MeanModel-float32",
+      "How the predictions of the members are combined and scored.")
+  flags.DEFINE_string("candidates", "", "The candidate methods.")
+  flags.DEFINE_integer("top_k", 20, "The top_k of the GAP.")
+  flags.DEFINE_integer("bootstrap_resamples", 0, "The number of bootstrap replicates of the GAP, if any.")
+  flags.DEFINE_float("bootstrap_confidence", 0.95, "The confidence of the bootstrap interval.")
+  flags.DEFINE_string("replicates_file", "", "The .npy file of the bootstrap replicates of the candidate.")
+  flags.DEFINE_boolean("store", False,
+      "If true, the 'GAP = ...' line of eval.py --echo_gap is read from stdin and "
+      "stored in the cache, with the replicates of --replicates_file. Otherwise the "
+      "candidate is looked up: on a hit, its line is printed and its replicates are "
+      "written to --replicates_file, on a miss the exit status is 1.")
+
+def parse_gap(line):
+  """Parses 'GAP = 0.8 | CI = 0.79 0.81' into 0.8."""
+  return float(line.strip().split("|")[0].split("=")[-1])
+
+if __name__=="__main__":
+  members = map(lambda x: x.strip(), FLAGS.candidates.strip().split(","))
+  # the files eval.py reads, as get_patterns.py
+  files = []
+  for member in members:
+    files.extend(glob.glob("%s/%s/*.tfrecord" % (FLAGS.train_path, member)))
+  cache = score_cache.ScoreCache(FLAGS.score_cache, FLAGS.train_path.rstrip("/"),
+                                 FLAGS.scorer, score_cache.files_fingerprint(files))
+  if FLAGS.store:
+    lines = [line for line in sys.stdin.readlines() if line.startswith("GAP")]
+    if not lines:
+      sys.exit(1)
+    replicates = None
+    if FLAGS.bootstrap_resamples > 0:
+      replicates = numpy.load(FLAGS.replicates_file)
+    cache.put(members, FLAGS.top_k, parse_gap(lines[-1]), replicates)
+  else:
+    score = cache.get(members, FLAGS.top_k, FLAGS.bootstrap_resamples)
+    if score is None:
+      sys.exit(1)
+    gap, replicates = score
+    if replicates is None:
+      print "GAP =", gap
+    else:
+      lower, upper = eval_util.bootstrap_interval(replicates, FLAGS.bootstrap_confidence)
+      print "GAP =", gap, "| CI =", lower, upper
+      if FLAGS.replicates_file:
+        numpy.save(FLAGS.replicates_file, replicates)
+  cache.close()
@@ -7,15 +7,34 @@ candidates_conf="$2"
 train_path=/Youtube-8M/model_predictions_for_selection/ensemble_train
 model_path="${DIR}/../../model/${model_name}"
 all_models_conf="${model_path}/all_models.conf"
+# the bootstrap replicates of the GAP of every candidate, for get_top_k.py
+replicates_dir="${model_path}/bootstrap"
+mkdir -p $replicates_dir
+# the scores of the candidates of the previous steps and runs
+score_cache="${model_path}/score_cache.sqlite"
+cache_flags="--score_cache=$score_cache --train_path=$train_path --scorer=eval-MeanModel-float32 --bootstrap_resamples=1000"
 
+hits=0
+misses=0
 for candidates in $(cat $candidates_conf); do
   echo "$candidates"
+  replicates_file="${replicates_dir}/${candidates}.npy"
+  if python ${DIR}/cached_score.py $cache_flags --candidates="$candidates" --replicates_file="$replicates_file"; then
+    hits=$((hits+1))
+    continue
+  fi
+  misses=$((misses+1))
   train_data_patterns=$(python ${DIR}/get_patterns.py --train_path="$train_path" --candidates="$candidates")
-  CUDA_VISIBLE_DEVICES=1 python ${DIR}/../eval.py \
+  gap_line=$(CUDA_VISIBLE_DEVICES=1 python ${DIR}/../eval.py \
       --model_checkpoint_path="${model_path}/model.ckpt-0" \
       --train_dir="${model_path}" \
       --model="MeanModel" \
       --echo_gap=True \
+      --bootstrap_resamples=1000 \
+      --bootstrap_replicates_file="$replicates_file" \
       --batch_size=1024 \
-      --eval_data_patterns="$train_data_patterns" | tail -n 1
+      --eval_data_patterns="$train_data_patterns" | tail -n 1)
+  echo "$gap_line"
+  echo "$gap_line" | python ${DIR}/cached_score.py $cache_flags --candidates="$candidates" --replicates_file="$replicates_file" --store
 done
+echo "$candidates_conf: score cache $hits hits, $misses misses" >&2
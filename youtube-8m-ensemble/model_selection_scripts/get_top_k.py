@@ -1,26 +1,94 @@
+import os
 import sys
+import numpy
 from tensorflow import flags
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import eval_util
+
 FLAGS = flags.FLAGS
 
 if __name__=="__main__":
   flags.DEFINE_string("log_file", "", "The file that log models performances.")
   flags.DEFINE_string("sorted_log_file", "", "The file that log models performances (sorted by GAP).")
   flags.DEFINE_integer("top_k", 10, "The number of top models reserved.")
+  flags.DEFINE_string("replicates_dir", "",
+      "If set, the directory of the bootstrap replicates of the GAP of the models, "
+      "as <models>.npy written by eval.py --bootstrap_replicates_file. The models "
+      "significantly worse than the best one by a paired bootstrap are not reserved. "
+      "Otherwise, the intervals of the log file are used, if any.")
+  flags.DEFINE_string("previous_top_k_file", "",
+      "If set, the top-k models of the previous step. When the best model is not "
+      "significantly better than the best previous one by a paired bootstrap (with "
+      "--replicates_dir), no model is reserved, so that the search stops instead of "
+      "extending statistically tied models.")
+  flags.DEFINE_float("confidence", 0.95, "The confidence of the bootstrap intervals.")
+
+def parse_perf(line):
+  """Parses 'GAP = 0.8 | CI = 0.79 0.81' into (0.8, (0.79, 0.81)), or (0.8, None)."""
+  fields = line.strip().split("|")
+  perf = float(fields[0].split("=")[-1])
+  interval = None
+  if len(fields) > 1:
+    interval = tuple(map(float, fields[1].split("=")[-1].split()))
+  return perf, interval
+
+def load_replicates(model):
+  filename = os.path.join(FLAGS.replicates_dir, model + ".npy")
+  if not os.path.exists(filename):
+    return None
+  return numpy.load(filename)
+
+def is_worse(model, interval, best_model, best_interval):
+  """Whether the model is significantly worse than the best one."""
+  if FLAGS.replicates_dir:
+    replicates = load_replicates(model)
+    best_replicates = load_replicates(best_model)
+    if replicates is not None and best_replicates is not None:
+      return eval_util.paired_bootstrap_interval(
+          best_replicates, replicates, FLAGS.confidence)[0] > 0
+  if interval is not None and best_interval is not None:
+    return interval[1] < best_interval[0]
+  return False
+
+def is_tied_with_previous(best_model):
+  """Whether the best model is not significantly better than the previous best."""
+  with open(FLAGS.previous_top_k_file) as F:
+    previous_models = [line.strip() for line in F.readlines() if len(line.strip()) > 0]
+  if not previous_models:
+    return False
+  replicates = load_replicates(best_model)
+  previous_replicates = load_replicates(previous_models[0])
+  if replicates is None or previous_replicates is None:
+    return False
+  return eval_util.paired_bootstrap_interval(
+      replicates, previous_replicates, FLAGS.confidence)[0] <= 0
 
 if __name__=="__main__":
   log_file = FLAGS.log_file
   with open(log_file) as F:
     lines = F.readlines()
     models = map(lambda x: x.strip(), lines[::2])
-    perfs = map(lambda x: float(x.strip().split("=")[-1]), lines[1::2])
+    perfs = map(parse_perf, lines[1::2])
     perfs = perfs[:len(models)]
     model_perfs = sorted(zip(perfs, models), reverse=True)
 
     with open(FLAGS.sorted_log_file, "w") as Fo:
-      Fo.writelines(["%f\t%s\n"%(x,y) for x,y in model_perfs])
+      for (perf, interval), model in model_perfs:
+        if interval is None:
+          Fo.write("%f\t%s\n"%(perf, model))
+        else:
+          Fo.write("%f\t%f\t%f\t%s\n"%(perf, interval[0], interval[1], model))
 
-    for perf, model in model_perfs[:FLAGS.top_k]:
-      print model
-      
+    if not model_perfs:
+      sys.exit(0)
+    (best_perf, best_interval), best_model = model_perfs[0]
+    if FLAGS.previous_top_k_file and FLAGS.replicates_dir and is_tied_with_previous(best_model):
+      sys.stderr.write("%s is not significantly better than the previous step, stop.\n" % best_model)
+      sys.exit(0)
 
+    for (perf, interval), model in model_perfs[:FLAGS.top_k]:
+      if is_worse(model, interval, best_model, best_interval):
+        sys.stderr.write("%s is significantly worse than %s, not extended.\n" % (model, best_model))
+        continue
+      print model
@@ -0,0 +1,29 @@
+#!/bin/bash
+
+# the search of greedy-selection-mean_model.sh, with every model's predictions
+# loaded once and the candidates scored in memory, on CPU
+DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
+model_name=$1
+
+train_path=/Youtube-8M/model_predictions_for_selection/ensemble_train
+model_path="${DIR}/../../model/${model_name}"
+all_models_conf="${model_path}/all_models.conf"
+
+if [ -f $all_models_conf ]; then 
+
+  python ${DIR}/../greedy-selection.py \
+      --train_path="$train_path" \
+      --all_models_conf="$all_models_conf" \
+      --model_path="$model_path" \
+      --prediction_cache="/tmp/${model_name}.predictions.npy" \
+      --score_cache="${model_path}/score_cache.sqlite" \
+      --beam_size=2 \
+      --num_steps=30 \
+      --num_workers=4 \
+      --bootstrap_resamples=1000
+
+else
+
+  echo $all_models_conf not found, did nothing
+
+fi
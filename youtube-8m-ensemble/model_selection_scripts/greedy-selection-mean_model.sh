@@ -23,7 +23,14 @@ if [ -f $all_models_conf ]; then
       fi
 
       bash $extend_step_script $model_name ${len_k_models_conf} > ${model_path}/len_${step}_models.log
-      python ${DIR}/get_top_k.py --top_k=2 --log_file="${model_path}/len_${step}_models.log" --sorted_log_file="${model_path}/len_${step}_models.sorted.log" > ${model_path}/top_${step}_models.conf
+      # candidates significantly worse than the best are not extended, and the
+      # search stops when the best is tied with the one of the previous step
+      python ${DIR}/get_top_k.py --top_k=2 --log_file="${model_path}/len_${step}_models.log" --sorted_log_file="${model_path}/len_${step}_models.sorted.log" --replicates_dir="${model_path}/bootstrap" --previous_top_k_file="$top_models_conf" > ${model_path}/top_${step}_models.conf
+
+      if [ ! -s ${model_path}/top_${step}_models.conf ]; then
+          echo no significant improvement at step $step, stop
+          break
+      fi
 
       top_models_conf="${model_path}/top_${step}_models.conf"
   done
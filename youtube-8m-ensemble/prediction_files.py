@@ -0,0 +1,183 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads the prediction directories with numpy, without a Tensorflow graph.
+
+A directory holds the predictions of a model written by
+inference-pre-ensemble.py, as tf.train.Example tfrecords or prediction store
+files. The tfrecords are split by their framing and only the needed fields of
+the Examples are decoded; the prediction stores are memory-mapped.
+"""
+
+import os
+import struct
+
+import numpy as np
+from tensorflow import gfile
+
+import prediction_store
+
+
+def read_varint(data, pos):
+  """Returns the varint at data[pos] and the position after it."""
+  result = 0
+  shift = 0
+  while True:
+    byte = ord(data[pos])
+    pos += 1
+    result |= (byte & 0x7f) << shift
+    if byte < 0x80:
+      return result, pos
+    shift += 7
+
+
+def iter_fields(data, start, end):
+  """Yields the field number, wire type and span of the fields of a proto.
+
+  The span of a varint (wire type 0) is the varint itself, the span of a
+  length-delimited field (wire type 2) is its payload.
+  """
+  pos = start
+  while pos < end:
+    tag, pos = read_varint(data, pos)
+    wire_type = tag & 7
+    if wire_type == 0:
+      field_start = pos
+      _, pos = read_varint(data, pos)
+    elif wire_type == 2:
+      length, field_start = read_varint(data, pos)
+      pos = field_start + length
+    elif wire_type == 5:
+      field_start, pos = pos, pos + 4
+    elif wire_type == 1:
+      field_start, pos = pos, pos + 8
+    else:
+      raise ValueError("Unsupported wire type %d." % wire_type)
+    yield tag >> 3, wire_type, field_start, pos
+
+
+def decode_feature(data, start, end):
+  """Decodes a tf.train.Feature: a list of bytes, a float32 or int64 array."""
+  for kind, _, list_start, list_end in iter_fields(data, start, end):
+    values = []
+    for _, wire_type, value_start, value_end in iter_fields(
+        data, list_start, list_end):
+      if kind == 1:
+        values.append(data[value_start:value_end])
+      elif kind == 2 and wire_type == 2:
+        # packed floats
+        values.append(np.frombuffer(data, dtype="<f4",
+                                    count=(value_end - value_start) // 4,
+                                    offset=value_start))
+      elif kind == 2:
+        values.append(np.frombuffer(data, dtype="<f4", count=1,
+                                    offset=value_start))
+      elif wire_type == 2:
+        # packed varints
+        pos = value_start
+        while pos < value_end:
+          value, pos = read_varint(data, pos)
+          values.append(value)
+      else:
+        values.append(read_varint(data, value_start)[0])
+    if kind == 2:
+      return (np.concatenate(values) if values
+              else np.zeros([0], dtype=np.float32))
+    return values
+  return []
+
+
+def parse_example(data, feature_names):
+  """Returns the features of a serialized tf.train.Example, by name.
+
+  Only the features in feature_names are decoded.
+  """
+  features = {}
+  for field, _, start, end in iter_fields(data, 0, len(data)):
+    if field != 1:
+      continue
+    # the map entries of Example.features
+    for _, _, entry_start, entry_end in iter_fields(data, start, end):
+      key, span = None, None
+      for entry_field, _, value_start, value_end in iter_fields(
+          data, entry_start, entry_end):
+        if entry_field == 1:
+          key = data[value_start:value_end]
+        elif entry_field == 2:
+          span = (value_start, value_end)
+      if key in feature_names and span is not None:
+        features[key] = decode_feature(data, *span)
+  return features
+
+
+def read_tfrecords(filename):
+  """Yields the records of a tfrecord file, without checking their crc."""
+  with gfile.Open(filename, "rb") as F:
+    data = F.read()
+  pos = 0
+  while pos + 12 <= len(data):
+    length = struct.unpack("<Q", data[pos:pos + 8])[0]
+    yield data[pos + 12:pos + 12 + length]
+    pos += 12 + length + 4
+
+
+def get_prediction_batches(files, feature_name, num_classes, batch_size):
+  """Yields the video ids, predictions and labels of the files, by batch_size
+  videos."""
+  video_ids = [None] * batch_size
+  predictions = np.zeros([batch_size, num_classes], dtype=np.float32)
+  labels = np.zeros([batch_size, num_classes], dtype=np.float32)
+  num_rows = 0
+  for filename in files:
+    if filename.endswith(prediction_store.FILE_EXTENSION):
+      store = prediction_store.PredictionStore(filename)
+      for start in range(0, store.num_rows, batch_size):
+        yield (store.video_ids[start:start + batch_size],
+               store.get_predictions(start, start + batch_size),
+               store.get_labels(start, start + batch_size).astype(np.float32))
+      continue
+    for record in read_tfrecords(filename):
+      features = parse_example(record, ("video_id", feature_name, "labels"))
+      video_ids[num_rows] = features.get("video_id", [""])[0]
+      predictions[num_rows] = features[feature_name]
+      labels[num_rows] = 0
+      labels[num_rows, features.get("labels", [])] = 1
+      num_rows += 1
+      if num_rows == batch_size:
+        yield video_ids, predictions, labels
+        num_rows = 0
+  if num_rows > 0:
+    yield video_ids[:num_rows], predictions[:num_rows], labels[:num_rows]
+
+
+def get_prediction_files(directory):
+  """Returns the tfrecord and prediction store files of a directory."""
+  return sorted(
+      gfile.Glob(os.path.join(directory, "*.tfrecord")) +
+      gfile.Glob(os.path.join(directory, "*" + prediction_store.FILE_EXTENSION)))
+
+
+def get_video_ids(files):
+  """Returns the video ids of the files, in order.
+
+  Only the video_id field of the tfrecords is decoded.
+  """
+  video_ids = []
+  for filename in files:
+    if filename.endswith(prediction_store.FILE_EXTENSION):
+      video_ids.extend(prediction_store.PredictionStore(filename).video_ids)
+      continue
+    for record in read_tfrecords(filename):
+      video_ids.append(parse_example(record, ("video_id",))["video_id"][0])
+  return video_ids
@@ -0,0 +1,110 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for prediction_store."""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import prediction_store
+
+
+class PredictionStoreTest(tf.test.TestCase):
+
+  def setUp(self):
+    random = np.random.RandomState(0)
+    self.num_rows = 50
+    self.num_classes = 40
+    self.video_ids = ["video%d" % i for i in range(self.num_rows)]
+    self.labels = random.rand(self.num_rows, self.num_classes) > 0.9
+    self.predictions = random.rand(
+        self.num_rows, self.num_classes).astype(np.float32)
+
+  def write(self, name, predictions, **kwargs):
+    filename = os.path.join(self.get_temp_dir(),
+                            name + prediction_store.FILE_EXTENSION)
+    prediction_store.write_predictions(
+        filename, self.video_ids[:len(predictions)],
+        self.labels[:len(predictions)], predictions, **kwargs)
+    return filename
+
+  def testRoundtrip(self):
+    for dtype, tolerance in [("float32", 0.0), ("float16", 1e-3),
+                             ("uint8", 0.5 / 255 + 1e-6)]:
+      store = prediction_store.PredictionStore(
+          self.write(dtype, self.predictions, dtype=dtype, model="m",
+                     checkpoint="c"))
+      self.assertEqual(store.header["model"], "m")
+      self.assertEqual(store.header["checkpoint"], "c")
+      self.assertEqual(store.num_rows, self.num_rows)
+      self.assertEqual(list(store.video_ids), self.video_ids)
+      self.assertAllEqual(store.get_labels(), self.labels)
+      self.assertAllClose(store.get_predictions(), self.predictions,
+                          atol=tolerance, rtol=0)
+      self.assertAllClose(store.get_predictions(10, 20),
+                          self.predictions[10:20], atol=tolerance, rtol=0)
+
+  def testTopK(self):
+    top_k = 5
+    store = prediction_store.PredictionStore(
+        self.write("top_k", self.predictions, dtype="float32", top_k=top_k))
+    predictions = store.get_predictions()
+    top = np.argsort(-self.predictions, axis=1)[:, :top_k]
+    rows = np.arange(self.num_rows)[:, None]
+    self.assertAllEqual(predictions[rows, top], self.predictions[rows, top])
+    left_out = np.ones_like(self.predictions, dtype=np.bool_)
+    left_out[rows, top] = False
+    floor = self.predictions[left_out].mean()
+    self.assertAllClose(predictions[left_out],
+                        np.full([left_out.sum()], floor, dtype=np.float32))
+
+  def testSetModelFloor(self):
+    top_k = 5
+    filenames = [
+        self.write("part0", self.predictions[:10], top_k=top_k),
+        self.write("part1", self.predictions[10:], top_k=top_k)]
+    file_floors = [prediction_store.read_header(filename)["floor"]
+                   for filename in filenames]
+    self.assertNotAlmostEqual(file_floors[0], file_floors[1])
+
+    whole = self.write("whole", self.predictions, top_k=top_k)
+    model_floor = prediction_store.read_header(whole)["floor"]
+    self.assertAlmostEqual(prediction_store.set_model_floor(filenames),
+                           model_floor)
+    parts = []
+    for filename in filenames:
+      store = prediction_store.PredictionStore(filename)
+      self.assertAlmostEqual(store.header["floor"], model_floor)
+      self.assertAllClose(store.rows["floor"],
+                          np.full([store.num_rows], model_floor))
+      parts.append(store.get_predictions())
+    self.assertAllEqual(
+        np.concatenate(parts),
+        prediction_store.PredictionStore(whole).get_predictions())
+
+  def testSetModelFloorMismatch(self):
+    filenames = [self.write("top5", self.predictions, top_k=5),
+                 self.write("top3", self.predictions, top_k=3)]
+    with self.assertRaises(ValueError):
+      prediction_store.set_model_floor(filenames)
+
+  def testTooManyLabels(self):
+    self.labels[0] = True
+    with self.assertRaises(ValueError):
+      self.write("labels", self.predictions)
+
+
+if __name__ == "__main__":
+  tf.test.main()
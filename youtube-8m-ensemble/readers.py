@@ -16,8 +16,10 @@
 
 import sys
 import tensorflow as tf
+import prediction_store
 import utils
 
+from tensorflow import gfile
 from tensorflow import logging
 
 def resize_axis(tensor, axis, new_size, fill_value=0):
@@ -68,6 +70,10 @@ class EnsembleReader(BaseReader):
 
     reader = tf.TFRecordReader()
     _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.decode(serialized_examples)
+
+  def decode(self, serialized_examples):
+    """Decodes a batch of serialized Examples into the reader outputs."""
 
     # set the mapping from the fields to data types in the proto
     num_features = len(self.feature_names)
@@ -90,6 +96,116 @@ class EnsembleReader(BaseReader):
 
     return features["video_id"], concatenated_features, labels, tf.ones([tf.shape(serialized_examples)[0]])
 
+class EnsemblePredictionStoreReader(BaseReader):
+  """Reads the prediction store files written by prediction_store.py.
+
+  The counterpart of EnsembleReader, with the same outputs. Rows are read as
+  fixed length records and sliced into the video_id, labels and predictions,
+  so no protobuf is parsed. Files storing only the top_k predictions are
+  densified on the fly, with the floor of the row for the other classes.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[4716],
+               feature_names=["predictions"],
+               dtype="float16",
+               top_k=0):
+
+    assert len(feature_names) == len(feature_sizes), \
+        "length of feature_names (={}) != length of feature_sizes (={})".format( \
+        len(feature_names), len(feature_sizes))
+
+    self.num_classes = num_classes
+    self.feature_sizes = feature_sizes
+    self.feature_names = feature_names
+    self.dtype = dtype
+    self.top_k = top_k
+
+  def prepare_reader(self, filename_queue, batch_size=1024):
+
+    num_values = sum(self.feature_sizes)
+    reader = tf.FixedLengthRecordReader(
+        record_bytes=prediction_store.record_bytes(num_values, self.dtype,
+                                                   self.top_k),
+        header_bytes=prediction_store.HEADER_BYTES)
+    _, records = reader.read_up_to(filename_queue, batch_size)
+    return self.decode(records)
+
+  def decode(self, records):
+    """Decodes a batch of rows into the reader outputs."""
+
+    num_values = sum(self.feature_sizes)
+
+    # video ids are padded with 0
+    id_bytes = tf.substr(records, 0, prediction_store.VIDEO_ID_BYTES)
+    id_lengths = tf.reduce_sum(tf.cast(tf.not_equal(
+        tf.decode_raw(id_bytes, tf.uint8), 0), tf.int32), axis=1)
+    video_ids = tf.substr(id_bytes, tf.zeros_like(id_lengths), id_lengths)
+
+    # labels are padded with -1
+    label_indices = tf.cast(tf.decode_raw(
+        tf.substr(records, prediction_store.VIDEO_ID_BYTES,
+                  2 * prediction_store.MAX_LABELS), tf.int16), tf.int64)
+    label_positions = tf.where(label_indices >= 0)
+    sparse_labels = tf.SparseTensor(
+        indices=label_positions,
+        values=tf.gather_nd(label_indices, label_positions),
+        dense_shape=tf.cast(tf.shape(label_indices), tf.int64))
+    labels = tf.sparse_to_indicator(sparse_labels, self.num_classes)
+    labels.set_shape([None, self.num_classes])
+
+    out_type = {"float32": tf.float32,
+                "float16": tf.float16,
+                "uint8": tf.uint8}[self.dtype]
+    offset = prediction_store.VIDEO_ID_BYTES + 2 * prediction_store.MAX_LABELS
+    if self.top_k:
+      floor = tf.decode_raw(tf.substr(records, offset, 4), tf.float32)
+      classes = tf.cast(tf.decode_raw(
+          tf.substr(records, offset + 4, 2 * self.top_k), tf.int16), tf.int32)
+      offset += 4 + 2 * self.top_k
+    predictions = tf.decode_raw(
+        tf.substr(records, offset,
+                  (self.top_k or num_values) *
+                  prediction_store.DTYPES[self.dtype].itemsize),
+        out_type)
+    predictions = tf.cast(predictions, tf.float32)
+    if self.dtype == "uint8":
+      predictions = predictions * (1.0 / 255)
+
+    if self.top_k:
+      # scatter the top_k predictions over the floor
+      num_records = tf.shape(records)[0]
+      rows = tf.tile(tf.expand_dims(tf.range(num_records), 1), [1, self.top_k])
+      indices = tf.stack([rows, classes], axis=2)
+      dense_shape = tf.stack([num_records, num_values])
+      mask = tf.scatter_nd(indices, tf.ones_like(predictions), dense_shape)
+      predictions = (tf.scatter_nd(indices, predictions, dense_shape) +
+                     floor * (1.0 - mask))
+    predictions.set_shape([None, num_values])
+
+    return video_ids, predictions, labels, tf.ones([tf.shape(records)[0]])
+
+def get_prediction_reader(data_pattern, feature_names, feature_sizes):
+  """Returns the reader of the prediction files matching data_pattern.
+
+  Patterns of prediction store files (ending with
+  prediction_store.FILE_EXTENSION) are read by an
+  EnsemblePredictionStoreReader of the dtype of their first file, others by
+  an EnsembleReader.
+  """
+  if data_pattern.endswith(prediction_store.FILE_EXTENSION):
+    files = gfile.Glob(data_pattern)
+    if not files:
+      raise IOError("Unable to find prediction files. data_pattern='" +
+                    data_pattern + "'.")
+    header = prediction_store.read_header(sorted(files)[0])
+    return EnsemblePredictionStoreReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        dtype=str(header["dtype"]), top_k=header.get("top_k", 0))
+  return EnsembleReader(
+      feature_names=feature_names, feature_sizes=feature_sizes)
+
 class EnsembleFrameReader(BaseReader):
 
   def __init__(self,
@@ -0,0 +1,178 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for scoring prediction directories without a Tensorflow graph.
+
+Every directory of --prediction_dirs holds the predictions of a model written
+by inference-pre-ensemble.py, as tf.train.Example tfrecords or prediction
+store files. The tfrecords are split by their framing and only the video_id,
+labels and predictions fields of the Examples are decoded, with numpy; the
+prediction stores are memory-mapped. The GAP, MAP, Hit@1 and PERR are then
+computed by eval_util.EvaluationMetrics, as eval.py does with the MeanModel of
+a single directory.
+
+The directories are scored in parallel by --num_workers processes, and a
+leaderboard of the directories sorted by GAP is printed. With
+--bootstrap_resamples, it also has the bootstrap interval of every GAP, and
+the paired interval of its difference to the GAP of the first directory
+(see eval_util.GapBootstrap).
+"""
+
+import multiprocessing
+import time
+
+import numpy as np
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+
+import eval_util
+import prediction_files
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string(
+      "prediction_dirs", "",
+      "Comma separated directories (or globs of directories) of prediction "
+      "files, e.g. /Youtube-8M/model_predictions/ensemble_validate/*.")
+  flags.DEFINE_string("feature_name", "predictions",
+                      "The feature of the Examples holding the predictions.")
+  flags.DEFINE_integer("num_classes", 4716, "Number of classes.")
+  flags.DEFINE_integer("top_k", 20,
+                       "How many predictions per video are used for the GAP.")
+  flags.DEFINE_integer("batch_size", 1024,
+                       "How many videos to accumulate at a time.")
+  flags.DEFINE_integer("num_workers", 4,
+                       "How many directories to score in parallel.")
+  flags.DEFINE_integer(
+      "gap_histogram_bins", 0,
+      "If positive, estimate the GAP from histograms of this many bins of the "
+      "predictions, in bounded memory, instead of computing it exactly. The "
+      "memory of the MAP still grows with the number of videos.")
+  flags.DEFINE_integer(
+      "bootstrap_resamples", 0,
+      "If positive, the bootstrap intervals of the GAP are computed from this "
+      "many resamples of the videos.")
+  flags.DEFINE_float("bootstrap_confidence", 0.95,
+                     "The confidence of the bootstrap intervals.")
+
+
+def score_directory(args):
+  """Returns the metrics of the predictions of a directory.
+
+  Args:
+    args: a tuple of the directory, the feature name, the number of classes,
+      the top_k, the batch size, the number of histogram bins of the GAP and
+      the number of bootstrap resamples, so that it can be mapped by a
+      multiprocessing.Pool.
+
+  Returns:
+    A dict of the directory, the number of videos, the gap, map, hit_at_one
+    and perr, the bootstrap replicates of the gap (or None), and the seconds
+    taken.
+  """
+  (directory, feature_name, num_classes, top_k, batch_size, gap_bins,
+   bootstrap_resamples) = args
+  start_time = time.time()
+  files = prediction_files.get_prediction_files(directory)
+  if not files:
+    raise IOError("Unable to find prediction files in '" + directory + "'.")
+  evl_metrics = eval_util.EvaluationMetrics(num_classes, top_k, gap_bins)
+  gap_bootstrap = eval_util.GapBootstrap(top_k)
+  batches = prediction_files.get_prediction_batches(
+      files, feature_name, num_classes, batch_size)
+  for video_ids, predictions, labels in batches:
+    evl_metrics.accumulate(predictions, labels, np.zeros([labels.shape[0]]))
+    if bootstrap_resamples > 0:
+      gap_bootstrap.accumulate(video_ids, predictions, labels)
+  epoch_info_dict = evl_metrics.get()
+  replicates = None
+  if bootstrap_resamples > 0:
+    _, replicates = gap_bootstrap.get_replicates(bootstrap_resamples)
+  return {"directory": directory,
+          "num_videos": evl_metrics.num_examples,
+          "gap": epoch_info_dict["gap"],
+          "map": np.mean(epoch_info_dict["aps"]),
+          "hit_at_one": epoch_info_dict["avg_hit_at_one"],
+          "perr": epoch_info_dict["avg_perr"],
+          "replicates": replicates,
+          "seconds": time.time() - start_time}
+
+
+def get_directories(prediction_dirs):
+  """Returns the directories of comma separated directories or globs."""
+  directories = []
+  for pattern in prediction_dirs.split(","):
+    pattern = pattern.strip()
+    if pattern:
+      directories.extend(sorted(
+          d for d in gfile.Glob(pattern) if gfile.IsDirectory(d)))
+  if not directories:
+    raise IOError("Unable to find the prediction directories. "
+                  "prediction_dirs='" + prediction_dirs + "'.")
+  return directories
+
+
+def print_leaderboard_with_intervals(results):
+  """Prints the leaderboard with the bootstrap intervals of the GAP.
+
+  dGAP is the paired interval of the GAP of the first directory minus the one
+  of every directory, which is significantly better when it is positive.
+  """
+  confidence = FLAGS.bootstrap_confidence
+  best_replicates = results[0]["replicates"]
+  print("%4s %8s %19s %19s %8s %8s %8s %9s  %s" % (
+      "rank", "GAP", "GAP interval", "dGAP interval", "MAP", "Hit@1", "PERR",
+      "videos", "directory"))
+  for rank, result in enumerate(results):
+    lower, upper = eval_util.bootstrap_interval(result["replicates"],
+                                                confidence)
+    diff_lower, diff_upper = eval_util.paired_bootstrap_interval(
+        best_replicates, result["replicates"], confidence)
+    print("%4d %8.5f [%8.5f,%8.5f] [%8.5f,%8.5f] %8.5f %8.5f %8.5f %9d  %s" % (
+        rank + 1, result["gap"], lower, upper, diff_lower, diff_upper,
+        result["map"], result["hit_at_one"], result["perr"],
+        result["num_videos"], result["directory"]))
+
+
+def main(unused_argv):
+  directories = get_directories(FLAGS.prediction_dirs)
+  tasks = [(directory, FLAGS.feature_name, FLAGS.num_classes, FLAGS.top_k,
+            FLAGS.batch_size, FLAGS.gap_histogram_bins,
+            FLAGS.bootstrap_resamples)
+           for directory in directories]
+  num_workers = min(FLAGS.num_workers, len(tasks))
+  if num_workers > 1:
+    pool = multiprocessing.Pool(num_workers)
+    results = pool.map(score_directory, tasks, chunksize=1)
+    pool.close()
+    pool.join()
+  else:
+    results = map(score_directory, tasks)
+
+  results.sort(key=lambda result: -result["gap"])
+  if FLAGS.bootstrap_resamples > 0:
+    print_leaderboard_with_intervals(results)
+    return
+  print("%4s %8s %8s %8s %8s %9s %8s  %s" % (
+      "rank", "GAP", "MAP", "Hit@1", "PERR", "videos", "seconds", "directory"))
+  for rank, result in enumerate(results):
+    print("%4d %8.5f %8.5f %8.5f %8.5f %9d %8.1f  %s" % (
+        rank + 1, result["gap"], result["map"], result["hit_at_one"],
+        result["perr"], result["num_videos"], result["seconds"],
+        result["directory"]))
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,151 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A persistent cache of the scores of the candidate ensembles.
+
+The model selection scores the same combinations of models again and again:
+when a search is resumed or rerun with another beam, another step range or
+more models, every candidate it has already scored is evaluated again. The
+cache is a local sqlite file holding the GAP of every scored candidate, and
+its bootstrap replicates if any, so that the selection only evaluates the
+candidates it has never seen.
+
+A candidate is identified by the hash of its sorted members, the validation
+split it is scored on (the directory of the prediction directories of the
+members), the scorer and the fingerprint of the videos it is scored on. The
+scorer names how the predictions are combined and at which precision, since
+two scorers of the same members give different GAPs: greedy-selection.py
+sums float16 predictions ("greedy-mean-float16"), and eval.py averages the
+float32 predictions with a MeanModel ("eval-MeanModel-float32"). The
+greedy selection only scores the videos all of its models have in common, so
+its fingerprint is the one of these video ids, while eval.py scores all the
+videos of the prediction files of the members, so its fingerprint is the one
+of these files. A cached score is only used with the same top_k of the GAP
+and, when replicates are requested, the same number of bootstrap resamples;
+otherwise it is a miss, and the new score replaces it.
+"""
+
+import hashlib
+import io
+import json
+import os
+import sqlite3
+
+import numpy
+
+
+def fingerprint(items):
+  """Returns the hex sha1 of a set of strings, e.g. video ids."""
+  digest = hashlib.sha1()
+  for item in sorted(set(items)):
+    digest.update(item + "\n")
+  return digest.hexdigest()
+
+
+def files_fingerprint(filenames):
+  """Returns the fingerprint of local files, by their names and sizes."""
+  return fingerprint(["%s %d" % (filename, os.path.getsize(filename))
+                      for filename in filenames])
+
+
+def candidate_key(members, split, scorer, videos):
+  """Returns the hash of a candidate.
+
+  Args:
+    members: The names of the models of the candidate, in any order.
+    split: The validation split the candidate is scored on.
+    scorer: How the predictions of the members are combined and scored.
+    videos: The fingerprint of the videos the candidate is scored on.
+
+  Returns:
+    The hex sha1 of the sorted members, the split, the scorer and the videos.
+  """
+  canonical = json.dumps([sorted(members), split, scorer, videos])
+  return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class ScoreCache(object):
+  """The scores of the candidates, in a sqlite file."""
+
+  def __init__(self, filename, split, scorer, videos):
+    """Opens the cache, creating the file if needed.
+
+    Args:
+      filename: The local sqlite file.
+      split: The validation split of the candidates looked up and stored.
+      scorer: The scorer of the candidates looked up and stored.
+      videos: The fingerprint of the videos of the candidates looked up and
+        stored.
+    """
+    self._split = split
+    self._scorer = scorer
+    self._videos = videos
+    self._connection = sqlite3.connect(filename)
+    self._connection.execute(
+        "CREATE TABLE IF NOT EXISTS candidate_scores ("
+        "key TEXT PRIMARY KEY, members TEXT, split TEXT, scorer TEXT, "
+        "videos TEXT, top_k INTEGER, gap REAL, num_resamples INTEGER, "
+        "replicates BLOB)")
+    self._connection.commit()
+    self.hits = 0
+    self.misses = 0
+
+  def _key(self, members):
+    return candidate_key(members, self._split, self._scorer, self._videos)
+
+  def get(self, members, top_k, num_resamples=0):
+    """Returns the cached (gap, replicates) of a candidate, or None.
+
+    Args:
+      members: The names of the models of the candidate.
+      top_k: The top_k of the GAP.
+      num_resamples: If positive, only a score with this many bootstrap
+        replicates is a hit. Otherwise the replicates are None.
+    """
+    row = self._connection.execute(
+        "SELECT top_k, gap, num_resamples, replicates FROM candidate_scores "
+        "WHERE key = ?", (self._key(members),)).fetchone()
+    if (row is None or row[0] != top_k or
+        (num_resamples > 0 and row[2] != num_resamples)):
+      self.misses += 1
+      return None
+    self.hits += 1
+    replicates = None
+    if num_resamples > 0:
+      replicates = numpy.load(io.BytesIO(bytes(row[3])))
+    return row[1], replicates
+
+  def put(self, members, top_k, gap, replicates=None):
+    """Stores the score of a candidate, replacing any previous one."""
+    num_resamples = 0
+    blob = None
+    if replicates is not None:
+      num_resamples = len(replicates)
+      buf = io.BytesIO()
+      numpy.save(buf, replicates)
+      blob = sqlite3.Binary(buf.getvalue())
+    self._connection.execute(
+        "INSERT OR REPLACE INTO candidate_scores "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (self._key(members), ",".join(sorted(members)), self._split,
+         self._scorer, self._videos, top_k, float(gap), num_resamples, blob))
+    self._connection.commit()
+
+  def reset_counts(self):
+    """Resets the hit and miss counts, e.g. at every step."""
+    self.hits = 0
+    self.misses = 0
+
+  def close(self):
+    self._connection.close()
@@ -0,0 +1,101 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for score_cache."""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import score_cache
+
+
+class ScoreCacheTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.filename = os.path.join(self.get_temp_dir(), "scores.sqlite")
+    if os.path.exists(self.filename):
+      os.remove(self.filename)
+    self.videos = score_cache.fingerprint(["video1", "video0"])
+
+  def testCandidateKey(self):
+    key = score_cache.candidate_key(["b", "a"], "train", "greedy-mean-float16",
+                                    self.videos)
+    self.assertEqual(key, score_cache.candidate_key(
+        ["a", "b"], "train", "greedy-mean-float16", self.videos))
+    for other in [
+        score_cache.candidate_key(["a", "c"], "train", "greedy-mean-float16",
+                                  self.videos),
+        score_cache.candidate_key(["a", "b"], "test", "greedy-mean-float16",
+                                  self.videos),
+        score_cache.candidate_key(["a", "b"], "train",
+                                  "eval-MeanModel-float32", self.videos),
+        score_cache.candidate_key(["a", "b"], "train", "greedy-mean-float16",
+                                  score_cache.fingerprint(["video0"]))]:
+      self.assertNotEqual(key, other)
+
+  def testFingerprint(self):
+    self.assertEqual(self.videos,
+                     score_cache.fingerprint(["video0", "video1", "video0"]))
+    self.assertNotEqual(self.videos,
+                        score_cache.fingerprint(["video0", "video2"]))
+    filename = os.path.join(self.get_temp_dir(), "predictions.tfrecord")
+    with open(filename, "w") as F:
+      F.write("a")
+    files = score_cache.files_fingerprint([filename])
+    with open(filename, "w") as F:
+      F.write("ab")
+    self.assertNotEqual(files, score_cache.files_fingerprint([filename]))
+
+  def testRoundtrip(self):
+    replicates = np.random.RandomState(0).rand(100)
+    cache = score_cache.ScoreCache(self.filename, "train",
+                                   "greedy-mean-float16", self.videos)
+    self.assertIsNone(cache.get(["a", "b"], 20))
+    cache.put(["b", "a"], 20, 0.8, replicates)
+    cache.put(["a"], 20, 0.7)
+    cache.close()
+
+    cache = score_cache.ScoreCache(self.filename, "train",
+                                   "greedy-mean-float16", self.videos)
+    gap, cached_replicates = cache.get(["a", "b"], 20, 100)
+    self.assertAlmostEqual(gap, 0.8)
+    self.assertAllEqual(cached_replicates, replicates)
+    self.assertEqual(cache.get(["a"], 20), (0.7, None))
+    # another top_k, number of resamples or replicates that were not stored
+    self.assertIsNone(cache.get(["a", "b"], 10))
+    self.assertIsNone(cache.get(["a", "b"], 20, 1000))
+    self.assertIsNone(cache.get(["a"], 20, 100))
+    self.assertEqual((cache.hits, cache.misses), (2, 3))
+    cache.reset_counts()
+    self.assertEqual((cache.hits, cache.misses), (0, 0))
+    cache.close()
+
+  def testScorersAndVideosDoNotShareScores(self):
+    greedy = score_cache.ScoreCache(self.filename, "train",
+                                    "greedy-mean-float16", self.videos)
+    greedy.put(["a", "b"], 20, 0.8)
+    for scorer, videos in [
+        ("eval-MeanModel-float32", self.videos),
+        ("greedy-mean-float16", score_cache.fingerprint(["video0"]))]:
+      cache = score_cache.ScoreCache(self.filename, "train", scorer, videos)
+      self.assertIsNone(cache.get(["a", "b"], 20))
+      cache.put(["a", "b"], 20, 0.9)
+      cache.close()
+    self.assertEqual(greedy.get(["a", "b"], 20), (0.8, None))
+    greedy.close()
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -30,6 +30,7 @@ from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
 import utils
+import video_id_join
 
 FLAGS = flags.FLAGS
 
@@ -46,6 +47,15 @@ if __name__ == "__main__":
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_bool(
+      "join_by_video_id", False,
+      "If set, the train_data_patterns (and input_data_pattern) are joined on "
+      "their common video ids instead of being read in lockstep, so they may "
+      "be sharded and ordered differently. Videos that are not in every "
+      "source are left out.")
+  flags.DEFINE_bool(
+      "shuffle_data", False,
+      "Whether to shuffle the videos, only with --join_by_video_id.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -219,33 +229,48 @@ def build_graph(all_readers,
       staircase=True)
   tf.summary.scalar('learning_rate', learning_rate)
 
-  original_input = None
-  if input_data_pattern is not None:
-    original_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size,
-            num_epochs=num_epochs))
-  
   optimizer = optimizer_class(learning_rate)
-  model_input_raw_tensors = []
-  labels_batch_tensor = None
-  for reader, data_pattern in zip(all_readers, all_train_data_patterns):
-    video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            reader,
-            data_pattern,
+  if FLAGS.join_by_video_id:
+    video_id, all_model_input_raw, labels_batch_tensor, original_input = (
+        video_id_join.get_joined_input_tensors(
+            all_readers,
+            all_train_data_patterns,
+            input_reader=input_reader,
+            input_data_pattern=input_data_pattern,
             batch_size=batch_size,
-            num_epochs=num_epochs))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-    
-    if original_input is not None:
-      id_match = tf.ones_like(original_video_id, dtype=tf.float32)
-      id_match = id_match * tf.cast(tf.equal(original_video_id, video_id), dtype=tf.float32)
-      tf.summary.scalar("model/id_match", tf.reduce_mean(id_match))
+            num_epochs=num_epochs,
+            shuffle=FLAGS.shuffle_data,
+            allow_missing_videos=True))
+    model_input_raw_tensors = [tf.expand_dims(model_input_raw, axis=2)
+                               for model_input_raw in all_model_input_raw]
+    reader = all_readers[-1]
+  else:
+    original_input = None
+    if input_data_pattern is not None:
+      original_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size,
+              num_epochs=num_epochs))
+
+    model_input_raw_tensors = []
+    labels_batch_tensor = None
+    for reader, data_pattern in zip(all_readers, all_train_data_patterns):
+      video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size,
+              num_epochs=num_epochs))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
+
+      if original_input is not None:
+        id_match = tf.ones_like(original_video_id, dtype=tf.float32)
+        id_match = id_match * tf.cast(tf.equal(original_video_id, video_id), dtype=tf.float32)
+        tf.summary.scalar("model/id_match", tf.reduce_mean(id_match))
 
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
@@ -553,8 +578,8 @@ class Trainer(object):
     all_patterns = FLAGS.train_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      all_readers.append(readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes))
+      all_readers.append(readers.get_prediction_reader(
+          all_patterns[i], feature_names, feature_sizes))
 
     input_reader = None
     input_data_pattern = None
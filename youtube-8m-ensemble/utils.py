@@ -172,3 +172,25 @@ def clip_gradient_norms(gradients_to_variables, max_norm):
         grad = tf.clip_by_norm(grad, max_norm)
     clipped_grads_and_vars.append((grad, var))
   return clipped_grads_and_vars
+
+def fold_constant(tensor, is_training=True, name="folded"):
+  """Computes a tensor that does not depend on the input once at inference.
+
+  In training, the tensor is returned as is, since its variables change at
+  every step. Otherwise it is the initial value of a local variable, computed
+  once by tf.local_variables_initializer() (that eval.py and the inference
+  binaries run after restoring the checkpoint) instead of at every batch.
+
+  Args:
+    tensor: A tensor of the variables of the model only, e.g. a product of
+      weight matrices.
+    is_training: Whether the model is built for training.
+    name: The name of the local variable.
+
+  Returns:
+    The tensor, or the local variable holding its value.
+  """
+  if is_training:
+    return tensor
+  return tf.Variable(tensor, trainable=False, name=name,
+                     collections=[tf.GraphKeys.LOCAL_VARIABLES])
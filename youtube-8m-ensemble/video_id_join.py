@@ -0,0 +1,274 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Aligns several prediction sources by video_id.
+
+Without it, the ensemble scripts rely on every source being written in the
+same order with the same file_size, so that row i of every stream is the same
+video. Here every data pattern gets an index of its videos, sorted by
+video_id, which records where each record starts in which file. The index is
+saved next to the files (see get_index_filename) and rebuilt whenever the
+files matching the pattern or their sizes change. The sources are joined on
+the videos they have in common and records are read by seeking into the
+files, so the shards may differ in size and order, and the joined videos can
+be shuffled.
+
+Videos missing from some sources are dropped from the join. That is fine for
+training and evaluation, but inference must predict every test video, so it
+raises an error instead unless the drop is allowed explicitly.
+"""
+
+import os
+import struct
+import threading
+from cStringIO import StringIO
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import gfile
+from tensorflow import logging
+
+import prediction_store
+
+INDEX_SUFFIX = ".video_id_index.npz"
+
+
+def get_index_filename(data_pattern):
+  """Returns the file of the index of data_pattern, next to the data."""
+  dirname, basename = os.path.split(data_pattern)
+  return os.path.join(
+      dirname, basename.replace("*", "_").replace("?", "_") + INDEX_SUFFIX)
+
+
+def get_file_sizes(files):
+  """Returns the sizes of the files, to detect files that were rewritten."""
+  return [gfile.Stat(filename).length for filename in files]
+
+
+def scan_tfrecord(filename):
+  """Returns the video ids, data offsets and lengths of a file's records."""
+  video_ids, offsets, lengths = [], [], []
+  with gfile.Open(filename, "rb") as F:
+    offset = 0
+    while True:
+      header = F.read(12)
+      if len(header) < 12:
+        break
+      length = struct.unpack("<Q", header[:8])[0]
+      data = F.read(length)
+      F.read(4)
+      example = tf.train.Example.FromString(data)
+      video_ids.append(example.features.feature["video_id"].bytes_list.value[0])
+      offsets.append(offset + 12)
+      lengths.append(length)
+      offset += 12 + length + 4
+  return video_ids, offsets, lengths
+
+
+def scan_prediction_store(filename):
+  """Returns the video ids, row offsets and lengths of a prediction store."""
+  store = prediction_store.PredictionStore(filename)
+  length = store.rows.dtype.itemsize
+  offsets = prediction_store.HEADER_BYTES + np.arange(store.num_rows) * length
+  return list(store.video_ids), list(offsets), [length] * store.num_rows
+
+
+def build_index(files):
+  """Builds the video_id index of the records in the files.
+
+  Returns:
+    A dict of the files and their sizes, and for every video (sorted by
+    video_id), the video_id, the index of its file, the offset and the length
+    of its record.
+  """
+  video_ids, file_indices, offsets, lengths = [], [], [], []
+  for file_index, filename in enumerate(files):
+    if filename.endswith(prediction_store.FILE_EXTENSION):
+      file_video_ids, file_offsets, file_lengths = scan_prediction_store(
+          filename)
+    else:
+      file_video_ids, file_offsets, file_lengths = scan_tfrecord(filename)
+    video_ids.extend(file_video_ids)
+    file_indices.extend([file_index] * len(file_video_ids))
+    offsets.extend(file_offsets)
+    lengths.extend(file_lengths)
+
+  video_ids = np.array(video_ids, dtype=np.string_)
+  unique_video_ids, first = np.unique(video_ids, return_index=True)
+  if len(unique_video_ids) < len(video_ids):
+    logging.warning("%d duplicated video ids in %s..., keeping the first ones.",
+                    len(video_ids) - len(unique_video_ids), files[0])
+  return {"files": np.array(files, dtype=np.string_),
+          "file_sizes": np.array(get_file_sizes(files), dtype=np.int64),
+          "video_ids": unique_video_ids,
+          "file_indices": np.array(file_indices, dtype=np.int32)[first],
+          "offsets": np.array(offsets, dtype=np.int64)[first],
+          "lengths": np.array(lengths, dtype=np.int64)[first]}
+
+
+def load_index(data_pattern):
+  """Loads the video_id index of data_pattern, building it if needed."""
+  files = sorted(f for f in gfile.Glob(data_pattern)
+                 if not f.endswith(INDEX_SUFFIX))
+  if not files:
+    raise IOError("Unable to find files. data_pattern='" + data_pattern + "'.")
+  index_filename = get_index_filename(data_pattern)
+  if gfile.Exists(index_filename):
+    with gfile.Open(index_filename, "rb") as F:
+      index = dict(np.load(StringIO(F.read())))
+    if (list(index["files"]) == files and
+        list(index["file_sizes"]) == get_file_sizes(files)):
+      return index
+    logging.info("Files of %s changed, rebuilding its index.", data_pattern)
+
+  logging.info("Building the video_id index of %s.", data_pattern)
+  index = build_index(files)
+  try:
+    buf = StringIO()
+    np.savez(buf, **index)
+    with gfile.Open(index_filename, "wb") as F:
+      F.write(buf.getvalue())
+  except (IOError, OSError, tf.errors.OpError) as e:
+    logging.warning("Unable to save the index %s: %s", index_filename, str(e))
+  return index
+
+
+class VideoIdJoin(object):
+  """Joins the records of several data patterns on their common videos."""
+
+  def __init__(self, data_patterns, allow_missing_videos=False):
+    """Indexes the data patterns and joins them on their common videos.
+
+    Args:
+      data_patterns: The glob paths of the sources.
+      allow_missing_videos: Whether to drop the videos that are not in every
+        source. If False, a ValueError is raised for them.
+    """
+    indexes = [load_index(data_pattern) for data_pattern in data_patterns]
+    video_ids = indexes[0]["video_ids"]
+    for index in indexes[1:]:
+      video_ids = np.intersect1d(video_ids, index["video_ids"])
+    missing = []
+    for data_pattern, index in zip(data_patterns, indexes):
+      num_missing = len(index["video_ids"]) - len(video_ids)
+      if num_missing:
+        logging.warning("%s: %d videos, %d not in every source.", data_pattern,
+                        len(index["video_ids"]), num_missing)
+        missing.append("%s (%d of %d)" % (data_pattern, num_missing,
+                                           len(index["video_ids"])))
+      else:
+        logging.info("%s: %d videos.", data_pattern, len(index["video_ids"]))
+    if missing and not allow_missing_videos:
+      raise ValueError("Videos of %s are not in every source, they would be "
+                       "dropped from the join." % ", ".join(missing))
+
+    # (files, file index, offset, length) of the joined videos in every source
+    self.video_ids = video_ids
+    self.sources = []
+    for index in indexes:
+      positions = np.searchsorted(index["video_ids"], video_ids)
+      self.sources.append((list(index["files"]),
+                           index["file_indices"][positions],
+                           index["offsets"][positions],
+                           index["lengths"][positions]))
+    self.local = threading.local()
+
+  def get_file(self, filename):
+    """Returns a file handle private to the calling thread."""
+    if not hasattr(self.local, "files"):
+      self.local.files = {}
+    if filename not in self.local.files:
+      self.local.files[filename] = gfile.Open(filename, "rb")
+    return self.local.files[filename]
+
+  def read_records(self, rows):
+    """Returns the records of the joined videos at rows, for every source."""
+    all_records = []
+    for files, file_indices, offsets, lengths in self.sources:
+      records = []
+      for row in rows:
+        F = self.get_file(files[file_indices[row]])
+        F.seek(offsets[row])
+        records.append(F.read(lengths[row]))
+      all_records.append(np.array(records, dtype=np.object_))
+    return all_records
+
+  def prepare_join(self, batch_size, num_epochs=None, shuffle=False):
+    """Returns string tensors of up to batch_size aligned records per source."""
+    row_queue = tf.train.range_input_producer(
+        len(self.video_ids), num_epochs=num_epochs, shuffle=shuffle)
+    rows = row_queue.dequeue_up_to(batch_size)
+    all_records = tf.py_func(self.read_records, [rows],
+                             [tf.string] * len(self.sources))
+    for records in all_records:
+      records.set_shape([None])
+    return all_records
+
+
+def get_joined_input_tensors(all_readers,
+                             all_data_patterns,
+                             input_reader=None,
+                             input_data_pattern=None,
+                             batch_size=256,
+                             num_epochs=None,
+                             shuffle=False,
+                             allow_missing_videos=False):
+  """Creates the input section of the graph aligning sources by video_id.
+
+  Args:
+    all_readers: The readers of the prediction sources. They should have a
+      decode method, as EnsembleReader and EnsemblePredictionStoreReader.
+    all_data_patterns: The glob paths of the prediction sources.
+    input_reader: The reader of the original model input, or None.
+    input_data_pattern: The glob path of the original model input, or None.
+    batch_size: How many examples to process at a time.
+    num_epochs: How many passes to make over the data. 'None' means an
+      unlimited number of passes.
+    shuffle: Whether to shuffle the videos.
+    allow_missing_videos: Whether to drop the videos that are not in every
+      source instead of raising a ValueError.
+
+  Returns:
+    A tuple of the video_id batch, a list of the input batch of every
+    prediction source, the labels batch (of the first source), and the
+    original input batch (None without input_reader).
+  """
+  all_readers = list(all_readers)
+  all_data_patterns = list(all_data_patterns)
+  if input_reader is not None:
+    all_readers.append(input_reader)
+    all_data_patterns.append(input_data_pattern)
+
+  with tf.name_scope("join_input"):
+    join = VideoIdJoin(all_data_patterns,
+                       allow_missing_videos=allow_missing_videos)
+    all_records = join.prepare_join(batch_size, num_epochs=num_epochs,
+                                    shuffle=shuffle)
+    video_id, first_input, labels, unused_num_frames = (
+        all_readers[0].decode(all_records[0]))
+    tensors = [video_id, labels, first_input]
+    for reader, records in zip(all_readers[1:], all_records[1:]):
+      tensors.append(reader.decode(records)[1])
+    batch = tf.train.batch(
+        tensors,
+        batch_size=batch_size,
+        capacity=4 * batch_size,
+        allow_smaller_final_batch=True,
+        enqueue_many=True)
+
+  video_id_batch, labels_batch, all_inputs = batch[0], batch[1], batch[2:]
+  original_input = None
+  if input_reader is not None:
+    original_input = all_inputs.pop()
+  return video_id_batch, all_inputs, labels_batch, original_input
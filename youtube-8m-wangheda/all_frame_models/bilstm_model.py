@@ -12,6 +12,8 @@ FLAGS = flags.FLAGS
 
 class BiLstmModel(models.BaseModel):
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, **unused_params):
     """Creates a model which uses a stack of Bi LSTMs to represent the video.
 
@@ -33,6 +33,8 @@ class DbofModel(models.BaseModel):
     'batch_size' x 'num_classes'.
   """
 
+  variable_frames = True
+
   def create_model(self,
                    model_input,
                    vocab_size,
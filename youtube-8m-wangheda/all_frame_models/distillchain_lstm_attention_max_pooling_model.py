@@ -10,6 +10,8 @@ FLAGS = flags.FLAGS
 class DistillchainLstmAttentionMaxPoolingModel(models.BaseModel):
   """Max pooling over temporal weighted sums (attention) of lstm outputs."""
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, 
                    num_mixtures=None, l2_penalty=1e-8, sub_scope="", 
                    distillation_predictions=None,
@@ -13,6 +13,8 @@ FLAGS = flags.FLAGS
 class DistillchainLstmMemoryDeepCombineChainModel(models.BaseModel):
   """Classifier chain model of lstm memory"""
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, 
                    l2_penalty=1e-8, sub_scope="", original_input=None, 
                    distillation_predictions=None,
@@ -12,6 +12,8 @@ FLAGS = flags.FLAGS
 
 class DistillchainLstmParallelFinaloutputModel(models.BaseModel):
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames,
                    distillation_predictions=None,
                    l2_penalty=1e-8,
@@ -12,6 +12,8 @@ FLAGS = flags.FLAGS
 
 class LayerNormLstmMemoryModel(models.BaseModel):
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, 
                    dropout=False, keep_prob=None, noise_level=None,
                    **unused_params):
@@ -12,6 +12,8 @@ FLAGS = flags.FLAGS
 
 class LstmAuxlossDeepCombineChainModel(models.BaseModel):
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, num_mixtures=None,
                    l2_penalty=1e-8, sub_scope="", original_input=None, **unused_params):
     """Creates a model that use different times of output of lstm
@@ -13,6 +13,8 @@ FLAGS = flags.FLAGS
 class LstmMemoryChainModel(models.BaseModel):
   """Classifier chain model of lstm memory"""
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, **unused_params):
     """Creates a model which uses a stack of LSTMs to represent the video.
 
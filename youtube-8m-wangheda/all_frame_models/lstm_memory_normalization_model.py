@@ -13,6 +13,8 @@ FLAGS = flags.FLAGS
 class LstmMemoryNormalizationModel(models.BaseModel):
   """layer normalization (not the Hinton one)"""
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, **unused_params):
     """Creates a model which uses a stack of LSTMs to represent the video.
 
@@ -13,6 +13,8 @@ FLAGS = flags.FLAGS
 class MultiresLstmMemoryDeepCombineChainModel(models.BaseModel):
   """Classifier chain model of lstm memory"""
 
+  variable_frames = True
+
   def lstm(self, model_input, vocab_size, num_frames, sub_scope="", **unused_params):
     number_of_layers = FLAGS.lstm_layers
     lstm_sizes = map(int, FLAGS.lstm_cells.split(","))
@@ -150,6 +152,9 @@ class MultiresLstmMemoryDeepCombineChainModel(models.BaseModel):
     frame_dim = len(model_input_raw.get_shape()) - 2
     feature_dim = len(model_input_raw.get_shape()) - 1
     max_frames = model_input_raw.get_shape().as_list()[frame_dim]
+    if max_frames is None:
+      # e.g. the batches of --bucket_boundaries
+      max_frames = tf.shape(model_input_raw)[frame_dim]
     num_features = model_input_raw.get_shape().as_list()[feature_dim]
     if resolution > 1:
       new_max_frames = max_frames / resolution
@@ -0,0 +1,140 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for measuring the speed of the GAP computation.
+
+Synthetic top-20 predictions are accumulated in an AveragePrecisionCalculator
+and its ap is computed, as eval_util.calculate_gap does, and compared with the
+heap based implementation it replaced (legacy_gap). The legacy one keeps
+about 130 bytes of Python objects per point, so it is skipped above
+--max_legacy_points.
+
+The GAP estimated by a HistogramAveragePrecisionCalculator of every number of
+--histogram_bins is then reported against the exact one, with its memory and
+the width of its error bounds.
+"""
+
+import heapq
+import random
+import time
+
+import numpy
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import logging
+
+import average_precision_calculator as ap_calculator
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("sizes", "1000000,10000000,30000000",
+                      "Comma separated numbers of accumulated points.")
+  flags.DEFINE_integer("batch_points", 20 * 1024,
+                       "Number of points accumulated per call.")
+  flags.DEFINE_integer("max_legacy_points", 10000000,
+                       "Largest number of points to run the legacy code on.")
+  flags.DEFINE_string("histogram_bins", "1024,4096,16384,65536,262144,1048576",
+                      "Comma separated numbers of bins of the histogram "
+                      "estimator.")
+
+
+def synthetic_points(num_points):
+  """Returns float32 sigmoid predictions and 0/1 labels."""
+  rng = numpy.random.RandomState(0)
+  logits = rng.randn(num_points).astype(numpy.float32) * 2 - 2
+  predictions = (1 / (1 + numpy.exp(-logits))).astype(numpy.float32)
+  actuals = (rng.rand(num_points) < predictions * 0.5).astype(numpy.int64)
+  return predictions, actuals
+
+
+def legacy_gap(predictions, actuals, batch_points):
+  """The heap, sort and loop of the former AveragePrecisionCalculator."""
+  heap = []
+  for start in range(0, len(predictions), batch_points):
+    batch_predictions = predictions[start:start + batch_points]
+    batch_actuals = actuals[start:start + batch_points]
+    for i in range(numpy.size(batch_predictions)):
+      heapq.heappush(heap, (batch_predictions[i], batch_actuals[i]))
+  predlists = numpy.array(list(zip(*heap)))
+  predictions, actuals = predlists[0], predlists[1]
+  random.seed(0)
+  suffidx = random.sample(range(len(predictions)), len(predictions))
+  predictions = predictions[suffidx]
+  actuals = actuals[suffidx]
+  sortidx = sorted(range(len(predictions)), key=lambda k: predictions[k],
+                   reverse=True)
+  delta_recall = 1.0 / numpy.size(numpy.where(actuals > 0))
+  ap = 0.0
+  poscount = 0.0
+  for i in range(len(sortidx)):
+    if actuals[sortidx[i]] > 0:
+      poscount += 1
+      ap += poscount / (i + 1) * delta_recall
+  return ap
+
+
+def gap(predictions, actuals, batch_points, calculator=None):
+  if calculator is None:
+    calculator = ap_calculator.AveragePrecisionCalculator()
+  for start in range(0, len(predictions), batch_points):
+    calculator.accumulate(predictions[start:start + batch_points],
+                          actuals[start:start + batch_points])
+  return calculator.peek_ap_at_n()
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  print("%-10s %12s %12s %9s %14s" % (
+      "points", "legacy (s)", "numpy (s)", "speedup", "|dGAP|"))
+  exact_values = {}
+  for num_points in map(int, FLAGS.sizes.split(",")):
+    predictions, actuals = synthetic_points(num_points)
+    start_time = time.time()
+    value = gap(predictions, actuals, FLAGS.batch_points)
+    seconds = time.time() - start_time
+    exact_values[num_points] = (value, seconds)
+    if num_points <= FLAGS.max_legacy_points:
+      start_time = time.time()
+      legacy_value = legacy_gap(predictions, actuals, FLAGS.batch_points)
+      legacy_seconds = time.time() - start_time
+      print("%-10d %12.2f %12.2f %8.1fx %14.3g" % (
+          num_points, legacy_seconds, seconds, legacy_seconds / seconds,
+          abs(value - legacy_value)))
+    else:
+      print("%-10d %12s %12.2f %9s %14s" % (num_points, "-", seconds, "-", "-"))
+
+  print("")
+  print("%-10s %9s %12s %12s %12s %12s" % (
+      "points", "bins", "memory", "seconds", "|dGAP|", "bound width"))
+  for num_points in map(int, FLAGS.sizes.split(",")):
+    predictions, actuals = synthetic_points(num_points)
+    value, seconds = exact_values[num_points]
+    # the exact calculator keeps every point
+    print("%-10d %9s %11dK %12.2f %12s %12s" % (
+        num_points, "exact", (predictions.nbytes + actuals.nbytes) // 1024,
+        seconds, "-", "-"))
+    for num_bins in map(int, FLAGS.histogram_bins.split(",")):
+      calculator = ap_calculator.HistogramAveragePrecisionCalculator(num_bins)
+      start_time = time.time()
+      estimate = gap(predictions, actuals, FLAGS.batch_points, calculator)
+      seconds = time.time() - start_time
+      lower, upper = calculator.peek_ap_bounds()
+      print("%-10d %9d %11dK %12.2f %12.3g %12.3g" % (
+          num_points, num_bins, num_bins * 16 // 1024, seconds,
+          abs(estimate - value), upper - lower))
+
+
+if __name__ == "__main__":
+  app.run()
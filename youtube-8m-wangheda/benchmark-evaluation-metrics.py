@@ -0,0 +1,192 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for measuring the per-batch cost of eval_util.EvaluationMetrics.
+
+Synthetic batches of sigmoid predictions are accumulated, as eval.py does, by
+the per-class and global ap calculators from the top k of every video, and
+compared with the per-video triplet lists and the per-class
+AveragePrecisionCalculator they replaced (LegacyMeanAveragePrecision).
+
+The batch metrics PERR and Recall@N are then timed against the per-video
+loops they replaced.
+"""
+
+import time
+
+import numpy
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import logging
+
+import average_precision_calculator as ap_calculator
+import eval_util
+import mean_average_precision_calculator as map_calculator
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_integer("num_classes", 4716,
+                       "Number of classes.")
+  flags.DEFINE_integer("batch_size", 1024,
+                       "Number of videos per batch.")
+  flags.DEFINE_integer("num_batches", 20,
+                       "Number of batches to accumulate.")
+  flags.DEFINE_integer("top_k", 20,
+                       "How many predictions to accumulate per video.")
+  flags.DEFINE_integer("recall_n", 20,
+                       "The n of Recall@N.")
+
+
+def synthetic_batches(num_batches, batch_size, num_classes):
+  """Yields float32 sigmoid predictions and 0/1 labels of a few classes."""
+  rng = numpy.random.RandomState(0)
+  for _ in range(num_batches):
+    labels = numpy.zeros([batch_size, num_classes], dtype=numpy.float32)
+    for i in range(batch_size):
+      labels[i, rng.randint(0, num_classes, size=rng.randint(1, 6))] = 1
+    logits = 4.0 * labels - 5.0 + rng.randn(batch_size, num_classes) * 1.5
+    predictions = (1.0 / (1.0 + numpy.exp(-logits))).astype(numpy.float32)
+    yield predictions, labels
+
+
+class LegacyMeanAveragePrecision(object):
+  """The former per-video triplets and per-class calculators."""
+
+  def __init__(self, num_classes, top_k):
+    self.top_k = top_k
+    self.calculators = [ap_calculator.AveragePrecisionCalculator()
+                        for _ in range(num_classes)]
+    self.global_calculator = ap_calculator.AveragePrecisionCalculator()
+
+  def accumulate(self, predictions, labels):
+    num_classes = predictions.shape[1]
+    triplets = []
+    for video_index in range(predictions.shape[0]):
+      triplets.extend(eval_util.top_k_triplets(
+          predictions[video_index], labels[video_index], self.top_k))
+    out_predictions = [[] for _ in range(num_classes)]
+    out_labels = [[] for _ in range(num_classes)]
+    for triplet in triplets:
+      out_predictions[triplet[0]].append(triplet[1])
+      out_labels[triplet[0]].append(triplet[2])
+    num_positives = [numpy.sum(labels[:, i]) for i in range(num_classes)]
+    for i in range(num_classes):
+      self.calculators[i].accumulate(out_predictions[i], out_labels[i],
+                                     num_positives[i])
+    self.global_calculator.accumulate(eval_util.flatten(out_predictions),
+                                      eval_util.flatten(out_labels),
+                                      sum(num_positives))
+
+  def get(self):
+    return ([calculator.peek_ap_at_n() for calculator in self.calculators],
+            self.global_calculator.peek_ap_at_n())
+
+
+class MeanAveragePrecision(object):
+  """The accumulation of eval_util.EvaluationMetrics."""
+
+  def __init__(self, num_classes, top_k):
+    self.top_k = top_k
+    self.calculator = map_calculator.MeanAveragePrecisionCalculator(
+        num_classes)
+    self.global_calculator = ap_calculator.AveragePrecisionCalculator()
+
+  def accumulate(self, predictions, labels):
+    classes, top_predictions, top_labels = eval_util.top_k_by_video(
+        predictions, labels, self.top_k)
+    num_positives = numpy.sum(labels, axis=0)
+    self.calculator.accumulate_top_k(classes, top_predictions, top_labels,
+                                     num_positives)
+    order = numpy.argsort(classes, axis=None, kind="mergesort")
+    self.global_calculator.accumulate(top_predictions.ravel()[order],
+                                      top_labels.ravel()[order],
+                                      numpy.sum(num_positives))
+
+  def get(self):
+    return (self.calculator.peek_map_at_n(),
+            self.global_calculator.peek_ap_at_n())
+
+
+def legacy_top_k_precision(predictions, actuals, n=None):
+  """The former loops of PERR (n=None) and of Recall@N."""
+  aggregated = 0.0
+  num_videos = actuals.shape[0]
+  for row in numpy.arange(num_videos):
+    num_labels = int(numpy.sum(actuals[row]))
+    k = num_labels if n is None else n
+    top_indices = numpy.argpartition(predictions[row], -k)[-k:]
+    item = 0.0
+    for label_index in top_indices:
+      if predictions[row][label_index] > 0:
+        item += actuals[row][label_index]
+    item /= top_indices.size if n is None else num_labels
+    aggregated += item
+  aggregated /= num_videos
+  return aggregated
+
+
+def measure(metrics, batches):
+  """Returns the seconds per accumulated batch, of the get and its value."""
+  accumulate_seconds = 0.0
+  for predictions, labels in batches:
+    start_time = time.time()
+    metrics.accumulate(predictions, labels)
+    accumulate_seconds += time.time() - start_time
+  start_time = time.time()
+  value = metrics.get()
+  return accumulate_seconds / len(batches), time.time() - start_time, value
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  batches = list(synthetic_batches(FLAGS.num_batches, FLAGS.batch_size,
+                                   FLAGS.num_classes))
+  results = []
+  for name, metrics_class in [("legacy", LegacyMeanAveragePrecision),
+                              ("arrays", MeanAveragePrecision)]:
+    metrics = metrics_class(FLAGS.num_classes, FLAGS.top_k)
+    results.append((name,) + measure(metrics, batches))
+
+  legacy_aps, legacy_gap = results[0][3]
+  print("%-8s %16s %10s %8s %9s" % (
+      "mode", "accumulate (ms)", "peek (s)", "MAP", "same aps"))
+  for name, accumulate_seconds, get_seconds, (aps, gap) in results:
+    print("%-8s %16.1f %10.2f %8.5f %9s" % (
+        name, accumulate_seconds * 1000, get_seconds, numpy.mean(aps),
+        aps == legacy_aps and gap == legacy_gap))
+
+  print("")
+  print("%-10s %12s %12s %9s %6s" % (
+      "metric", "legacy (ms)", "numpy (ms)", "speedup", "same"))
+  for name, legacy, metric in [
+      ("perr", legacy_top_k_precision,
+       eval_util.calculate_precision_at_equal_recall_rate),
+      ("recall@%d" % FLAGS.recall_n,
+       lambda p, a: legacy_top_k_precision(p, a, FLAGS.recall_n),
+       lambda p, a: eval_util.calculate_recall_at_n(p, a, FLAGS.recall_n))]:
+    seconds = []
+    values = []
+    for function in [legacy, metric]:
+      start_time = time.time()
+      values.append([function(predictions, labels)
+                     for predictions, labels in batches])
+      seconds.append((time.time() - start_time) / len(batches))
+    print("%-10s %12.1f %12.1f %8.1fx %6s" % (
+        name, seconds[0] * 1000, seconds[1] * 1000, seconds[0] / seconds[1],
+        values[0] == values[1]))
+
+
+if __name__ == "__main__":
+  app.run()
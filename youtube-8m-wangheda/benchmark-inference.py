@@ -0,0 +1,122 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for measuring the throughput of inference.py with --direct_input.
+
+A synthetic frame-level dataset is written to a temporary directory and the
+predictions of the checkpoint in --train_dir (a frame-level model trained on
+the same features) are computed with and without --direct_input, alternating
+the two modes --num_runs times. The time of a run includes restoring the
+checkpoint, which is the same in both modes.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import logging
+
+import inference
+import readers
+import utils
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("train_dir", "/tmp/yt8m_model/",
+                      "The directory to load the frame-level model from.")
+  flags.DEFINE_string("model_checkpoint_path", "",
+                      "The file path to load the model from.")
+  flags.DEFINE_string("feature_names", "rgb,audio", "Name of the feature "
+                      "to use for training.")
+  flags.DEFINE_string("feature_sizes", "1024,128",
+                      "Length of the feature vectors.")
+  flags.DEFINE_integer("num_videos", 1024,
+                       "Number of synthetic videos.")
+  flags.DEFINE_integer("num_shards", 4,
+                       "Number of files of synthetic videos.")
+  flags.DEFINE_integer("max_frames", 300,
+                       "Maximum number of frames of a synthetic video.")
+  flags.DEFINE_integer("batch_size", 256,
+                       "How many examples to process per batch.")
+  flags.DEFINE_integer("num_runs", 3,
+                       "How many times to run each mode.")
+  flags.DEFINE_integer("top_k", 20,
+                       "How many predictions to output per video.")
+  flags.DEFINE_bool("dropout", False,
+                    "Whether to consider dropout.")
+  flags.DEFINE_float("keep_prob", 1.0,
+                     "Probability to keep output, if dropout is set.")
+
+
+def write_synthetic_videos(data_dir, feature_names, feature_sizes):
+  """Writes random frame-level SequenceExamples and returns their pattern."""
+  rng = np.random.RandomState(0)
+  for shard in range(FLAGS.num_shards):
+    filename = os.path.join(data_dir, "synthetic%04d.tfrecord" % shard)
+    with tf.python_io.TFRecordWriter(filename) as writer:
+      for video in range(shard, FLAGS.num_videos, FLAGS.num_shards):
+        example = tf.train.SequenceExample()
+        context = example.context.feature
+        context["video_id"].bytes_list.value.append("v%06d" % video)
+        context["labels"].int64_list.value.extend(
+            rng.randint(0, 4716, size=rng.randint(1, 6)))
+        num_frames = rng.randint(FLAGS.max_frames // 2, FLAGS.max_frames + 1)
+        for feature_name, feature_size in zip(feature_names, feature_sizes):
+          frames = rng.randint(0, 256, size=[num_frames, feature_size])
+          feature_list = example.feature_lists.feature_list[feature_name]
+          for frame in frames.astype(np.uint8):
+            feature_list.feature.add().bytes_list.value.append(frame.tobytes())
+        writer.write(example.SerializeToString())
+  return os.path.join(data_dir, "synthetic*.tfrecord")
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.ERROR)
+  feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
+      FLAGS.feature_names, FLAGS.feature_sizes)
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    data_pattern = write_synthetic_videos(temp_dir, feature_names,
+                                          feature_sizes)
+    out_file = os.path.join(temp_dir, "predictions.csv")
+    seconds = {False: [], True: []}
+    for _ in range(FLAGS.num_runs):
+      for direct_input in [False, True]:
+        reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
+                                                feature_sizes=feature_sizes)
+        with tf.Graph().as_default():
+          start_time = time.time()
+          inference.inference(reader, FLAGS.train_dir, data_pattern, out_file,
+                              FLAGS.batch_size, FLAGS.top_k,
+                              direct_input=direct_input)
+          seconds[direct_input].append(time.time() - start_time)
+  finally:
+    shutil.rmtree(temp_dir)
+
+  print("%-14s %10s %14s" % ("mode", "seconds", "examples/sec"))
+  for direct_input in [False, True]:
+    best = min(seconds[direct_input])
+    print("%-14s %10.2f %14.1f" % (
+        "direct_input" if direct_input else "feed_dict", best,
+        FLAGS.num_videos / best))
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,124 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for measuring the input throughput (examples/sec) of readers.
+
+Each reader is plugged into the same input pipeline as train.py
+(string_input_producer + shuffle_batch_join) and the batches are pulled
+without running any model, so the numbers are an upper bound of the training
+speed that the reader can sustain.
+
+The batch readers return uint8 frames, so compare them with --quantized_frames:
+
+  python benchmark-readers.py --train_data_pattern=... --quantized_frames \
+      --readers=YT8MFrameFeatureReader,YT8MFrameFeatureBatchReader
+"""
+
+import time
+
+import readers
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+import utils
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("train_data_pattern", "",
+                      "File glob for the training dataset.")
+  flags.DEFINE_string("feature_names", "rgb,audio", "Name of the feature "
+                      "to use for training.")
+  flags.DEFINE_string("feature_sizes", "1024,128",
+                      "Length of the feature vectors.")
+  flags.DEFINE_string("readers", "YT8MFrameFeatureReader",
+                      "Comma separated list of the reader classes to compare.")
+  flags.DEFINE_bool("quantized_frames", False,
+                    "If set, the frame-level readers keep the features as "
+                    "uint8, as train.py does with --quantized_frames.")
+  flags.DEFINE_integer("batch_size", 128,
+                       "How many examples to process per batch.")
+  flags.DEFINE_integer("num_readers", 4,
+                       "How many threads to use for reading input files.")
+  flags.DEFINE_integer("warmup_batches", 10,
+                       "How many batches to skip before timing.")
+  flags.DEFINE_integer("num_batches", 100,
+                       "How many batches to time.")
+
+
+def benchmark_reader(reader, files):
+  """Returns the examples/sec of pulling batches produced by the reader."""
+  with tf.Graph().as_default():
+    filename_queue = tf.train.string_input_producer(files, shuffle=True)
+    training_data = [
+        reader.prepare_reader(filename_queue) for _ in range(FLAGS.num_readers)
+    ]
+    batch = tf.train.shuffle_batch_join(
+        training_data,
+        batch_size=FLAGS.batch_size,
+        capacity=FLAGS.batch_size * 10,
+        min_after_dequeue=FLAGS.batch_size,
+        allow_smaller_final_batch=True,
+        enqueue_many=True)
+
+    with tf.Session() as sess:
+      sess.run([tf.global_variables_initializer(),
+                tf.local_variables_initializer()])
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      for _ in range(FLAGS.warmup_batches):
+        sess.run(batch)
+      num_examples = 0
+      start_time = time.time()
+      for _ in range(FLAGS.num_batches):
+        num_examples += sess.run(batch)[2].shape[0]
+      seconds = time.time() - start_time
+      coord.request_stop()
+      coord.join(threads, stop_grace_period_secs=10)
+  return num_examples / seconds
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
+      FLAGS.feature_names, FLAGS.feature_sizes)
+  files = gfile.Glob(FLAGS.train_data_pattern)
+  if not files:
+    raise IOError("Unable to find training files. data_pattern='" +
+                  FLAGS.train_data_pattern + "'.")
+
+  results = []
+  for reader_name in FLAGS.readers.split(","):
+    reader_class = getattr(readers, reader_name.strip())
+    if issubclass(reader_class, (readers.YT8MFrameFeatureReader,
+                                 readers.YT8MFrameFeatureCacheReader)):
+      reader = reader_class(feature_names=feature_names,
+                            feature_sizes=feature_sizes,
+                            dequantize=not FLAGS.quantized_frames)
+    else:
+      reader = reader_class(feature_names=feature_names,
+                            feature_sizes=feature_sizes)
+    examples_per_second = benchmark_reader(reader, files)
+    logging.info("%s: %.2f examples/sec", reader_name, examples_per_second)
+    results.append((reader_name, examples_per_second))
+
+  baseline = results[0][1]
+  for reader_name, examples_per_second in results:
+    print("%-45s %10.2f examples/sec  x%.2f" % (
+        reader_name, examples_per_second, examples_per_second / baseline))
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,125 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for converting frame-level TFRecords into a columnar frame cache.
+
+Every TFRecord shard is converted once into a directory of .npy arrays (see
+readers.YT8MFrameFeatureCacheReader for the layout), which is read by setting
+--frame_cache and pointing --train_data_pattern to the "index" files, e.g.
+"/Youtube-8M/data/frame/cache/train*/index".
+"""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+import utils
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("input_data_pattern", "",
+                      "File glob of the frame-level TFRecords to convert.")
+  flags.DEFINE_string("output_dir", "",
+                      "The directory to write the cache shards to.")
+  flags.DEFINE_string("feature_names", "rgb,audio", "Name of the feature "
+                      "to convert.")
+  flags.DEFINE_string("feature_sizes", "1024,128",
+                      "Length of the feature vectors.")
+
+
+def convert_shard(filename, shard_dir, feature_names, feature_sizes):
+  """Converts a TFRecord of SequenceExamples into a cache shard.
+
+  The index file is written last, so a shard that was interrupted is not
+  matched by the data pattern and is converted again on the next run.
+
+  Returns:
+    The number of videos in the shard.
+  """
+  frames = [[] for _ in feature_names]
+  offsets, num_frames, label_offsets, label_indices, video_ids = [], [], [0], [], []
+  num_rows = 0
+  for record in tf.python_io.tf_record_iterator(filename):
+    example = tf.train.SequenceExample.FromString(record)
+    context = example.context.feature
+    video_ids.append(context["video_id"].bytes_list.value[0])
+    labels = context["labels"].int64_list.value
+    label_indices.extend(labels)
+    label_offsets.append(label_offsets[-1] + len(labels))
+
+    video_frames = -1
+    for i, (feature_name, feature_size) in enumerate(
+        zip(feature_names, feature_sizes)):
+      feature_list = example.feature_lists.feature_list[feature_name].feature
+      matrix = np.frombuffer(
+          b"".join(f.bytes_list.value[0] for f in feature_list),
+          dtype=np.uint8).reshape([-1, feature_size])
+      if video_frames == -1:
+        video_frames = matrix.shape[0]
+      elif video_frames != matrix.shape[0]:
+        raise ValueError("Video %s has different numbers of frames across "
+                         "features." % video_ids[-1])
+      frames[i].append(matrix)
+    offsets.append(num_rows)
+    num_frames.append(video_frames)
+    num_rows += video_frames
+
+  if not gfile.Exists(shard_dir):
+    gfile.MakeDirs(shard_dir)
+  for feature_name, feature_size, matrices in zip(feature_names, feature_sizes,
+                                                  frames):
+    if matrices:
+      matrix = np.concatenate(matrices)
+    else:
+      matrix = np.zeros([0, feature_size], dtype=np.uint8)
+    np.save(os.path.join(shard_dir, feature_name + ".npy"), matrix)
+  np.save(os.path.join(shard_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+  np.save(os.path.join(shard_dir, "num_frames.npy"), np.array(num_frames, dtype=np.int32))
+  np.save(os.path.join(shard_dir, "label_offsets.npy"), np.array(label_offsets, dtype=np.int64))
+  np.save(os.path.join(shard_dir, "label_indices.npy"), np.array(label_indices, dtype=np.int32))
+  np.save(os.path.join(shard_dir, "video_ids.npy"), np.array(video_ids, dtype=np.string_))
+  with open(os.path.join(shard_dir, "index"), "w") as F:
+    for row in range(len(video_ids)):
+      F.write("%d\n" % row)
+  return len(video_ids)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
+      FLAGS.feature_names, FLAGS.feature_sizes)
+  files = gfile.Glob(FLAGS.input_data_pattern)
+  if not files:
+    raise IOError("Unable to find input files. data_pattern='" +
+                  FLAGS.input_data_pattern + "'.")
+
+  for filename in sorted(files):
+    shard_name = os.path.basename(filename)
+    if shard_name.endswith(".tfrecord"):
+      shard_name = shard_name[:-len(".tfrecord")]
+    shard_dir = os.path.join(FLAGS.output_dir, shard_name)
+    if gfile.Exists(os.path.join(shard_dir, "index")):
+      logging.info("Skipping %s, already converted.", filename)
+      continue
+    num_videos = convert_shard(filename, shard_dir, feature_names, feature_sizes)
+    logging.info("Converted %d videos from %s to %s.", num_videos, filename,
+                 shard_dir)
+
+
+if __name__ == "__main__":
+  app.run()
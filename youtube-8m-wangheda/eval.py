@@ -13,8 +13,11 @@
 # limitations under the License.
 """Binary for evaluating Tensorflow models on the YouTube-8M dataset."""
 
+import os
+import re
 import time
 
+import numpy
 import eval_util
 import losses
 import frame_level_models
@@ -30,6 +33,10 @@ import utils
 
 FLAGS = flags.FLAGS
 
+# the variable scope of the model copy of every checkpoint, with
+# --model_checkpoint_paths
+CHECKPOINT_SCOPE = "checkpoint_%d"
+
 if __name__ == "__main__":
   # Dataset flags.
   flags.DEFINE_string("train_dir", "/tmp/yt8m_model/",
@@ -38,6 +45,18 @@ if __name__ == "__main__":
                       "directory.")
   flags.DEFINE_string("model_checkpoint_path", "",
                       "The file to load the model files from. ")
+  flags.DEFINE_string(
+      "model_checkpoint_paths", "",
+      "Comma separated checkpoints, or globs of checkpoint files (e.g. "
+      "model.ckpt-*.index), to evaluate together in a single pass over the "
+      "evaluation data, each restored into its own copy of the model. "
+      "Overrides --model_checkpoint_path and --run_once, and ends with a table "
+      "of the checkpoints ranked by GAP.")
+  flags.DEFINE_integer(
+      "checkpoints_per_pass", 0,
+      "With --model_checkpoint_paths, how many checkpoints to evaluate per "
+      "pass over the evaluation data, to bound the memory of the model "
+      "copies. 0 means all of them.")
   flags.DEFINE_string(
       "eval_data_pattern", "",
       "File glob defining the evaluation dataset in tensorflow.SequenceExample "
@@ -57,6 +76,21 @@ if __name__ == "__main__":
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "frame_batch_reader", False,
+      "If set, frame-level features are read by the *FeatureBatchReader, which "
+      "reads and decodes blocks of SequenceExamples per op. It needs "
+      "--quantized_frames.")
+  flags.DEFINE_bool(
+      "quantized_frames", False,
+      "If set, frame-level features are kept as uint8 in the input queues and "
+      "dequantized in the graph right before the model, which takes about 4x "
+      "less queue memory.")
+  flags.DEFINE_bool(
+      "frame_cache", False,
+      "If set, frame-level features are read by the YT8MFrameFeatureCacheReader "
+      "from a cache written by convert-frame-cache.py, and the data pattern "
+      "must match the index files of the cache.")
   flags.DEFINE_string(
       "model", "LogisticModel",
       "Which architecture to use for the model. Options include 'Logistic', "
@@ -72,6 +106,26 @@ if __name__ == "__main__":
                        "How many threads to use for reading input files.")
   flags.DEFINE_boolean("run_once", False, "Whether to run eval only once.")
   flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+  flags.DEFINE_integer(
+      "metric_queue_size", 2,
+      "How many batches may wait for the thread accumulating the metrics, "
+      "which overlaps with the inference of the next batches. 0 accumulates "
+      "them synchronously.")
+  flags.DEFINE_integer(
+      "gap_histogram_bins", 0,
+      "If positive, estimate the GAP from histograms of this many bins of the "
+      "predictions, in bounded memory, instead of computing it exactly. The "
+      "memory of the MAP still grows with the number of videos.")
+  flags.DEFINE_integer(
+      "num_shards", 1,
+      "Split the sorted evaluation files into this many consecutive shards, "
+      "and evaluate only the shard --shard_index.")
+  flags.DEFINE_integer("shard_index", 0,
+                       "Which shard of the evaluation files to evaluate.")
+  flags.DEFINE_string(
+      "metric_state_file", "",
+      "If set, the accumulated metrics are also written to this .npz file, to "
+      "be merged with the ones of the other shards by merge-eval-states.py.")
   flags.DEFINE_bool(
       "multitask", False,
       "Whether to consider support_predictions")
@@ -90,17 +144,35 @@ def find_class_by_name(name, modules):
   return next(a for a in modules if a)
 
 
+def get_shard(files, shard_index, num_shards):
+  """Returns the consecutive files of shard shard_index of num_shards.
+
+  The shards of a sorted list keep its order, so that the metrics of the
+  shards merged in order are those of all the files.
+  """
+  if not 0 <= shard_index < num_shards:
+    raise ValueError("shard_index must be in [0, num_shards).")
+  return files[len(files) * shard_index // num_shards:
+               len(files) * (shard_index + 1) // num_shards]
+
+
 def get_input_evaluation_tensors(reader,
                                  data_pattern,
-                                 batch_size=1024):
+                                 batch_size=1024,
+                                 shard_index=0,
+                                 num_shards=1):
 
   logging.info("Using batch size of " + str(batch_size) + " for evaluation.")
   with tf.name_scope("eval_input"):
     files = gfile.Glob(data_pattern)
     if not files:
       raise IOError("Unable to find the evaluation files.")
-    logging.info("number of evaluation files: " + str(len(files)))
     files.sort()
+    files = get_shard(files, shard_index, num_shards)
+    if not files:
+      raise IOError("Shard %d of %d has no evaluation files." % (
+          shard_index, num_shards))
+    logging.info("number of evaluation files: " + str(len(files)))
     filename_queue = tf.train.string_input_producer(
         files, shuffle=False, num_epochs=1)
     eval_data = reader.prepare_reader(filename_queue)
@@ -119,7 +191,8 @@ def build_graph(reader,
                 batch_size=1024,
                 transformer_class=feature_transform.DefaultTransformer,
                 distill_reader=None,
-                num_readers=1):
+                num_readers=1,
+                num_checkpoints=None):
   """Creates the Tensorflow graph for evaluation.
 
   Args:
@@ -131,20 +204,30 @@ def build_graph(reader,
                 from BaseLoss.
     batch_size: How many examples to process at a time.
     num_readers: How many threads to use for I/O operations.
+    num_checkpoints: If set, how many copies of the model to create on the
+      same input batches, the variables of copy i in the variable scope
+      CHECKPOINT_SCOPE % i, to be restored from different checkpoints.
   """
 
   global_step = tf.Variable(0, trainable=False, name="global_step")
   video_id_batch, model_input_raw, labels_batch, num_frames = get_input_evaluation_tensors(  # pylint: disable=g-line-too-long
       reader,
       eval_data_pattern,
-      batch_size=batch_size)
+      batch_size=batch_size,
+      shard_index=FLAGS.shard_index,
+      num_shards=FLAGS.num_shards)
+  if model_input_raw.dtype == tf.uint8:
+    # frame features were kept quantized through the input queues
+    model_input_raw = readers.dequantize_frames(model_input_raw, num_frames)
   tf.summary.histogram("model_input_raw", model_input_raw)
 
   if distill_reader is not None:
     unused_video_id_batch, distill_input_raw, unused_labels_batch, unused_num_frames = get_input_evaluation_tensors(  # pylint: disable=g-line-too-long
         distill_reader,
         FLAGS.distill_data_pattern,
-        batch_size=batch_size)
+        batch_size=batch_size,
+        shard_index=FLAGS.shard_index,
+        num_shards=FLAGS.num_shards)
 
   feature_dim = len(model_input_raw.get_shape()) - 1
 
@@ -152,22 +235,47 @@ def build_graph(reader,
   feature_transformer = transformer_class()
   model_input, num_frames = feature_transformer.transform(model_input_raw, num_frames=num_frames)
 
+  if distill_reader is not None:
+    distillation_predictions = distill_input_raw
+  else:
+    distillation_predictions = None
+
+  if num_checkpoints is None:
+    build_model(model, model_input, num_frames, labels_batch, label_loss_fn,
+                reader.num_classes, distillation_predictions)
+  else:
+    for index in range(num_checkpoints):
+      # every checkpoint is restored into its own copy of the variables
+      with tf.variable_scope(CHECKPOINT_SCOPE % index):
+        build_model(model, model_input, num_frames, labels_batch,
+                    label_loss_fn, reader.num_classes, distillation_predictions)
+
+  tf.add_to_collection("global_step", global_step)
+  tf.add_to_collection("input_batch", model_input)
+  tf.add_to_collection("video_id_batch", video_id_batch)
+  tf.add_to_collection("num_frames", num_frames)
+  tf.add_to_collection("labels", tf.cast(labels_batch, tf.float32))
+  tf.add_to_collection("summary_op", tf.summary.merge_all())
+
+
+def build_model(model, model_input, num_frames, labels_batch, label_loss_fn,
+                num_classes, distillation_predictions=None):
+  """Creates a copy of the model on the input batch.
+
+  Its predictions, loss and placeholders are added to the collections
+  predictions, loss, keep_prob and noise_level.
+  """
   with tf.name_scope("model"):
     if FLAGS.noise_level > 0:
       noise_level_tensor = tf.placeholder_with_default(0.0, shape=[], name="noise_level")
     else:
       noise_level_tensor = None
 
-    if distill_reader is not None:
-      distillation_predictions = distill_input_raw
-    else:
-      distillation_predictions = None
-
     if FLAGS.dropout:
       keep_prob_tensor = tf.placeholder_with_default(1.0, shape=[], name="keep_prob")
       result = model.create_model(model_input,
                                 num_frames=num_frames,
-                                vocab_size=reader.num_classes,
+                                vocab_size=num_classes,
                                 labels=labels_batch,
                                 dropout=FLAGS.dropout,
                                 keep_prob=keep_prob_tensor,
@@ -176,7 +284,7 @@ def build_graph(reader,
     else:
       result = model.create_model(model_input,
                                 num_frames=num_frames,
-                                vocab_size=reader.num_classes,
+                                vocab_size=num_classes,
                                 labels=labels_batch,
                                 distillation_predictions=distillation_predictions,
                                 is_training=False)
@@ -191,20 +299,36 @@ def build_graph(reader,
       else:
         label_loss = label_loss_fn.calculate_loss(predictions, labels_batch)
 
-  tf.add_to_collection("global_step", global_step)
   tf.add_to_collection("loss", label_loss)
   tf.add_to_collection("predictions", predictions)
-  tf.add_to_collection("input_batch", model_input)
-  tf.add_to_collection("video_id_batch", video_id_batch)
-  tf.add_to_collection("num_frames", num_frames)
-  tf.add_to_collection("labels", tf.cast(labels_batch, tf.float32))
-  tf.add_to_collection("summary_op", tf.summary.merge_all())
   if FLAGS.dropout:
     tf.add_to_collection("keep_prob", keep_prob_tensor)
   if FLAGS.noise_level > 0:
     tf.add_to_collection("noise_level", noise_level_tensor)
 
 
+def log_iteration_infos(summary_writer, global_step_val, iteration_info_dicts):
+  """Writes the summaries of the accumulated batches and logs them.
+
+  Returns:
+    The seconds spent accumulating the batches and blocked handing them over.
+  """
+  accumulate_seconds, wait_seconds = 0.0, 0.0
+  for iteration_info_dict in iteration_info_dicts:
+    iterinfo = utils.AddGlobalStepSummary(
+        summary_writer,
+        global_step_val,
+        iteration_info_dict,
+        summary_scope="Eval")
+    logging.info("examples_processed: %d | %s | Metrics: %.3fs, %.0f%% "
+                 "overlapped", iteration_info_dict["examples_processed"],
+                 iterinfo, iteration_info_dict["accumulate_seconds"],
+                 100 * iteration_info_dict["overlap"])
+    accumulate_seconds += iteration_info_dict["accumulate_seconds"]
+    wait_seconds += iteration_info_dict["wait_seconds"]
+  return accumulate_seconds, wait_seconds
+
+
 def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                     summary_op, saver, summary_writer, evl_metrics,
                     last_global_step_val):
@@ -255,6 +379,8 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
     if FLAGS.noise_level > 0:
       noise_level_tensor = tf.get_collection("noise_level")[0]
     fetches = [video_id_batch, prediction_batch, label_batch, loss, summary_op]
+    async_metrics = eval_util.AsyncEvaluationMetrics(
+        evl_metrics, FLAGS.metric_queue_size)
     coord = tf.train.Coordinator()
     try:
       threads = []
@@ -266,6 +392,7 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                    global_step_val)
 
       evl_metrics.clear()
+      accumulate_seconds, wait_seconds = 0.0, 0.0
 
       examples_processed = 0
       while not coord.should_stop():
@@ -284,24 +411,28 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
         example_per_second = labels_val.shape[0] / seconds_per_batch
         examples_processed += labels_val.shape[0]
 
-        iteration_info_dict = evl_metrics.accumulate(predictions_val,
-                                                     labels_val, loss_val)
-        iteration_info_dict["examples_per_second"] = example_per_second
-
-        iterinfo = utils.AddGlobalStepSummary(
-            summary_writer,
-            global_step_val,
-            iteration_info_dict,
-            summary_scope="Eval")
-        logging.info("examples_processed: %d | %s", examples_processed,
-                     iterinfo)
+        async_metrics.accumulate(
+            predictions_val, labels_val, loss_val,
+            {"examples_per_second": example_per_second,
+             "examples_processed": examples_processed})
+        seconds = log_iteration_infos(summary_writer, global_step_val,
+                                      async_metrics.pop_finished())
+        accumulate_seconds += seconds[0]
+        wait_seconds += seconds[1]
 
     except tf.errors.OutOfRangeError as e:
       logging.info(
           "Done with batched inference. Now calculating global performance "
           "metrics.")
+      seconds = log_iteration_infos(summary_writer, global_step_val,
+                                    async_metrics.pop_finished(wait=True))
+      accumulate_seconds += seconds[0]
+      wait_seconds += seconds[1]
+      logging.info("Metrics: %.2fs, %.0f%% overlapped with the inference.",
+                   accumulate_seconds, 100 * max(
+                       0.0, 1.0 - wait_seconds / max(accumulate_seconds, 1e-9)))
       # calculate the metrics for the entire epoch
-      epoch_info_dict = evl_metrics.get()
+      epoch_info_dict = async_metrics.get()
       epoch_info_dict["epoch_id"] = global_step_val
 
       summary_writer.add_summary(summary_val, global_step_val)
@@ -311,6 +442,11 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
           epoch_info_dict,
           summary_scope="Eval")
       logging.info(epochinfo)
+      if FLAGS.metric_state_file:
+        eval_util.write_metric_state(FLAGS.metric_state_file, evl_metrics)
+        logging.info("Wrote the metric state of shard %d of %d to %s",
+                     FLAGS.shard_index, FLAGS.num_shards,
+                     FLAGS.metric_state_file)
       evl_metrics.clear()
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
@@ -318,10 +454,193 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
 
     coord.request_stop()
     coord.join(threads, stop_grace_period_secs=10)
+    async_metrics.close()
 
     return global_step_val
 
 
+def get_checkpoints(checkpoint_paths):
+  """Returns the checkpoints of comma separated paths or globs, by global step.
+
+  A glob may match the .meta, .index or .data files of the checkpoints.
+  """
+  checkpoints = set()
+  for path in checkpoint_paths.split(","):
+    path = path.strip()
+    if not path:
+      continue
+    filenames = gfile.Glob(path) if re.search(r"[*?[]", path) else [path]
+    for filename in filenames:
+      checkpoints.add(
+          re.sub(r"\.(meta|index|data-\d+-of-\d+)$", "", filename))
+  return sorted(checkpoints, key=lambda checkpoint: (
+      get_global_step(checkpoint), checkpoint))
+
+
+def get_global_step(checkpoint):
+  """Returns the global step of a checkpoint, like /path/model.ckpt-1000."""
+  step = checkpoint.split("/")[-1].split("-")[-1]
+  return int(step) if step.isdigit() else -1
+
+
+def get_checkpoint_saver(index):
+  """Returns a saver restoring a checkpoint into the model copy index."""
+  prefix = CHECKPOINT_SCOPE % index + "/"
+  var_list = dict((variable.op.name[len(prefix):], variable)
+                  for variable in tf.global_variables()
+                  if variable.op.name.startswith(prefix))
+  return tf.train.Saver(var_list)
+
+
+def multi_checkpoint_evaluation_loop(checkpoints, video_id_batch,
+                                     prediction_batches, label_batch, losses,
+                                     savers, summary_writer, all_evl_metrics):
+  """Evaluates several checkpoints in a single pass over the evaluation data.
+
+  Every batch is read once and evaluated by the model copies of all the
+  checkpoints, each accumulated in its own EvaluationMetrics.
+
+  Args:
+    checkpoints: the checkpoints to evaluate.
+    video_id_batch: a tensor of video ids mini-batch.
+    prediction_batches: the tensors of predictions mini-batch of every copy.
+    label_batch: a tensor of label_batch mini-batch.
+    losses: the tensors of loss of every copy.
+    savers: the tensorflow savers restoring every copy.
+    summary_writer: a tensorflow summary_writer
+    all_evl_metrics: the EvaluationMetrics object of every copy.
+
+  Returns:
+    The epoch_info_dict of every checkpoint, or None if the pass failed.
+  """
+  with tf.Session() as sess:
+    for checkpoint, saver in zip(checkpoints, savers):
+      logging.info("Loading checkpoint for eval: " + checkpoint)
+      saver.restore(sess, checkpoint)
+    sess.run([tf.local_variables_initializer()])
+
+    custom_feed = {}
+    for keep_prob_tensor in tf.get_collection("keep_prob"):
+      custom_feed[keep_prob_tensor] = FLAGS.keep_prob
+    for noise_level_tensor in tf.get_collection("noise_level"):
+      custom_feed[noise_level_tensor] = FLAGS.noise_level
+    fetches = [video_id_batch, label_batch, prediction_batches, losses]
+
+    epoch_info_dicts = None
+    coord = tf.train.Coordinator()
+    try:
+      threads = []
+      for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
+        threads.extend(qr.create_threads(
+            sess, coord=coord, daemon=True,
+            start=True))
+      logging.info("enter eval loop of %d checkpoints.", len(checkpoints))
+
+      for evl_metrics in all_evl_metrics:
+        evl_metrics.clear()
+
+      examples_processed = 0
+      while not coord.should_stop():
+        batch_start_time = time.time()
+        _, labels_val, predictions_vals, loss_vals = sess.run(
+            fetches, feed_dict=custom_feed)
+        for evl_metrics, predictions_val, loss_val in zip(
+            all_evl_metrics, predictions_vals, loss_vals):
+          evl_metrics.accumulate(predictions_val, labels_val, loss_val)
+
+        seconds_per_batch = time.time() - batch_start_time
+        examples_processed += labels_val.shape[0]
+        logging.info("examples_processed: %d | examples_per_second: %.1f",
+                     examples_processed,
+                     labels_val.shape[0] / seconds_per_batch)
+
+    except tf.errors.OutOfRangeError as e:
+      logging.info(
+          "Done with batched inference. Now calculating global performance "
+          "metrics.")
+      epoch_info_dicts = []
+      for checkpoint, evl_metrics in zip(checkpoints, all_evl_metrics):
+        global_step_val = get_global_step(checkpoint)
+        epoch_info_dict = evl_metrics.get()
+        epoch_info_dict["epoch_id"] = global_step_val
+        epochinfo = utils.AddEpochSummary(
+            summary_writer,
+            global_step_val,
+            epoch_info_dict,
+            summary_scope="Eval")
+        logging.info(epochinfo)
+        epoch_info_dicts.append(epoch_info_dict)
+        evl_metrics.clear()
+    except Exception as e:  # pylint: disable=broad-except
+      logging.info("Unexpected exception: " + str(e))
+      coord.request_stop(e)
+
+    coord.request_stop()
+    coord.join(threads, stop_grace_period_secs=10)
+
+    return epoch_info_dicts
+
+
+def evaluate_checkpoints(checkpoints, reader, model, label_loss_fn,
+                         transformer_class, distill_reader):
+  """Evaluates the checkpoints in as few passes over the data as possible.
+
+  Logs a table of the checkpoints ranked by GAP.
+  """
+  if not checkpoints:
+    raise IOError("Unable to find the checkpoints. model_checkpoint_paths='" +
+                  FLAGS.model_checkpoint_paths + "'.")
+  checkpoints_per_pass = FLAGS.checkpoints_per_pass or len(checkpoints)
+  summary_writer = tf.summary.FileWriter(FLAGS.train_dir)
+
+  results = []
+  for start in range(0, len(checkpoints), checkpoints_per_pass):
+    pass_checkpoints = checkpoints[start:start + checkpoints_per_pass]
+    with tf.Graph().as_default():
+      tf.set_random_seed(0)  # for reproducibility
+      build_graph(
+          reader=reader,
+          model=model,
+          eval_data_pattern=FLAGS.eval_data_pattern,
+          label_loss_fn=label_loss_fn,
+          num_readers=FLAGS.num_readers,
+          transformer_class=transformer_class,
+          distill_reader=distill_reader,
+          batch_size=FLAGS.batch_size,
+          num_checkpoints=len(pass_checkpoints))
+      logging.info("built evaluation graph of %d checkpoints",
+                   len(pass_checkpoints))
+
+      savers = [get_checkpoint_saver(index)
+                for index in range(len(pass_checkpoints))]
+      all_evl_metrics = [
+          eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k,
+                                      FLAGS.gap_histogram_bins)
+          for _ in pass_checkpoints]
+      epoch_info_dicts = multi_checkpoint_evaluation_loop(
+          pass_checkpoints,
+          tf.get_collection("video_id_batch")[0],
+          tf.get_collection("predictions"),
+          tf.get_collection("labels")[0],
+          tf.get_collection("loss"),
+          savers, summary_writer, all_evl_metrics)
+    if epoch_info_dicts is None:
+      raise RuntimeError("Failed to evaluate " + ",".join(pass_checkpoints))
+    results.extend(zip(pass_checkpoints, epoch_info_dicts))
+
+  results.sort(key=lambda result: -result[1]["gap"])
+  logging.info("checkpoints ranked by GAP:")
+  logging.info("%4s %-32s %8s %8s %8s %8s %8s", "rank", "checkpoint", "GAP",
+               "MAP", "Hit@1", "PERR", "loss")
+  for rank, (checkpoint, epoch_info_dict) in enumerate(results):
+    logging.info("%4d %-32s %8.4f %8.4f %8.4f %8.4f %8.4f", rank + 1,
+                 os.path.basename(checkpoint), epoch_info_dict["gap"],
+                 numpy.mean(epoch_info_dict["aps"]),
+                 epoch_info_dict["avg_hit_at_one"], epoch_info_dict["avg_perr"],
+                 epoch_info_dict["avg_loss"])
+  return results
+
+
 def evaluate():
   tf.set_random_seed(0)  # for reproducibility
   with tf.Graph().as_default():
@@ -329,9 +648,18 @@ def evaluate():
     feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
         FLAGS.feature_names, FLAGS.feature_sizes)
 
-    if FLAGS.frame_features:
+    if FLAGS.frame_features and FLAGS.frame_cache:
+      reader = readers.YT8MFrameFeatureCacheReader(feature_names=feature_names,
+                                                   feature_sizes=feature_sizes,
+                                                   dequantize=not FLAGS.quantized_frames)
+    elif FLAGS.frame_features and FLAGS.frame_batch_reader:
+      reader = readers.YT8MFrameFeatureBatchReader(feature_names=feature_names,
+                                                   feature_sizes=feature_sizes,
+                                                   dequantize=not FLAGS.quantized_frames)
+    elif FLAGS.frame_features:
       reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                              feature_sizes=feature_sizes)
+                                              feature_sizes=feature_sizes,
+                                              dequantize=not FLAGS.quantized_frames)
     else:
       reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                    feature_sizes=feature_sizes)
@@ -351,6 +679,15 @@ def evaluate():
       raise IOError("'eval_data_pattern' was not specified. " +
                      "Nothing to evaluate.")
 
+    if FLAGS.model_checkpoint_paths:
+      if FLAGS.metric_state_file:
+        raise ValueError("--metric_state_file is not supported with "
+                         "--model_checkpoint_paths.")
+      evaluate_checkpoints(get_checkpoints(FLAGS.model_checkpoint_paths),
+                           reader, model, label_loss_fn, transformer_class,
+                           distill_reader)
+      return
+
     build_graph(
         reader=reader,
         model=model,
@@ -372,7 +709,8 @@ def evaluate():
     summary_writer = tf.summary.FileWriter(
         FLAGS.train_dir, graph=tf.get_default_graph())
 
-    evl_metrics = eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k)
+    evl_metrics = eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k,
+                                              FLAGS.gap_histogram_bins)
 
     last_global_step_val = -1
     while True:
@@ -0,0 +1,31 @@
+
+GPU_ID=1
+EVERY=1000
+MODEL=DbofModel 
+MODEL_DIR="../model/dbof_model"
+
+start=$1
+DIR="$(pwd)"
+
+# all the selected checkpoints are evaluated in a single pass over the data
+checkpoints=""
+for checkpoint in $(cd $MODEL_DIR && python ${DIR}/training_utils/select.py $EVERY); do
+	if [ $checkpoint -gt $start ]; then
+		checkpoints="${checkpoints},${MODEL_DIR}/model.ckpt-${checkpoint}"
+	fi
+done
+echo $checkpoints;
+
+CUDA_VISIBLE_DEVICES=$GPU_ID python eval.py \
+	--train_dir="$MODEL_DIR" \
+	--model_checkpoint_paths="${checkpoints}" \
+	--checkpoints_per_pass=8 \
+	--eval_data_pattern="/Youtube-8M/data/frame/validate/validatea*" \
+	--frame_features=True \
+	--feature_names="rgb,audio" \
+	--feature_sizes="1024,128" \
+	--model=$MODEL \
+	--batch_size=128 \
+	--num_readers=1 \
+	--run_once=True
+
@@ -0,0 +1,24 @@
+
+GPU_ID=0
+MODEL=LogisticModel
+MODEL_DIR="../model/logistic_model"
+NUM_SHARDS=4
+
+# every shard of the validation files is evaluated by its own process, and
+# the metric states are merged into the GAP and MAP of the whole set
+for ((shard=0; shard<$NUM_SHARDS; shard++)); do
+	CUDA_VISIBLE_DEVICES=$GPU_ID python eval.py \
+		--train_dir="$MODEL_DIR" \
+		--eval_data_pattern="/Youtube-8M/data/video/validate/validatea*" \
+		--model=$MODEL \
+		--batch_size=1024 \
+		--num_readers=1 \
+		--run_once=True \
+		--shard_index=$shard \
+		--num_shards=$NUM_SHARDS \
+		--metric_state_file="${MODEL_DIR}/eval-state-${shard}-of-${NUM_SHARDS}.npz" &
+done
+wait
+
+python merge-eval-states.py \
+	--metric_state_files="${MODEL_DIR}/eval-state-*-of-${NUM_SHARDS}.npz"
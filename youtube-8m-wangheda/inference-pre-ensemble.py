@@ -24,6 +24,7 @@ import frame_level_models
 import video_level_models
 import data_augmentation
 import feature_transform
+import prediction_store
 import readers
 import utils
 
@@ -61,6 +62,11 @@ if __name__ == '__main__':
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "quantized_frames", False,
+      "If set, frame-level features are kept as uint8 in the input queues and "
+      "dequantized in the graph right before the model, which takes about 4x "
+      "less queue memory.")
   flags.DEFINE_integer(
       "batch_size", 8192,
       "How many examples to process per batch.")
@@ -69,6 +75,15 @@ if __name__ == '__main__':
   flags.DEFINE_string("feature_sizes", "1024", "Length of the feature vectors.")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_string("output_format", "tfrecord",
+                      "Format of the prediction files, either tfrecord "
+                      "(tf.train.Example protos) or a prediction store "
+                      "dtype (float32, float16 or uint8), see "
+                      "prediction_store.py.")
+  flags.DEFINE_integer("output_top_k", 0,
+                       "If positive, prediction store files only hold the top "
+                       "k predictions of each video, the other classes are "
+                       "read as a floor value of the model.")
   flags.DEFINE_string(
       "model", "YouShouldSpecifyAModel",
       "Which architecture to use for the model. Models are defined "
@@ -142,6 +157,9 @@ def build_graph(reader,
           reader,
           input_data_pattern,
           batch_size=batch_size))
+  if model_input_raw.dtype == tf.uint8:
+    # frame features were kept quantized through the input queue
+    model_input_raw = readers.dequantize_frames(model_input_raw, num_frames)
 
   if distill_reader is not None:
     unused_video_id_batch, distill_input_raw, unused_labels_batch, unused_num_frames = get_input_data_tensors(  # pylint: disable=g-line-too-long
@@ -267,7 +285,8 @@ def inference(saver, model_checkpoint_path, out_file_location, batch_size, top_k
             video_id = np.concatenate(video_id, axis=0)
             video_label = np.concatenate(video_label, axis=0)
             video_features = np.concatenate(video_features, axis=0)
-            write_to_record(video_id, video_label, video_features, filenum, num_examples_processed)
+            write_to_record(video_id, video_label, video_features, filenum, num_examples_processed,
+                            checkpoint=model_checkpoint_path)
 
             filenum += 1
             video_id = []
@@ -283,12 +302,27 @@ def inference(saver, model_checkpoint_path, out_file_location, batch_size, top_k
             video_id = np.concatenate(video_id,axis=0)
             video_label = np.concatenate(video_label,axis=0)
             video_features = np.concatenate(video_features,axis=0)
-            write_to_record(video_id, video_label, video_features, filenum,num_examples_processed)
+            write_to_record(video_id, video_label, video_features, filenum, num_examples_processed,
+                            checkpoint=model_checkpoint_path)
 
     coord.join(threads)
     sess.close()
 
-def write_to_record(id_batch, label_batch, predictions, filenum, num_examples_processed):
+    if FLAGS.output_format != "tfrecord" and FLAGS.output_top_k:
+      # every file was written with the floor of its own rows
+      prediction_store.set_model_floor(gfile.Glob(
+          FLAGS.output_dir + "/*" + prediction_store.FILE_EXTENSION))
+
+def write_to_record(id_batch, label_batch, predictions, filenum, num_examples_processed,
+                    checkpoint=""):
+    if FLAGS.output_format != "tfrecord":
+        prediction_store.write_predictions(
+            FLAGS.output_dir + '/' + 'predictions-%04d' % filenum + prediction_store.FILE_EXTENSION,
+            id_batch[:num_examples_processed], label_batch[:num_examples_processed],
+            predictions[:num_examples_processed], dtype=FLAGS.output_format,
+            model=FLAGS.model, checkpoint=checkpoint,
+            top_k=FLAGS.output_top_k)
+        return
     writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
     for i in range(num_examples_processed):
         video_id = id_batch[i]
@@ -316,7 +350,8 @@ def main(unused_argv):
 
   if FLAGS.frame_features:
     reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                            feature_sizes=feature_sizes)
+                                            feature_sizes=feature_sizes,
+                                            dequantize=not FLAGS.quantized_frames)
   else:
     reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                  feature_sizes=feature_sizes)
@@ -28,6 +28,7 @@ from tensorflow import logging
 
 import eval_util
 import losses
+import prediction_store
 import readers
 import utils
 
@@ -42,6 +43,15 @@ if __name__ == '__main__':
                       "The file to save the predictions to.")
   flags.DEFINE_integer("file_size", 4096,
                       "Number of examples put into a file.")
+  flags.DEFINE_string("output_format", "tfrecord",
+                      "Format of the prediction files, either tfrecord "
+                      "(tf.train.Example protos) or a prediction store "
+                      "dtype (float32, float16 or uint8), see "
+                      "prediction_store.py.")
+  flags.DEFINE_integer("output_top_k", 0,
+                       "If positive, prediction store files only hold the top "
+                       "k predictions of each video, the other classes are "
+                       "read as a floor value of the model.")
   flags.DEFINE_string(
       "input_data_pattern", "",
       "File glob defining the evaluation dataset in tensorflow.SequenceExample "
@@ -127,7 +137,16 @@ def get_output_feature(video_id, labels, feature_dict):
     example = tf.train.Example(features=tf.train.Features(feature=feature_maps))
     return example
 
-def write_to_record(id_batch, label_batch, feature_dict, filenum, num_examples_processed):
+def write_to_record(id_batch, label_batch, feature_dict, filenum, num_examples_processed,
+                    checkpoint=""):
+    if FLAGS.output_format != "tfrecord":
+        prediction_store.write_predictions(
+            FLAGS.output_file + str(filenum) + prediction_store.FILE_EXTENSION,
+            id_batch[:num_examples_processed], label_batch[:num_examples_processed],
+            feature_dict["predictions"][:num_examples_processed],
+            dtype=FLAGS.output_format, checkpoint=checkpoint,
+            top_k=FLAGS.output_top_k)
+        return
     writer = tf.python_io.TFRecordWriter(FLAGS.output_file+str(filenum)+'.tfrecord')
     for i in range(num_examples_processed):
         slice_dict = lambda d, j: dict([(k,d[k][j,:]) for k in d])
@@ -186,7 +205,8 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
           video_label_list = np.concatenate(video_label_list,axis=0)
           video_predictions_list = np.concatenate(video_predictions_list,axis=0)
           feature_dict = {"predictions": video_predictions_list}
-          write_to_record(video_id_list, video_label_list, feature_dict, file_num, num_examples_processed)
+          write_to_record(video_id_list, video_label_list, feature_dict, file_num, num_examples_processed,
+                          checkpoint=latest_checkpoint)
 
       while not coord.should_stop():
           video_id_batch_val, video_batch_val, video_label_batch_val, num_frames_batch_val = sess.run([video_id_batch, video_batch, video_label_batch, num_frames_batch])
@@ -218,6 +238,11 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
     coord.join(threads)
     sess.close()
 
+    if FLAGS.output_format != "tfrecord" and FLAGS.output_top_k:
+      # every file was written with the floor of its own rows
+      prediction_store.set_model_floor(gfile.Glob(
+          FLAGS.output_file + "[0-9]*" + prediction_store.FILE_EXTENSION))
+
 
 def main(unused_argv):
   logging.set_verbosity(tf.logging.INFO)
@@ -24,6 +24,7 @@ from tensorflow import app
 from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
+from tensorflow.core.protobuf import meta_graph_pb2
 
 import eval_util
 import losses
@@ -52,6 +53,27 @@ if __name__ == '__main__':
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "frame_batch_reader", False,
+      "If set, frame-level features are read by the *FeatureBatchReader, which "
+      "reads and decodes blocks of SequenceExamples per op. It needs "
+      "--quantized_frames.")
+  flags.DEFINE_bool(
+      "quantized_frames", False,
+      "If set, frame-level features are kept as uint8 in the input queues and "
+      "dequantized in the graph right before the model, which takes about 4x "
+      "less queue memory.")
+  flags.DEFINE_bool(
+      "frame_cache", False,
+      "If set, frame-level features are read by the YT8MFrameFeatureCacheReader "
+      "from a cache written by convert-frame-cache.py, and the data pattern "
+      "must match the index files of the cache.")
+  flags.DEFINE_bool(
+      "direct_input", False,
+      "If set, the reader output is wired into the input of the restored graph "
+      "instead of being fetched and fed back with a feed_dict, so the batches "
+      "never leave the runtime, and the input queue holds up to a second batch "
+      "that is read while the current one is computed.")
   flags.DEFINE_integer(
       "batch_size", 8192,
       "How many examples to process per batch.")
@@ -87,7 +109,8 @@ def format_lines(video_ids, predictions, top_k):
                                                   for pair in line) + "\n"
 
 
-def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
+def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1,
+                           capacity=32):
   """Creates the section of the graph which reads the input data.
 
   Args:
@@ -95,6 +118,7 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
     data_pattern: A 'glob' style path to the data files.
     batch_size: How many examples to process at a time.
     num_readers: How many I/O threads to use.
+    capacity: How many examples the input queue holds.
 
   Returns:
     A tuple containing the features tensor, labels tensor, and optionally a
@@ -118,13 +142,51 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
     video_id_batch, video_batch, unused_labels, num_frames_batch = (
         tf.train.batch_join(examples_and_labels,
                             batch_size=batch_size,
+                            capacity=capacity,
                             allow_smaller_final_batch = True,
                             enqueue_many=True))
+    if video_batch.dtype == tf.uint8:
+      # frame features were kept quantized through the input queue
+      video_batch = readers.dequantize_frames(video_batch, num_frames_batch)
     return video_id_batch, video_batch, num_frames_batch
 
-def inference(reader, train_dir, data_pattern, out_file_location, batch_size, top_k):
+def import_meta_graph_with_input(meta_graph_location, tensors_by_collection):
+  """Imports a meta graph, replacing the input tensors of the model.
+
+  Args:
+    meta_graph_location: The meta graph file.
+    tensors_by_collection: A dict from collection name to the tensor which
+      replaces the first tensor of that collection in the imported graph.
+
+  Returns:
+    The saver of the imported graph.
+  """
+  meta_graph_def = meta_graph_pb2.MetaGraphDef()
+  with gfile.Open(meta_graph_location, "rb") as F:
+    meta_graph_def.ParseFromString(F.read())
+  # The control flow contexts are only needed to compute gradients, and the
+  # tensor names in them are not moved under the import scope.
+  for collection in [tf.GraphKeys.COND_CONTEXT, tf.GraphKeys.WHILE_CONTEXT]:
+    if collection in meta_graph_def.collection_def:
+      del meta_graph_def.collection_def[collection]
+  input_map = {}
+  for collection, tensor in tensors_by_collection.items():
+    name = meta_graph_def.collection_def[collection].node_list.value[0]
+    input_map[name] = tensor
+  # an input_map needs the graph to be imported under a scope
+  return tf.train.import_meta_graph(meta_graph_def, clear_devices=True,
+                                    import_scope="restored",
+                                    input_map=input_map)
+
+def inference(reader, train_dir, data_pattern, out_file_location, batch_size, top_k,
+              direct_input=False):
   with tf.Session() as sess, gfile.Open(out_file_location, "w+") as out_file:
-    video_id_batch, video_batch, num_frames_batch = get_input_data_tensors(reader, data_pattern, batch_size)
+    if direct_input:
+      capacity = 2 * batch_size
+    else:
+      capacity = 32
+    video_id_batch, video_batch, num_frames_batch = get_input_data_tensors(
+        reader, data_pattern, batch_size, capacity=capacity)
     if FLAGS.model_checkpoint_path:
       latest_checkpoint = FLAGS.model_checkpoint_path
     else:
@@ -134,7 +196,14 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
     else:
       meta_graph_location = latest_checkpoint + ".meta"
       logging.info("loading meta-graph: " + meta_graph_location)
-    saver = tf.train.import_meta_graph(meta_graph_location, clear_devices=True)
+    if direct_input:
+      # the restored graph reads its input from the reader output, rather than
+      # from the tensors fed by the feed_dict below
+      saver = import_meta_graph_with_input(
+          meta_graph_location, {"input_batch_raw": video_batch,
+                                "num_frames": num_frames_batch})
+    else:
+      saver = tf.train.import_meta_graph(meta_graph_location, clear_devices=True)
     logging.info("restoring variables from " + latest_checkpoint)
     saver.restore(sess, latest_checkpoint)
     input_tensor = tf.get_collection("input_batch_raw")[0]
@@ -164,13 +233,19 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
 
     try:
       while not coord.should_stop():
-          video_id_batch_val, video_batch_val,num_frames_batch_val = sess.run([video_id_batch, video_batch, num_frames_batch])
-          if FLAGS.dropout:
-            predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val, keep_prob_tensor: FLAGS.keep_prob})
+          if direct_input:
+            feed_dict = {}
+            if FLAGS.dropout:
+              feed_dict[keep_prob_tensor] = FLAGS.keep_prob
+            video_id_batch_val, predictions_val = sess.run([video_id_batch, predictions_tensor], feed_dict=feed_dict)
           else:
-            predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val})
+            video_id_batch_val, video_batch_val,num_frames_batch_val = sess.run([video_id_batch, video_batch, num_frames_batch])
+            if FLAGS.dropout:
+              predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val, keep_prob_tensor: FLAGS.keep_prob})
+            else:
+              predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val})
           now = time.time()
-          num_examples_processed += len(video_batch_val)
+          num_examples_processed += len(video_id_batch_val)
           num_classes = predictions_val.shape[1]
           logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
           for line in format_lines(video_id_batch_val, predictions_val, top_k):
@@ -194,9 +269,18 @@ def main(unused_argv):
   feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
       FLAGS.feature_names, FLAGS.feature_sizes)
 
-  if FLAGS.frame_features:
+  if FLAGS.frame_features and FLAGS.frame_cache:
+    reader = readers.YT8MFrameFeatureCacheReader(feature_names=feature_names,
+                                                 feature_sizes=feature_sizes,
+                                                 dequantize=not FLAGS.quantized_frames)
+  elif FLAGS.frame_features and FLAGS.frame_batch_reader:
+    reader = readers.YT8MFrameFeatureBatchReader(feature_names=feature_names,
+                                                 feature_sizes=feature_sizes,
+                                                 dequantize=not FLAGS.quantized_frames)
+  elif FLAGS.frame_features:
     reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                            feature_sizes=feature_sizes)
+                                            feature_sizes=feature_sizes,
+                                            dequantize=not FLAGS.quantized_frames)
   else:
     reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                  feature_sizes=feature_sizes)
@@ -210,7 +294,8 @@ def main(unused_argv):
       "Unable to continue with inference.")
 
   inference(reader, FLAGS.train_dir, FLAGS.input_data_pattern,
-    FLAGS.output_file, FLAGS.batch_size, FLAGS.top_k)
+    FLAGS.output_file, FLAGS.batch_size, FLAGS.top_k,
+    direct_input=FLAGS.direct_input)
 
 
 if __name__ == "__main__":
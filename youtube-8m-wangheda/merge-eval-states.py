@@ -0,0 +1,81 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary for merging the metric states of a sharded evaluation.
+
+Every shard is evaluated by eval.py --shard_index=i --num_shards=n
+--metric_state_file=..., which writes the state of its
+eval_util.EvaluationMetrics. The states are merged in the order of the shards,
+so the GAP and MAP are those of an eval.py run over all the files. The merged
+state can also be written, to be merged again with other ones.
+"""
+
+import numpy
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+import tensorflow as tf
+
+import eval_util
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string(
+      "metric_state_files", "",
+      "Comma separated metric state files, or globs of them, in the order of "
+      "their shards. The files of a glob are taken in sorted order.")
+  flags.DEFINE_string("output_state_file", "",
+                      "If set, the merged metric state is written there.")
+
+
+def get_state_files(metric_state_files):
+  """Returns the files of comma separated files or globs, in order."""
+  filenames = []
+  for pattern in metric_state_files.split(","):
+    pattern = pattern.strip()
+    if pattern:
+      filenames.extend(sorted(gfile.Glob(pattern)))
+  if not filenames:
+    raise IOError("Unable to find the metric state files. "
+                  "metric_state_files='" + metric_state_files + "'.")
+  return filenames
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  filenames = get_state_files(FLAGS.metric_state_files)
+  evl_metrics = None
+  for filename in filenames:
+    shard_metrics = eval_util.read_metric_state(filename)
+    logging.info("%s: %d examples", filename, shard_metrics.num_examples)
+    if evl_metrics is None:
+      evl_metrics = shard_metrics
+    else:
+      evl_metrics.merge(shard_metrics)
+
+  if FLAGS.output_state_file:
+    eval_util.write_metric_state(FLAGS.output_state_file, evl_metrics)
+    logging.info("Wrote the merged metric state to %s", FLAGS.output_state_file)
+
+  epoch_info_dict = evl_metrics.get()
+  print("num_examples: %d | avg_hit_at_one: %.5f | avg_perr: %.5f | "
+        "avg_loss: %.5f | MAP: %.5f | GAP: %.5f" % (
+            evl_metrics.num_examples, epoch_info_dict["avg_hit_at_one"],
+            epoch_info_dict["avg_perr"], epoch_info_dict["avg_loss"],
+            numpy.mean(epoch_info_dict["aps"]), epoch_info_dict["gap"]))
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,243 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact storage of the predictions of a model.
+
+A prediction store file holds the predictions of one model for a set of
+videos as fixed length rows following a fixed size header:
+
+  header: MAGIC followed by a JSON dict with the model name, checkpoint,
+    number of rows, number of classes and dtype, padded to HEADER_BYTES.
+  row: the video_id (VIDEO_ID_BYTES, padded with 0), the labels (MAX_LABELS
+    little-endian int16, padded with -1) and the predictions (num_classes
+    values of dtype).
+
+If top_k is set, a row only holds the top_k highest predictions of the video:
+the floor (float32), the classes (top_k int16) and the predictions (top_k
+values of dtype). Every other class is predicted as the floor of the row.
+write_predictions sets it to the mean of the predictions left out in the
+file. When the predictions of a model are split across several files,
+set_model_floor then rewrites all of them with the mean of the predictions
+left out in all the files, i.e. a value per model. The readers always use the
+floor of each row, so the files of an interrupted run, whose floors are still
+per file, are read as written.
+
+The predictions are stored as float32 (lossless), float16 or uint8 (quantized
+as round(p * 255)). Since all the rows have the same length, a file can be
+read by a tf.FixedLengthRecordReader without any parsing, or memory-mapped
+with numpy, where the video_id column serves as the index of the videos.
+"""
+
+import json
+
+import numpy as np
+from tensorflow import gfile
+
+MAGIC = b"YT8MPRED"
+HEADER_BYTES = 1024
+VIDEO_ID_BYTES = 32
+MAX_LABELS = 32
+FILE_EXTENSION = ".pstore"
+DTYPES = {"float32": np.dtype("<f4"),
+          "float16": np.dtype("<f2"),
+          "uint8": np.dtype("u1")}
+
+
+def row_dtype(num_classes, dtype, top_k=0):
+  """Returns the numpy structured dtype of a row."""
+  if top_k:
+    return np.dtype([("video_id", "S%d" % VIDEO_ID_BYTES),
+                     ("labels", "<i2", (MAX_LABELS,)),
+                     ("floor", "<f4"),
+                     ("classes", "<i2", (top_k,)),
+                     ("predictions", DTYPES[dtype], (top_k,))])
+  return np.dtype([("video_id", "S%d" % VIDEO_ID_BYTES),
+                   ("labels", "<i2", (MAX_LABELS,)),
+                   ("predictions", DTYPES[dtype], (num_classes,))])
+
+
+def record_bytes(num_classes, dtype, top_k=0):
+  """Returns the number of bytes of a row."""
+  return row_dtype(num_classes, dtype, top_k).itemsize
+
+
+def encode_predictions(predictions, dtype):
+  """Converts float predictions in [0, 1] to the stored dtype."""
+  if dtype == "uint8":
+    return np.round(np.clip(predictions, 0.0, 1.0) * 255).astype(np.uint8)
+  return predictions.astype(DTYPES[dtype])
+
+
+def decode_predictions(values, dtype):
+  """Converts stored predictions back to float32."""
+  values = values.astype(np.float32)
+  if dtype == "uint8":
+    values *= np.float32(1.0 / 255)
+  return values
+
+
+def write_predictions(filename, video_ids, labels, predictions,
+                      dtype="float16", model="", checkpoint="", top_k=0):
+  """Writes a prediction store file.
+
+  Args:
+    filename: the file to write.
+    video_ids: a list of N video ids.
+    labels: a N x num_classes matrix of 0/1 labels.
+    predictions: a N x num_classes matrix of predictions in [0, 1].
+    dtype: the stored dtype, one of "float32", "float16" and "uint8".
+    model: the name of the model recorded in the header.
+    checkpoint: the checkpoint recorded in the header.
+    top_k: if positive, only the top_k predictions of each video are stored.
+
+  Raises:
+    ValueError: if a video_id or the list of labels of a video is too long.
+  """
+  num_rows, num_classes = predictions.shape
+  rows = np.zeros([num_rows], dtype=row_dtype(num_classes, dtype, top_k))
+  for i in range(num_rows):
+    if len(video_ids[i]) > VIDEO_ID_BYTES:
+      raise ValueError("video_id %s is longer than %d bytes." %
+                       (video_ids[i], VIDEO_ID_BYTES))
+    label_indices = np.nonzero(labels[i])[0]
+    if len(label_indices) > MAX_LABELS:
+      raise ValueError("video %s has more than %d labels." %
+                       (video_ids[i], MAX_LABELS))
+    rows["video_id"][i] = video_ids[i]
+    rows["labels"][i] = -1
+    rows["labels"][i, :len(label_indices)] = label_indices
+
+  floor = 0.0
+  if top_k:
+    classes = np.argpartition(predictions, -top_k, axis=1)[:, -top_k:]
+    top_predictions = predictions[np.arange(num_rows)[:, None], classes]
+    if num_rows > 0 and num_classes > top_k:
+      floor = float((predictions.sum(dtype=np.float64) -
+                     top_predictions.sum(dtype=np.float64)) /
+                    (num_rows * (num_classes - top_k)))
+    rows["floor"] = floor
+    rows["classes"] = classes
+    rows["predictions"] = encode_predictions(top_predictions, dtype)
+  else:
+    rows["predictions"] = encode_predictions(predictions, dtype)
+
+  write_rows(filename, {"model": model,
+                        "checkpoint": checkpoint,
+                        "num_rows": num_rows,
+                        "num_classes": num_classes,
+                        "dtype": dtype,
+                        "top_k": top_k,
+                        "floor": floor}, rows)
+
+
+def write_rows(filename, header, rows):
+  """Writes a header dict and the rows of a prediction store file."""
+  header = MAGIC + json.dumps(header)
+  if len(header) > HEADER_BYTES:
+    raise ValueError("header is longer than %d bytes." % HEADER_BYTES)
+  with gfile.Open(filename, "wb") as F:
+    F.write(header.ljust(HEADER_BYTES))
+    F.write(rows.tobytes())
+
+
+def set_model_floor(filenames):
+  """Sets the floor of all the files of a model to the floor of the model.
+
+  Each file is written with the mean of the predictions left out in its own
+  rows. Since every row leaves out num_classes - top_k predictions, the mean
+  over all the files is the mean of the file floors weighted by their number
+  of rows.
+
+  Args:
+    filenames: the top_k prediction store files of one model.
+
+  Returns:
+    The floor of the model.
+
+  Raises:
+    ValueError: if the files do not have the same top_k and num_classes.
+  """
+  headers = [read_header(filename) for filename in filenames]
+  if len(set((header.get("top_k", 0), header["num_classes"])
+             for header in headers)) > 1:
+    raise ValueError("the files of a model must have the same top_k and "
+                     "num_classes.")
+  num_rows = sum(header["num_rows"] for header in headers)
+  if num_rows == 0 or not headers[0].get("top_k", 0):
+    return 0.0
+  floor = sum(header["floor"] * header["num_rows"]
+              for header in headers) / num_rows
+  for filename, header in zip(filenames, headers):
+    with gfile.Open(filename, "rb") as F:
+      data = F.read()
+    rows = np.frombuffer(data[HEADER_BYTES:], dtype=row_dtype(
+        header["num_classes"], str(header["dtype"]), header["top_k"])).copy()
+    rows["floor"] = floor
+    header["floor"] = floor
+    write_rows(filename, header, rows)
+  return floor
+
+
+def read_header(filename):
+  """Returns the header dict of a prediction store file."""
+  with gfile.Open(filename, "rb") as F:
+    header = F.read(HEADER_BYTES)
+  if not header.startswith(MAGIC):
+    raise IOError("%s is not a prediction store file." % filename)
+  return json.loads(header[len(MAGIC):].rstrip())
+
+
+class PredictionStore(object):
+  """Memory-maps a prediction store file with numpy."""
+
+  def __init__(self, filename):
+    self.header = read_header(filename)
+    self.dtype = str(self.header["dtype"])
+    self.num_rows = self.header["num_rows"]
+    self.num_classes = self.header["num_classes"]
+    self.top_k = self.header.get("top_k", 0)
+    dtype = row_dtype(self.num_classes, self.dtype, self.top_k)
+    if self.num_rows > 0:
+      self.rows = np.memmap(filename, mode="r", offset=HEADER_BYTES,
+                            dtype=dtype, shape=(self.num_rows,))
+    else:
+      self.rows = np.zeros([0], dtype=dtype)
+
+  @property
+  def video_ids(self):
+    return self.rows["video_id"]
+
+  def video_id_index(self):
+    """Returns a dict from video_id to row number."""
+    return dict(zip(self.video_ids, range(self.num_rows)))
+
+  def get_predictions(self, start=0, end=None):
+    """Returns the dense float32 predictions of the rows [start, end)."""
+    predictions = decode_predictions(self.rows["predictions"][start:end],
+                                     self.dtype)
+    if not self.top_k:
+      return predictions
+    rows = self.rows[start:end]
+    dense = np.empty([len(rows), self.num_classes], dtype=np.float32)
+    dense[:] = rows["floor"][:, None]
+    dense[np.arange(len(rows))[:, None], rows["classes"]] = predictions
+    return dense
+
+  def get_labels(self, start=0, end=None):
+    """Returns the dense bool labels of the rows [start, end)."""
+    label_indices = self.rows["labels"][start:end]
+    labels = np.zeros([len(label_indices), self.num_classes], dtype=np.bool_)
+    rows, columns = np.nonzero(label_indices >= 0)
+    labels[rows, label_indices[rows, columns]] = True
+    return labels
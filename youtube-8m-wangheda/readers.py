@@ -14,6 +14,13 @@
 
 """Provides readers configured for different datasets."""
 
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
 import tensorflow as tf
 import utils
 
@@ -55,6 +62,38 @@ def resize_axis(tensor, axis, new_size, fill_value=0):
   resized.set_shape(new_shape)
   return resized
 
+def dequantize_frames(quantized_matrix,
+                      num_frames,
+                      max_quantized_value=2,
+                      min_quantized_value=-2):
+  """Dequantizes a batch of padded byte frame features.
+
+  The padded frames (beyond num_frames) are set to 0, so that the result is
+  identical to dequantizing each video first and padding it afterwards.
+
+  Args:
+    quantized_matrix: A uint8 tensor of shape [batch, max_frames, feature_size].
+    num_frames: An int32 tensor of shape [batch] with the valid frame counts.
+    max_quantized_value: the maximum of the quantized value.
+    min_quantized_value: the minimum of the quantized value.
+
+  Returns:
+    A float32 tensor with the same shape as quantized_matrix.
+  """
+  quantized_matrix = tf.convert_to_tensor(quantized_matrix)
+  shape = tf.shape(quantized_matrix)
+  feature_matrix = utils.Dequantize(tf.cast(quantized_matrix, tf.float32),
+                                    max_quantized_value,
+                                    min_quantized_value)
+  # select frames with a [batch * max_frames] mask to avoid tiling the mask
+  feature_matrix = tf.reshape(feature_matrix, [-1, shape[2]])
+  frame_mask = tf.reshape(tf.sequence_mask(num_frames, shape[1]), [-1])
+  feature_matrix = tf.where(frame_mask, feature_matrix,
+                            tf.zeros_like(feature_matrix))
+  feature_matrix = tf.reshape(feature_matrix, shape)
+  feature_matrix.set_shape(quantized_matrix.get_shape())
+  return feature_matrix
+
 class BaseReader(object):
   """Inherit from this class when implementing new readers."""
 
@@ -124,6 +163,167 @@ class YT8MAggregatedFeatureReader(BaseReader):
 
     return features["video_id"], concatenated_features, labels, tf.ones([tf.shape(serialized_examples)[0]])
 
+class YT8MAggregatedFeatureCacheReader(YT8MAggregatedFeatureReader):
+  """Reads pre-aggregated Examples through a cache of decoded shards.
+
+  The first time a TFRecord shard is read, its Examples are parsed once and
+  saved in a directory under cache_dir, holding:
+    features.npy: [num_videos, sum(feature_sizes)] features, as cache_dtype.
+    label_offsets.npy: int64 [num_videos + 1], label_indices[label_offsets[i]:
+      label_offsets[i + 1]] are the labels of video i.
+    label_indices.npy: int32 [num_labels], the sparse label index.
+    video_ids.npy: [num_videos] video_id table.
+
+  Every later epoch memory-maps these arrays instead of parsing the shard
+  again. The directory is named after the path, size and modification time
+  of the shard and the features it holds, and is published with an atomic
+  rename. With cache_dir in /dev/shm, the cache stays in RAM and concurrent
+  jobs on the host (e.g. the sub-models of a bagging script) build each
+  shard once and share the same pages.
+
+  Every read returns all the videos of a shard, in a random order if shuffle
+  is set, to be mixed across shards by the shuffle_batch_join of train.py.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[1024],
+               feature_names=["mean_inc3"],
+               cache_dir="/dev/shm/yt8m_feature_cache",
+               cache_dtype="float16",
+               shuffle=True):
+    """Construct a YT8MAggregatedFeatureCacheReader.
+
+    Args:
+      num_classes: a positive integer for the number of classes.
+      feature_sizes: positive integer(s) for the feature dimensions as a list.
+      feature_names: the feature name(s) in the tensorflow record as a list.
+      cache_dir: the directory of the decoded shards.
+      cache_dtype: the dtype of the cached features, "float16" (half the
+        memory) or "float32" (lossless).
+      shuffle: whether to shuffle the videos of each shard.
+    """
+    super(YT8MAggregatedFeatureCacheReader, self).__init__(
+        num_classes=num_classes,
+        feature_sizes=feature_sizes,
+        feature_names=feature_names)
+    self.cache_dir = cache_dir
+    self.cache_dtype = np.dtype(cache_dtype)
+    self.shuffle = shuffle
+    self.shards = {}
+    self.shards_lock = threading.Lock()
+    # a lock per shard, held while it is built
+    self.shard_locks = {}
+
+  def get_shard_dir(self, filename):
+    """Returns the cache directory of a TFRecord shard."""
+    stat = os.stat(filename)
+    key = "%s:%d:%d:%s:%s" % (os.path.abspath(filename), stat.st_size,
+                              int(stat.st_mtime), ",".join(self.feature_names),
+                              self.cache_dtype.name)
+    return os.path.join(self.cache_dir, "%s-%s" % (
+        os.path.basename(filename), hashlib.md5(key).hexdigest()[:16]))
+
+  def build_shard(self, filename, shard_dir):
+    """Parses a TFRecord shard and saves its decoded arrays to shard_dir."""
+    features, label_offsets, label_indices, video_ids = [], [0], [], []
+    for record in tf.python_io.tf_record_iterator(filename):
+      example = tf.train.Example.FromString(record).features.feature
+      video_ids.append(example["video_id"].bytes_list.value[0])
+      labels = example["labels"].int64_list.value
+      label_indices.extend(labels)
+      label_offsets.append(label_offsets[-1] + len(labels))
+      features.append(np.concatenate([
+          np.array(example[feature_name].float_list.value, dtype=np.float32)
+          for feature_name in self.feature_names]))
+    if features:
+      features = np.stack(features).astype(self.cache_dtype)
+    else:
+      features = np.zeros([0, sum(self.feature_sizes)], dtype=self.cache_dtype)
+
+    # concurrent builders write to their own directory, the first one to be
+    # renamed to shard_dir wins
+    if not os.path.isdir(self.cache_dir):
+      try:
+        os.makedirs(self.cache_dir)
+      except OSError:
+        pass
+    temp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".building-")
+    np.save(os.path.join(temp_dir, "features.npy"), features)
+    np.save(os.path.join(temp_dir, "label_offsets.npy"),
+            np.array(label_offsets, dtype=np.int64))
+    np.save(os.path.join(temp_dir, "label_indices.npy"),
+            np.array(label_indices, dtype=np.int32))
+    np.save(os.path.join(temp_dir, "video_ids.npy"),
+            np.array(video_ids, dtype=np.string_))
+    try:
+      os.rename(temp_dir, shard_dir)
+      logging.info("Cached %d videos of %s in %s.", len(video_ids), filename,
+                   shard_dir)
+    except OSError:
+      shutil.rmtree(temp_dir)
+
+  def load_shard(self, filename):
+    """Memory-maps (once per process) the arrays of a shard, built if needed.
+
+    Only the reads of the same shard wait for its build, the other reader
+    threads keep reading or building their own shards.
+    """
+    with self.shards_lock:
+      if filename in self.shards:
+        return self.shards[filename]
+      shard_lock = self.shard_locks.setdefault(filename, threading.Lock())
+    with shard_lock:
+      with self.shards_lock:
+        if filename in self.shards:
+          return self.shards[filename]
+      shard_dir = self.get_shard_dir(filename)
+      if not os.path.isdir(shard_dir):
+        self.build_shard(filename, shard_dir)
+      shard = {
+          name: np.load(os.path.join(shard_dir, name + ".npy"), mmap_mode="r")
+          for name in ["features", "label_offsets", "label_indices",
+                       "video_ids"]}
+      with self.shards_lock:
+        self.shards[filename] = shard
+      return shard
+
+  def read_shard(self, filename):
+    """Returns the video ids, features, labels and padding data of a shard."""
+    shard = self.load_shard(filename)
+    num_videos = len(shard["video_ids"])
+    if self.shuffle:
+      rows = np.random.permutation(num_videos)
+    else:
+      rows = np.arange(num_videos)
+    label_offsets = shard["label_offsets"]
+    labels = np.zeros([num_videos, self.num_classes], dtype=np.bool_)
+    for i, row in enumerate(rows):
+      labels[i, shard["label_indices"][
+          label_offsets[row]:label_offsets[row + 1]]] = True
+    return (np.array(shard["video_ids"][rows], dtype=np.object_),
+            shard["features"][rows].astype(np.float32),
+            labels,
+            np.ones([num_videos], dtype=np.float32))
+
+  def prepare_reader(self, filename_queue):
+    """Creates a single reader thread for the decoded feature cache.
+
+    Args:
+      filename_queue: A tensorflow queue of filename locations.
+
+    Returns:
+      A tuple of video indexes, features, labels, and padding data.
+    """
+    video_ids, features, labels, num_frames = tf.py_func(
+        self.read_shard, [filename_queue.dequeue()],
+        [tf.string, tf.float32, tf.bool, tf.float32])
+    video_ids.set_shape([None])
+    features.set_shape([None, sum(self.feature_sizes)])
+    labels.set_shape([None, self.num_classes])
+    num_frames.set_shape([None])
+    return video_ids, features, labels, num_frames
+
 class YT8MFrameFeatureReader(BaseReader):
   """Reads TFRecords of SequenceExamples.
 
@@ -137,7 +337,8 @@ class YT8MFrameFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["inc3"],
-               max_frames=300):
+               max_frames=300,
+               dequantize=True):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -145,6 +346,8 @@ class YT8MFrameFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      dequantize: if False, the frame features are returned as uint8 and
+        should be dequantized later with dequantize_frames.
     """
 
     assert len(feature_names) == len(feature_sizes), \
@@ -155,6 +358,7 @@ class YT8MFrameFeatureReader(BaseReader):
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.max_frames = max_frames
+    self.dequantize = dequantize
 
   def get_video_matrix(self,
                        features,
@@ -175,14 +379,16 @@ class YT8MFrameFeatureReader(BaseReader):
       feature_matrix: matrix of all frame-features
       num_frames: number of frames in the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
+    decoded_features = tf.reshape(tf.decode_raw(features, tf.uint8),
+                                  [-1, feature_size])
 
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
-    feature_matrix = utils.Dequantize(decoded_features,
-                                      max_quantized_value,
-                                      min_quantized_value)
+    if self.dequantize:
+      feature_matrix = utils.Dequantize(tf.cast(decoded_features, tf.float32),
+                                        max_quantized_value,
+                                        min_quantized_value)
+    else:
+      feature_matrix = decoded_features
     feature_matrix = resize_axis(feature_matrix, 0, max_frames)
     return feature_matrix, num_frames
 
@@ -258,6 +464,100 @@ class YT8MFrameFeatureReader(BaseReader):
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames
 
+class YT8MFrameFeatureBatchReader(YT8MFrameFeatureReader):
+  """Reads blocks of TFRecords of SequenceExamples as uint8 frames.
+
+  Up to batch_size records are read with a single read_up_to, then parsed and
+  decoded by one op each for the whole block, instead of one record per step.
+  The frames are always returned as uint8, so the reader is meant to be used
+  with --quantized_frames and dequantize_frames in the graph. The outputs are
+  the same as those of YT8MFrameFeatureReader(dequantize=False).
+
+  tf.io.parse_sequence_example is needed, i.e. Tensorflow 1.13 or higher.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[1024],
+               feature_names=["inc3"],
+               max_frames=300,
+               dequantize=False):
+    """Construct a YT8MFrameFeatureBatchReader.
+
+    Args:
+      num_classes: a positive integer for the number of classes.
+      feature_sizes: positive integer(s) for the feature dimensions as a list.
+      feature_names: the feature name(s) in the tensorflow record as a list.
+      max_frames: the maximum number of frames to process.
+      dequantize: must be False, the frame features are returned as uint8.
+    """
+    if dequantize:
+      raise ValueError("%s returns uint8 frames, it needs --quantized_frames."
+                       % self.__class__.__name__)
+    super(YT8MFrameFeatureBatchReader, self).__init__(
+        num_classes=num_classes, feature_sizes=feature_sizes,
+        feature_names=feature_names, max_frames=max_frames, dequantize=False)
+
+  def context_features(self):
+    """Returns the context features to parse, besides the labels."""
+    return {"video_id": tf.FixedLenFeature([], tf.string)}
+
+  def prepare_reader(self, filename_queue, batch_size=8):
+    """Creates a single reader thread for blocks of YouTube8M SequenceExamples.
+
+    Args:
+      filename_queue: A tensorflow queue of filename locations.
+      batch_size: the maximum number of records read per step.
+
+    Returns:
+      A tuple of video indexes, uint8 video features, labels, and padding
+      data, followed by the other context features.
+    """
+    reader = tf.TFRecordReader()
+    _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+
+    context_features = self.context_features()
+    context_features["labels"] = tf.VarLenFeature(tf.int64)
+    contexts, features, lengths = tf.io.parse_sequence_example(
+        serialized_examples,
+        context_features=context_features,
+        sequence_features={
+            feature_name : tf.FixedLenSequenceFeature([], dtype=tf.string)
+            for feature_name in self.feature_names
+        })
+
+    # read ground truth labels
+    batch_labels = tf.sparse_to_indicator(contexts["labels"], self.num_classes)
+
+    num_features = len(self.feature_names)
+    assert num_features > 0, "No feature selected: feature_names is empty!"
+
+    # the frames past the end of a video are empty strings, decode them as 0
+    num_examples = tf.shape(serialized_examples)[0]
+    feature_matrices = [None] * num_features
+    for feature_index in range(num_features):
+      feature_size = self.feature_sizes[feature_index]
+      frames = features[self.feature_names[feature_index]]
+      frames = tf.where(tf.equal(frames, ""),
+                        tf.fill(tf.shape(frames), "\0" * feature_size),
+                        frames)
+      decoded_features = tf.reshape(tf.decode_raw(frames, tf.uint8),
+                                    [num_examples, -1, feature_size])
+      feature_matrices[feature_index] = resize_axis(decoded_features, 1,
+                                                    self.max_frames)
+
+    # cap the number of frames at self.max_frames
+    batch_frames = tf.minimum(
+        tf.cast(lengths[self.feature_names[0]], tf.int32), self.max_frames)
+
+    # concatenate different features
+    batch_video_matrix = tf.concat(feature_matrices, 2)
+
+    return (contexts["video_id"], batch_video_matrix, batch_labels,
+            batch_frames) + tuple(
+                contexts[name] for name in sorted(self.context_features())
+                if name != "video_id")
+
 class YT8MAggregatedDistillationFeatureReader(BaseReader):
   """Reads TFRecords of pre-aggregated Examples.
 
@@ -333,7 +633,8 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["inc3"],
-               max_frames=300):
+               max_frames=300,
+               dequantize=True):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -341,6 +642,8 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      dequantize: if False, the frame features are returned as uint8 and
+        should be dequantized later with dequantize_frames.
     """
 
     assert len(feature_names) == len(feature_sizes), \
@@ -351,6 +654,7 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.max_frames = max_frames
+    self.dequantize = dequantize
 
   def get_video_matrix(self,
                        features,
@@ -371,14 +675,16 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
       feature_matrix: matrix of all frame-features
       num_frames: number of frames in the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
+    decoded_features = tf.reshape(tf.decode_raw(features, tf.uint8),
+                                  [-1, feature_size])
 
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
-    feature_matrix = utils.Dequantize(decoded_features,
-                                      max_quantized_value,
-                                      min_quantized_value)
+    if self.dequantize:
+      feature_matrix = utils.Dequantize(tf.cast(decoded_features, tf.float32),
+                                        max_quantized_value,
+                                        min_quantized_value)
+    else:
+      feature_matrix = decoded_features
     feature_matrix = resize_axis(feature_matrix, 0, max_frames)
     return feature_matrix, num_frames
 
@@ -457,3 +763,148 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames, batch_predictions
 
 
+class YT8MFrameDistillationFeatureBatchReader(YT8MFrameFeatureBatchReader):
+  """Reads blocks of TFRecords of SequenceExamples with distilled predictions.
+
+  The batch version of YT8MFrameDistillationFeatureReader with uint8 frames,
+  see YT8MFrameFeatureBatchReader.
+  """
+
+  def context_features(self):
+    """Returns the context features to parse, besides the labels."""
+    return {"video_id": tf.FixedLenFeature([], tf.string),
+            "predictions": tf.FixedLenFeature([self.num_classes], tf.float32)}
+
+class YT8MFrameFeatureCacheReader(BaseReader):
+  """Reads frame-level features from a memory-mapped columnar cache.
+
+  The cache is written by convert-frame-cache.py, one directory per TFRecord
+  shard, holding:
+    <feature_name>.npy: uint8 [total_frames, feature_size] frame matrix.
+    offsets.npy: int64 [num_videos], row of the first frame of each video.
+    num_frames.npy: int32 [num_videos], number of frames of each video.
+    label_offsets.npy: int64 [num_videos + 1], label_indices[label_offsets[i]:
+      label_offsets[i + 1]] are the labels of video i.
+    label_indices.npy: int32 [num_labels], the sparse label index.
+    video_ids.npy: [num_videos] video_id table.
+    index: one video row number per line.
+
+  The data pattern should match the index files. Rows are read from them with
+  a TextLineReader, so epochs and file shuffling are handled by the
+  filename_queue as usual, and the frames are sliced out of the memory-mapped
+  arrays without any protobuf parsing. Since the arrays are mapped read-only,
+  concurrent jobs on the same host share their page cache. The outputs are
+  identical to those of YT8MFrameFeatureReader.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[1024],
+               feature_names=["inc3"],
+               max_frames=300,
+               dequantize=True,
+               batch_size=32):
+    """Construct a YT8MFrameFeatureCacheReader.
+
+    Args:
+      num_classes: a positive integer for the number of classes.
+      feature_sizes: positive integer(s) for the feature dimensions as a list.
+      feature_names: the feature name(s) in the cache as a list.
+      max_frames: the maximum number of frames to process.
+      dequantize: if False, the frame features are returned as uint8 and
+        should be dequantized later with dequantize_frames.
+      batch_size: the maximum number of videos read per op.
+    """
+
+    assert len(feature_names) == len(feature_sizes), \
+    "length of feature_names (={}) != length of feature_sizes (={})".format( \
+    len(feature_names), len(feature_sizes))
+
+    self.num_classes = num_classes
+    self.feature_sizes = feature_sizes
+    self.feature_names = feature_names
+    self.max_frames = max_frames
+    self.dequantize = dequantize
+    self.batch_size = batch_size
+    self.shards = {}
+    self.shards_lock = threading.Lock()
+
+  def load_shard(self, shard_dir):
+    """Memory-maps (once per process) the arrays of a cache shard."""
+    with self.shards_lock:
+      if shard_dir not in self.shards:
+        names = self.feature_names + ["offsets", "num_frames", "label_offsets",
+                                      "label_indices", "video_ids"]
+        self.shards[shard_dir] = {
+            name: np.load(os.path.join(shard_dir, name + ".npy"), mmap_mode="r")
+            for name in names}
+      return self.shards[shard_dir]
+
+  def gather_videos(self, keys, rows, max_quantized_value, min_quantized_value):
+    """Slices a block of videos out of the cache.
+
+    Args:
+      keys: the "<index file>:<line>" keys of the TextLineReader.
+      rows: the video row numbers read from the index files.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video ids, video matrices padded with 0 (uint8 unless
+      dequantize is set), labels, and numbers of frames.
+    """
+    num_videos = len(rows)
+    video_ids = []
+    video_matrix = np.zeros(
+        [num_videos, self.max_frames, sum(self.feature_sizes)],
+        dtype=np.float32 if self.dequantize else np.uint8)
+    labels = np.zeros([num_videos, self.num_classes], dtype=np.bool_)
+    num_frames = np.zeros([num_videos], dtype=np.int32)
+    for i in range(num_videos):
+      shard = self.load_shard(os.path.dirname(keys[i].rsplit(":", 1)[0]))
+      row = int(rows[i])
+      video_ids.append(shard["video_ids"][row])
+      num_frames[i] = min(shard["num_frames"][row], self.max_frames)
+      offset = shard["offsets"][row]
+      column = 0
+      for feature_name, feature_size in zip(self.feature_names,
+                                            self.feature_sizes):
+        frames = shard[feature_name][offset:offset + num_frames[i]]
+        if self.dequantize:
+          # only the real frames are dequantized, the padding stays 0
+          frames = utils.Dequantize(frames.astype(np.float32),
+                                    max_quantized_value, min_quantized_value)
+        video_matrix[i, :num_frames[i], column:column + feature_size] = frames
+        column += feature_size
+      labels[i, shard["label_indices"][
+          shard["label_offsets"][row]:shard["label_offsets"][row + 1]]] = True
+    return np.array(video_ids, dtype=np.object_), video_matrix, labels, num_frames
+
+  def prepare_reader(self,
+                     filename_queue,
+                     max_quantized_value=2,
+                     min_quantized_value=-2):
+    """Creates a single reader thread for the frame cache.
+
+    Args:
+      filename_queue: A tensorflow queue of cache index file locations.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, and padding data.
+    """
+    reader = tf.TextLineReader()
+    keys, rows = reader.read_up_to(filename_queue, self.batch_size)
+    video_ids, video_matrix, labels, num_frames = tf.py_func(
+        lambda keys, rows: self.gather_videos(
+            keys, rows, max_quantized_value, min_quantized_value),
+        [keys, rows],
+        [tf.string, tf.float32 if self.dequantize else tf.uint8, tf.bool,
+         tf.int32])
+    video_ids.set_shape([None])
+    video_matrix.set_shape(
+        [None, self.max_frames, sum(self.feature_sizes)])
+    labels.set_shape([None, self.num_classes])
+    num_frames.set_shape([None])
+    return video_ids, video_matrix, labels, num_frames
@@ -5,39 +5,95 @@ from tensorflow import app
 from tensorflow import flags
 import numpy as np
 import os, fnmatch
-import threading
-import Queue
+import multiprocessing
+import time
 import utils
 
 flags.DEFINE_string("src_path", "/Youtube-8M/data/frame/train", "")
 flags.DEFINE_string("des_path", "./mean_std.tfrecord", "")
-
-def get_frame_input_feature(input_file):
-    features = []
-    record_iterator = tf.python_io.tf_record_iterator(path=input_file)
-    for i, string_record in enumerate(record_iterator):
-        example = tf.train.SequenceExample()
-        example.ParseFromString(string_record)
-
-        # traverse the Example format to get data
-        video_id = example.context.feature['video_id'].bytes_list.value[0]
-        label = example.context.feature['labels'].int64_list.value[:]
-        rgbs = []
-        audios = []
-        rgb_feature = example.feature_lists.feature_list['rgb'].feature
-        for i in range(len(rgb_feature)):
-            rgb = np.fromstring(rgb_feature[i].bytes_list.value[0], dtype=np.uint8).astype(np.float32)
-            rgb = utils.Dequantize(rgb, 2, -2)
-            rgbs.append(rgb)
-        audio_feature = example.feature_lists.feature_list['audio'].feature
-        for i in range(len(audio_feature)):
-            audio = np.fromstring(audio_feature[i].bytes_list.value[0], dtype=np.uint8).astype(np.float32)
-            audio = utils.Dequantize(audio, 2, -2)
-            audios.append(audio)
-        rgbs = np.array(rgbs)
-        audios = np.array(audios)
-        features.append((video_id, label, rgbs, audios))
-    return features
+flags.DEFINE_integer("num_workers", multiprocessing.cpu_count(),
+                     "Number of worker processes.")
+
+# frame features and dimensions
+FRAME_FEATURES = [('rgb', 1024), ('audio', 128)]
+# statistics of a video, taken over its frames
+VIDEO_STATS = ['mean_rgb', 'mean_audio', 'std_rgb', 'std_audio']
+
+class Moments(object):
+    """Streaming count, mean and sum of squared deviations of values.
+
+    Batches are added with the update of Welford and merged with the pairwise
+    formula of Chan et al., in float64, so that the memory does not depend on
+    the number of values.
+    """
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def update(self, values):
+        """Adds a batch of values, stacked along the first axis."""
+        values = np.asarray(values, dtype=np.float64)
+        mean = values.mean(axis=0)
+        self.merge(len(values), mean, ((values - mean) ** 2).sum(axis=0))
+
+    def merge(self, count, mean, m2):
+        """Adds the moments of another set of values."""
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (float(count) / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (float(self.count) * count / total)
+        self.count = total
+
+    def std(self):
+        """Returns the population standard deviation, as np.std."""
+        return np.sqrt(self.m2 / self.count)
+
+def get_video_stats(example):
+    """Returns the mean and std over the frames of the features of a video.
+
+    The frames of a feature are decoded and dequantized as a single matrix.
+    """
+    means = []
+    stds = []
+    for name, size in FRAME_FEATURES:
+        feature_list = example.feature_lists.feature_list[name].feature
+        frames = np.frombuffer(b"".join(f.bytes_list.value[0] for f in feature_list),
+                               dtype=np.uint8).reshape([-1, size])
+        frames = utils.Dequantize(frames.astype(np.float32), 2, -2)
+        means.append(np.mean(frames, axis=0))
+        stds.append(np.std(frames, axis=0))
+    return means + stds, frames.shape[0]
+
+def get_file_stats(input_file):
+    """Returns the moments across the videos of a file of the VIDEO_STATS.
+
+    Returns:
+      The number of videos and frames in the file, and for each of VIDEO_STATS,
+      its mean and std across the videos of every dimension, and its mean and
+      std across the videos and dimensions together.
+    """
+    dim_moments = [Moments(size) for _, size in FRAME_FEATURES * 2]
+    all_moments = [Moments() for _ in VIDEO_STATS]
+    num_videos = 0
+    num_frames = 0
+    for string_record in tf.python_io.tf_record_iterator(path=input_file):
+        example = tf.train.SequenceExample.FromString(string_record)
+        video_stats, video_frames = get_video_stats(example)
+        if video_frames == 0:
+            continue
+        for i, stat in enumerate(video_stats):
+            dim_moments[i].update(stat[np.newaxis, :])
+            all_moments[i].update(stat)
+        num_videos += 1
+        num_frames += video_frames
+    if num_videos == 0:
+        return input_file, 0, 0, None
+    return input_file, num_videos, num_frames, [
+        (dim.mean, dim.std(), total.mean, total.std())
+        for dim, total in zip(dim_moments, all_moments)]
 
 def get_video_input_feature(input_file):
     features = []
@@ -73,100 +129,45 @@ def get_output_feature(video_id, labels, features, feature_names):
     example = tf.train.Example(features=tf.train.Features(feature=feature_maps))
     return example
 
-def read_batch_files(q,files):
-    mean_features = []
-    std_features = []
-    mean_all = []
-    std_all = []
-    for file in files:
-        print('processing '+file)
-        features = get_frame_input_feature(flags.FLAGS.src_path+'/'+file)
-        features_all = []
-
-        for i, feature in enumerate(features):
-            feature_1 = np.reshape(np.mean(feature[2], axis=0),[feature[2].shape[1],1])
-            feature_2 = np.reshape(np.mean(feature[3], axis=0),[feature[3].shape[1],1])
-            feature_3 = np.reshape(np.std(feature[2], axis=0),[feature[2].shape[1],1])
-            feature_4 = np.reshape(np.std(feature[3], axis=0),[feature[3].shape[1],1])
-            if features_all:
-                feature_1 = np.concatenate([features_all[0],feature_1],axis=1)
-                feature_2 = np.concatenate([features_all[1],feature_2],axis=1)
-                feature_3 = np.concatenate([features_all[2],feature_3],axis=1)
-                feature_4 = np.concatenate([features_all[3],feature_4],axis=1)
-                features_all = [feature_1,feature_2,feature_3,feature_4]
-            else:
-                features_all = [feature_1,feature_2,feature_3,feature_4]
-
-        mean_1 = []
-        std_1 = []
-        mean_all_1 = []
-        std_all_1 = []
-        for i in range(4):
-            mean_1.append(np.reshape(np.mean(features_all[i], axis=1),[features_all[i].shape[0],1]))
-            std_1.append(np.reshape(np.std(features_all[i], axis=1),[features_all[i].shape[0],1]))
-            mean_all_1.append(np.reshape(np.mean(features_all[i]),[1,1]))
-            std_all_1.append(np.reshape(np.std(features_all[i]),[1,1]))
-        if mean_features:
-            for i in range(4):
-                mean_features[i] = np.concatenate([mean_features[i],mean_1[i]],axis=1)
-                std_features[i] = np.concatenate([std_features[i],std_1[i]],axis=1)
-                mean_all[i] = np.concatenate([mean_all[i],mean_all_1[i]],axis=1)
-                std_all[i] = np.concatenate([std_all[i],std_all_1[i]],axis=1)
-        else:
-            for i in range(4):
-                mean_features.append(mean_1[i])
-                std_features.append(std_1[i])
-                mean_all.append(mean_all_1[i])
-                std_all.append(std_all_1[i])
-    q.put([mean_features,std_features,mean_all,std_all])
-
-class myThread(threading.Thread):
-    def __init__(self, threadID, name, files, q):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.name = name
-        self.files = files
-        self.q = q
-    def run(self):
-        print("Starting " + self.name)
-        read_batch_files(self.q, self.files)
-
 
 def main():
 
-    files = fnmatch.filter(os.listdir(flags.FLAGS.src_path), '*.tfrecord')
-    threads =[]
-    thread_num = 10
-    fstep = int(len(files)/thread_num)+1
-    q = Queue.Queue()
-    for i in range(thread_num):
-        thread = myThread(i, "Thread-%d" % i, files[fstep*i:fstep*(i+1)], q)
-        threads.append(thread)
-        # Wait for all threads to complete
-    print(threads)
-    mean_features = []
-    std_features = []
-    mean_all = []
-    std_all = []
-    #Start all threads in thread pool
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
-    while not q.empty():
-        response = q.get()
-        mean_features.extend(response[0])
-        std_features.extend(response[1])
-        mean_all.extend(response[2])
-        std_all.extend(response[3])
-    for i in range(4):
-        mean_features[i] = np.mean(mean_features[i],axis=1)
-        std_features[i] = np.mean(std_features[i],axis=1)
-        mean_all[i] = np.mean(mean_all[i],axis=1)
-        std_all[i] = np.mean(std_all[i],axis=1)
-
-    mean_all = np.array(mean_all)
-    std_all = np.array(std_all)
+    files = sorted(fnmatch.filter(os.listdir(flags.FLAGS.src_path), '*.tfrecord'))
+    files = [os.path.join(flags.FLAGS.src_path, f) for f in files]
+
+    # the statistics of the files are averaged over the files, so only their
+    # sums are kept
+    sums = None
+    num_files = 0
+    num_videos = 0
+    num_frames = 0
+    start_time = time.time()
+    pool = multiprocessing.Pool(flags.FLAGS.num_workers)
+    for input_file, file_videos, file_frames, file_stats in pool.imap_unordered(
+            get_file_stats, files):
+        num_videos += file_videos
+        num_frames += file_frames
+        elapsed = time.time() - start_time
+        print('processed %s, %d videos, %.1f videos/sec, %.1f frames/sec' % (
+            input_file, num_videos, num_videos / elapsed, num_frames / elapsed))
+        if file_stats is None:
+            continue
+        if sums is None:
+            sums = [list(stats) for stats in file_stats]
+        else:
+            for stat_sums, stats in zip(sums, file_stats):
+                for j in range(4):
+                    stat_sums[j] = stat_sums[j] + stats[j]
+        num_files += 1
+    pool.close()
+    pool.join()
+    if sums is None:
+        raise IOError("Unable to find videos in " + flags.FLAGS.src_path)
+
+    mean_features = [sums[i][0] / num_files for i in range(4)]
+    std_features = [sums[i][1] / num_files for i in range(4)]
+    mean_all = np.array([sums[i][2] / num_files for i in range(4)])
+    std_all = np.array([sums[i][3] / num_files for i in range(4)])
     mean_features.extend(std_features)
     mean_features.append(mean_all)
     mean_features.append(std_all)
@@ -51,12 +51,73 @@ ap3 = calculator.peek_ap_at_n()
 ```
 """
 
-import heapq
-import random
 import numbers
+import random
 
 import numpy
 
+# The random() sequence after random.seed(0), as a numpy MT19937 state.
+_SHUFFLE_STATE = random.Random(0).getstate()[1]
+
+
+def _shuffle_positions(length, indices):
+  """Returns where AveragePrecisionCalculator._shuffle moves some items.
+
+  _shuffle takes random.sample(range(length), length) after random.seed(0),
+  which draws j_i = int(random() * (length - i)) and, for i = 0, 1, ..., moves
+  pool[j_i] to the output position i and pool[length - 1 - i] into its place.
+  Numpy's MT19937 draws the same random() sequence, and an item only moves
+  when it is drawn (and then stays at the output position) or when it is the
+  last one of the pool (and then goes to position j_i), so the output
+  positions of a few items are found by following their moves, without
+  running the whole sampling in Python.
+
+  Args:
+    length: the length of the shuffled array.
+    indices: a numpy 1-D array of distinct indices in the array.
+
+  Returns:
+    A numpy 1-D array of the positions of the indices after the shuffle.
+  """
+  state = numpy.random.RandomState()
+  state.set_state(("MT19937",
+                   numpy.array(_SHUFFLE_STATE[:624], dtype=numpy.uint32),
+                   _SHUFFLE_STATE[624]))
+  # the item at pool position k is drawn from pool[:k + 1] at step k, i.e.
+  # i = length - 1 - k
+  draws = (state.random_sample(length) *
+           numpy.arange(length, 0, -1)).astype(numpy.int64)[::-1]
+
+  # the pool positions an item can go through: p, draws[p], draws[draws[p]]...
+  visited = numpy.zeros([length], dtype=numpy.bool_)
+  positions = numpy.array(indices, dtype=numpy.int64)
+  while positions.size:
+    visited[positions] = True
+    positions = numpy.unique(draws[positions])
+    positions = positions[~visited[positions]]
+  steps = numpy.nonzero(visited[draws])[0]  # steps drawing a visited position
+  keys = draws[steps] * length + steps  # sorted by position then step
+
+  positions = numpy.array(indices, dtype=numpy.int64)
+  last_step = numpy.full([len(positions)], length - 1, dtype=numpy.int64)
+  drawn_at = numpy.full([len(positions)], -1, dtype=numpy.int64)
+  moving = numpy.arange(len(positions))
+  keys = numpy.sort(keys)
+  while moving.size:
+    p = positions[moving]
+    # the last step, not after last_step, drawing the position of the item
+    found = numpy.searchsorted(keys, p * length + last_step[moving],
+                               side="right") - 1
+    key = keys[numpy.maximum(found, 0)]
+    drawn = (found >= 0) & (key // length == p)
+    drawn_at[moving[drawn]] = key[drawn] % length
+    # otherwise the item is moved from the end of the pool at step p
+    moving = moving[~drawn]
+    p = p[~drawn]
+    positions[moving] = draws[p]
+    last_step[moving] = p - 1
+  return length - 1 - drawn_at
+
 
 class AveragePrecisionCalculator(object):
   """Calculate the average precision and average precision at n."""
@@ -78,12 +139,18 @@ class AveragePrecisionCalculator(object):
 
     self._top_n = top_n  # average precision at n
     self._total_positives = 0  # total number of positives have seen
-    self._heap = []  # max heap of (prediction, actual)
+    # accumulated (prediction, actual) pairs in arrival order, in buffers
+    # doubled when full
+    self._predictions = numpy.zeros([0], dtype=numpy.bool_)
+    self._actuals = numpy.zeros([0], dtype=numpy.bool_)
+    self._size = 0
+    # the size at which the buffers are pruned again
+    self._prune_size = 2 * max(top_n or 0, 1024)
 
   @property
   def heap_size(self):
     """Gets the heap size maintained in the class."""
-    return len(self._heap)
+    return len(self._top_indices())
 
   @property
   def num_accumulated_positives(self):
@@ -120,36 +187,149 @@ class AveragePrecisionCalculator(object):
       self._total_positives += num_positives
     else:
       self._total_positives += numpy.size(numpy.where(actuals > 0))
-    topk = self._top_n
-    heap = self._heap
 
-    for i in range(numpy.size(predictions)):
-      if topk is None or len(heap) < topk:
-        heapq.heappush(heap, (predictions[i], actuals[i]))
-      else:
-        if predictions[i] > heap[0][0]:  # heap[0] is the smallest
-          heapq.heappop(heap)
-          heapq.heappush(heap, (predictions[i], actuals[i]))
+    self._append(numpy.asarray(predictions), numpy.asarray(actuals))
+
+  def _append(self, predictions, actuals):
+    """Appends (prediction, actual) pairs to the buffers."""
+    count = numpy.size(predictions)
+    for name, values in [("_predictions", predictions), ("_actuals", actuals)]:
+      buf = getattr(self, name)
+      # the buffers take a dtype holding every accumulated value
+      dtype = numpy.promote_types(buf.dtype, values.dtype)
+      if self._size + count > len(buf) or dtype != buf.dtype:
+        capacity = len(buf)
+        if self._size + count > capacity:
+          capacity = max(2 * capacity, self._size + count)
+        new_buf = numpy.zeros([capacity], dtype=dtype)
+        new_buf[:self._size] = buf[:self._size]
+        setattr(self, name, new_buf)
+      getattr(self, name)[self._size:self._size + count] = values
+    self._size += count
+    if self._top_n is not None and self._size >= self._prune_size:
+      self._prune()
+
+  def _prune(self):
+    """Drops the pairs predicted below the top_n-th largest prediction.
+
+    Such pairs are never kept by the heap of _top_indices, nor change which
+    pairs it keeps, whatever pairs come before or after them. So, unlike the
+    heap, the pruned pairs can be merged with the ones accumulated elsewhere.
+    The pairs tied at the top_n-th prediction are all kept, and the buffers
+    are pruned again once they double.
+    """
+    top_n = self._top_n
+    if top_n is None or self._size <= top_n:
+      return
+    predictions = self._predictions[:self._size]
+    if top_n == 0:
+      keep = numpy.zeros([0], dtype=numpy.int64)
+    else:
+      threshold = -numpy.partition(-predictions, top_n - 1)[top_n - 1]
+      keep = numpy.nonzero(predictions >= threshold)[0]
+    self._size = len(keep)
+    self._predictions[:self._size] = predictions[keep]
+    self._actuals[:self._size] = self._actuals[keep]
+    self._prune_size = max(2 * self._size, 2 * max(top_n, 1024))
+
+  def _top_indices(self):
+    """Returns the indices of the top_n pairs a heap of (prediction, actual)
+    would keep, in arrival order.
+
+    Such a heap takes a pair when it holds less than top_n pairs or when the
+    prediction is larger than its smallest one, and then pops its smallest
+    pair. So it ends with every pair predicted above t, the top_n-th largest
+    prediction, and the pairs predicted t which came before the top_n-th pair
+    predicted at least t, less the ones with the smallest actuals popped by
+    the pairs predicted above t which came after.
+    """
+    top_n = self._top_n
+    if top_n is None or self._size <= top_n:
+      return numpy.arange(self._size)
+    predictions = self._predictions[:self._size]
+    actuals = self._actuals[:self._size]
+    if top_n == 0:
+      keep = numpy.zeros([0], dtype=numpy.int64)
+    else:
+      threshold = -numpy.partition(-predictions, top_n - 1)[top_n - 1]
+      above = predictions > threshold
+      at = predictions == threshold
+      last_in = numpy.searchsorted(numpy.cumsum(above | at), top_n)
+      came_in = numpy.nonzero(at[:last_in + 1])[0]
+      num_at = top_n - numpy.count_nonzero(above)
+      came_in = came_in[numpy.argsort(actuals[came_in], kind="mergesort")]
+      keep = numpy.sort(numpy.concatenate([numpy.nonzero(above)[0],
+                                           came_in[len(came_in) - num_at:]]))
+    return keep
+
+  def get_state(self):
+    """Gets the accumulated state, as a dict of numpy arrays.
+
+    It can be saved by numpy.savez, and restored by set_state.
+    """
+    self._prune()
+    return {"top_n": numpy.array(-1 if self._top_n is None else self._top_n),
+            "total_positives": numpy.array(self._total_positives),
+            "predictions": self._predictions[:self._size].copy(),
+            "actuals": self._actuals[:self._size].copy()}
+
+  def set_state(self, state):
+    """Restores the state returned by get_state."""
+    top_n = int(state["top_n"])
+    self._top_n = None if top_n < 0 else top_n
+    self.clear()
+    self._total_positives = state["total_positives"][()]
+    self._append(state["predictions"], state["actuals"])
+
+  def merge(self, other):
+    """Merges the pairs accumulated by another calculator into this one.
+
+    The pairs of other are taken as accumulated after the ones of this
+    calculator, so merging the calculators of consecutive parts of the data in
+    order gives the same ap as accumulating all of it, and merges are
+    associative.
+
+    Raises:
+      ValueError: An error occurred when the calculators have different top_n.
+    """
+    state = other.get_state()
+    if self._top_n != other._top_n:
+      raise ValueError("the calculators have different top_n.")
+    self._total_positives += state["total_positives"][()]
+    self._append(state["predictions"], state["actuals"])
 
   def clear(self):
     """Clear the accumulated predictions."""
-    self._heap = []
+    self._predictions = numpy.zeros([0], dtype=numpy.bool_)
+    self._actuals = numpy.zeros([0], dtype=numpy.bool_)
+    self._size = 0
     self._total_positives = 0
+    self._prune_size = 2 * max(self._top_n or 0, 1024)
 
   def peek_ap_at_n(self):
     """Peek the non-interpolated average precision at n.
 
+    The kept pairs are passed to ap_at_n in arrival order, so tied
+    predictions are ranked as ap_at_n ranks them in that order. This deviates
+    from the heap this calculator used to keep, which passed them in its
+    layout order: on tied predictions (e.g. float16 or quantized ones) of both
+    positives and negatives the ap may differ from the heap's, otherwise it is
+    the same. The heap layout depends on the whole push history, including
+    the popped pairs, so it cannot be rebuilt by merge or set_state, whereas
+    the arrival order gives the same ap for merged shards as for a single
+    calculator.
+
     Returns:
       The non-interpolated average precision at n (default 0).
       If n is larger than the length of the ranked list,
       the average precision will be returned.
     """
-    if self.heap_size <= 0:
+    top_indices = self._top_indices()
+    if len(top_indices) <= 0:
       return 0
-    predlists = numpy.array(list(zip(*self._heap)))
 
-    ap = self.ap_at_n(predlists[0],
-                      predlists[1],
+    ap = self.ap_at_n(self._predictions[top_indices],
+                      self._actuals[top_indices],
                       n=self._top_n,
                       total_num_positives=self._total_positives)
     return ap
@@ -208,19 +388,9 @@ class AveragePrecisionCalculator(object):
         raise ValueError("n must be 'None' or a positive integer."
                          " It was '%s'." % n)
 
-    ap = 0.0
-
     predictions = numpy.array(predictions)
     actuals = numpy.array(actuals)
 
-    # add a shuffler to avoid overestimating the ap
-    predictions, actuals = AveragePrecisionCalculator._shuffle(predictions,
-                                                               actuals)
-    sortidx = sorted(
-        range(len(predictions)),
-        key=lambda k: predictions[k],
-        reverse=True)
-
     if total_num_positives is None:
       numpos = numpy.size(numpy.where(actuals > 0))
     else:
@@ -232,17 +402,57 @@ class AveragePrecisionCalculator(object):
     if n is not None:
       numpos = min(numpos, n)
     delta_recall = 1.0 / numpos
-    poscount = 0.0
 
-    # calculate the ap
-    r = len(sortidx)
+    sortidx = AveragePrecisionCalculator._rank(predictions, actuals, n)
+    positives = actuals[sortidx] > 0
+    poscount = numpy.cumsum(positives)[positives].astype(numpy.float64)
+    ranks = numpy.nonzero(positives)[0] + 1
+    if ranks.size == 0:
+      return 0.0
+    # summed in rank order, as the loop it replaces
+    return float(numpy.cumsum(poscount / ranks * delta_recall)[-1])
+
+  @staticmethod
+  def _rank(predictions, actuals, n=None):
+    """Returns the indices of the top n predictions, from the largest.
+
+    Ties are ranked as after _shuffle, i.e. in the order of their shuffled
+    positions. Only tied items with both positive and negative actuals are
+    looked up, since the order of the others does not change the ap (so they
+    are left in any order).
+    """
+    length = len(predictions)
+    if predictions.dtype.kind == "f":
+      keys = -predictions
+    else:
+      keys = -predictions.astype(numpy.float64)
+    if n is not None and n < length:
+      threshold = numpy.partition(keys, n - 1)[n - 1]
+      candidates = numpy.nonzero(keys <= threshold)[0]
+    else:
+      candidates = numpy.arange(length)
+    sortidx = candidates[numpy.argsort(keys[candidates])]
     if n is not None:
-      r = min(r, n)
-    for i in range(r):
-      if actuals[sortidx[i]] > 0:
-        poscount += 1
-        ap += poscount / (i + 1) * delta_recall
-    return ap
+      limit = min(n, length)
+    else:
+      limit = length
+    if limit == 0:
+      return sortidx
+
+    # groups of tied predictions reaching the top n
+    sorted_keys = keys[sortidx]
+    group = numpy.concatenate([[0], numpy.cumsum(
+        sorted_keys[1:] != sorted_keys[:-1])])
+    group_sizes = numpy.bincount(group)
+    group_positives = numpy.bincount(group, weights=actuals[sortidx] > 0)
+    mixed = (group_positives > 0) & (group_positives < group_sizes)
+    mixed[group[limit - 1] + 1:] = False
+    slots = numpy.nonzero(mixed[group])[0]
+    if slots.size:
+      shuffled = _shuffle_positions(length, sortidx[slots])
+      order = numpy.argsort(group[slots] * length + shuffled)
+      sortidx[slots] = sortidx[slots][order]
+    return sortidx[:limit]
 
   @staticmethod
   def _shuffle(predictions, actuals):
@@ -272,3 +482,176 @@ class AveragePrecisionCalculator(object):
     ret = (predictions - numpy.min(predictions)) / numpy.max(denominator,
                                                              epsilon)
     return ret
+
+
+class HistogramAveragePrecisionCalculator(object):
+  """Estimate the average precision from histograms of the predictions.
+
+  A bounded memory alternative to AveragePrecisionCalculator for the ap of all
+  the accumulated points (top_n=None): the predictions, in [0, 1], are counted
+  in num_bins equal bins, separately for the positives and the negatives, and
+  the ap is computed from the counts in O(num_bins).
+
+  The points of different bins are ranked as by their predictions, so only the
+  order within the bins is unknown. peek_ap_bounds returns the smallest and the
+  largest ap over the orders of the points within each bin (positives last or
+  first), which bound the exact ap whatever the tie breaking. peek_ap_at_n
+  returns the ap expected when every bin is in random order, as the shuffled
+  ties of AveragePrecisionCalculator, and lies within the bounds, so its error
+  is at most the width of the bounds.
+  """
+
+  def __init__(self, num_bins=2**16):
+    """Construct a HistogramAveragePrecisionCalculator.
+
+    Args:
+      num_bins: A positive integer, the number of bins over [0, 1]. The
+        memory used is 16 bytes per bin.
+
+    Raises:
+      ValueError: An error occurred when num_bins is not a positive integer.
+    """
+    if not (isinstance(num_bins, int) and num_bins > 0):
+      raise ValueError("num_bins must be a positive integer.")
+
+    self._num_bins = num_bins
+    self._total_positives = 0  # total number of positives have seen
+    self._positives = numpy.zeros([num_bins], dtype=numpy.int64)
+    self._negatives = numpy.zeros([num_bins], dtype=numpy.int64)
+
+  @property
+  def num_bins(self):
+    """Gets the number of bins of the histograms."""
+    return self._num_bins
+
+  @property
+  def num_accumulated_positives(self):
+    """Gets the number of positive samples that have been accumulated."""
+    return self._total_positives
+
+  def accumulate(self, predictions, actuals, num_positives=None):
+    """Accumulate the predictions and their ground truth labels.
+
+    Args:
+      predictions: a list storing the prediction scores, in [0, 1]. Scores
+        out of the range are counted in the first or the last bin.
+      actuals: a list storing the ground truth labels. Any value
+        larger than 0 will be treated as positives, otherwise as negatives.
+      num_positives: If the 'predictions' and 'actuals' inputs aren't
+        complete, the number of true positives, to accurately track recall.
+
+    Raises:
+      ValueError: An error occurred when the shape of predictions and actuals
+        does not match or num_positives is not a nonnegative number.
+    """
+    if len(predictions) != len(actuals):
+      raise ValueError("the shape of predictions and actuals does not match.")
+
+    if num_positives is not None:
+      if not isinstance(num_positives, numbers.Number) or num_positives < 0:
+        raise ValueError("'num_positives' was provided but it wan't a nonzero number.")
+
+    predictions = numpy.asarray(predictions, dtype=numpy.float64)
+    positive = numpy.asarray(actuals) > 0
+    bins = numpy.clip((predictions * self._num_bins).astype(numpy.int64),
+                      0, self._num_bins - 1)
+    self._positives += numpy.bincount(bins[positive],
+                                      minlength=self._num_bins)
+    self._negatives += numpy.bincount(bins[~positive],
+                                      minlength=self._num_bins)
+    if num_positives is not None:
+      self._total_positives += num_positives
+    else:
+      self._total_positives += numpy.count_nonzero(positive)
+
+  def get_state(self):
+    """Gets the accumulated histograms, as a dict of numpy arrays.
+
+    It can be saved by numpy.savez, and restored by set_state.
+    """
+    return {"total_positives": numpy.array(self._total_positives),
+            "positives": self._positives.copy(),
+            "negatives": self._negatives.copy()}
+
+  def set_state(self, state):
+    """Restores the state returned by get_state."""
+    self._num_bins = len(state["positives"])
+    self._total_positives = state["total_positives"][()]
+    self._positives = state["positives"].astype(numpy.int64)
+    self._negatives = state["negatives"].astype(numpy.int64)
+
+  def merge(self, other):
+    """Adds the histograms of another calculator to the ones of this one.
+
+    Raises:
+      ValueError: An error occurred when the calculators have different
+        num_bins.
+    """
+    if self._num_bins != other.num_bins:
+      raise ValueError("the calculators have different num_bins.")
+    state = other.get_state()
+    self._total_positives += state["total_positives"][()]
+    self._positives += state["positives"]
+    self._negatives += state["negatives"]
+
+  def clear(self):
+    """Clear the accumulated predictions."""
+    self._total_positives = 0
+    self._positives[:] = 0
+    self._negatives[:] = 0
+
+  def _bin_counts(self):
+    """Returns the positives, negatives and points ranked before every bin."""
+    positives = self._positives[::-1].astype(numpy.float64)
+    negatives = self._negatives[::-1].astype(numpy.float64)
+    positives_before = numpy.cumsum(positives) - positives
+    points_before = numpy.cumsum(positives + negatives) - positives - negatives
+    return positives, negatives, positives_before, points_before
+
+  def peek_ap_bounds(self):
+    """Peek the range of the average precision over the orders within bins.
+
+    For a bin holding p positives and n negatives after r points, of which
+    t positives, the precision at its j-th positive is at least
+    (t + j) / (r + n + j) and at most (t + j) / (r + j). These increase with
+    j, so the ap is at least sum p * (t + 1) / (r + n + 1) and at most
+    sum p * (t + p) / (r + p), over the bins, divided by the number of
+    positives.
+
+    Returns:
+      A tuple of the lower and upper bounds of the non-interpolated average
+      precision (default 0, 0).
+    """
+    if self._total_positives <= 0:
+      return 0.0, 0.0
+    p, n, t, r = self._bin_counts()
+    used = p > 0
+    p, n, t, r = p[used], n[used], t[used], r[used]
+    lower = numpy.sum(p * (t + 1) / (r + n + 1)) / self._total_positives
+    upper = numpy.sum(p * (t + p) / (r + p)) / self._total_positives
+    return lower, upper
+
+  def peek_ap_at_n(self):
+    """Peek the estimated non-interpolated average precision.
+
+    In a bin in random order, the j-th positive is expected at the rank
+    r + j * k, with k = (p + n + 1) / (p + 1), so the precisions at its
+    positives are about (t + x) / (r + k * x) for x = 1..p, summed as the
+    integral of the function from 1/2 to p + 1/2.
+
+    Returns:
+      The estimated non-interpolated average precision (default 0).
+    """
+    if self._total_positives <= 0:
+      return 0
+    p, n, t, r = self._bin_counts()
+    used = p > 0
+    p, n, t, r = p[used], n[used], t[used], r[used]
+    k = (p + n + 1) / (p + 1)
+
+    def integral(x):
+      return x / k + (t - r / k) / k * numpy.log(r + k * x)
+
+    ap = numpy.sum(integral(p + 0.5) - integral(0.5)) / self._total_positives
+    lower, upper = self.peek_ap_bounds()
+    return min(max(ap, lower), upper)
@@ -53,6 +53,16 @@ if __name__ == "__main__":
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "frame_batch_reader", False,
+      "If set, frame-level features are read by the *FeatureBatchReader, which "
+      "reads and decodes blocks of SequenceExamples per op. It needs "
+      "--quantized_frames.")
+  flags.DEFINE_bool(
+      "quantized_frames", False,
+      "If set, frame-level features are kept as uint8 in the input queues and "
+      "dequantized in the graph right before the model, which takes about 4x "
+      "less queue memory.")
   flags.DEFINE_bool(
       "norm", True,
       "If set, then --input_data should be l2-normalized before follow-up processing. "
@@ -75,6 +85,16 @@ if __name__ == "__main__":
                        "How many threads to use for reading input files.")
   flags.DEFINE_boolean("run_once", False, "Whether to run eval only once.")
   flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+  flags.DEFINE_integer(
+      "metric_queue_size", 2,
+      "How many batches may wait for the thread accumulating the metrics, "
+      "which overlaps with the inference of the next batches. 0 accumulates "
+      "them synchronously.")
+  flags.DEFINE_integer(
+      "gap_histogram_bins", 0,
+      "If positive, estimate the GAP from histograms of this many bins of the "
+      "predictions, in bounded memory, instead of computing it exactly. The "
+      "memory of the MAP still grows with the number of videos.")
 
 
 def find_class_by_name(name, modules):
@@ -147,6 +167,9 @@ def build_graph(reader,
       eval_data_pattern,
       batch_size=batch_size,
       num_readers=num_readers)
+  if model_input_raw.dtype == tf.uint8:
+    # frame features were kept quantized through the input queues
+    model_input_raw = readers.dequantize_frames(model_input_raw, num_frames)
   tf.summary.histogram("model_input_raw", model_input_raw)
 
   feature_dim = len(model_input_raw.get_shape()) - 1
@@ -180,6 +203,28 @@ def build_graph(reader,
   tf.add_to_collection("summary_op", tf.summary.merge_all())
 
 
+def log_iteration_infos(summary_writer, global_step_val, iteration_info_dicts):
+  """Writes the summaries of the accumulated batches and logs them.
+
+  Returns:
+    The seconds spent accumulating the batches and blocked handing them over.
+  """
+  accumulate_seconds, wait_seconds = 0.0, 0.0
+  for iteration_info_dict in iteration_info_dicts:
+    iterinfo = utils.AddGlobalStepSummary(
+        summary_writer,
+        global_step_val,
+        iteration_info_dict,
+        summary_scope="Eval")
+    logging.info("examples_processed: %d | %s | Metrics: %.3fs, %.0f%% "
+                 "overlapped", iteration_info_dict["examples_processed"],
+                 iterinfo, iteration_info_dict["accumulate_seconds"],
+                 100 * iteration_info_dict["overlap"])
+    accumulate_seconds += iteration_info_dict["accumulate_seconds"]
+    wait_seconds += iteration_info_dict["wait_seconds"]
+  return accumulate_seconds, wait_seconds
+
+
 def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                     summary_op, saver, summary_writer, evl_metrics,
                     last_global_step_val):
@@ -227,6 +272,8 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
 
     # Start the queue runners.
     fetches = [video_id_batch, prediction_batch, label_batch, loss, summary_op]
+    async_metrics = eval_util.AsyncEvaluationMetrics(
+        evl_metrics, FLAGS.metric_queue_size)
     coord = tf.train.Coordinator()
     try:
       threads = []
@@ -238,6 +285,7 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                    global_step_val)
 
       evl_metrics.clear()
+      accumulate_seconds, wait_seconds = 0.0, 0.0
 
       examples_processed = 0
       while not coord.should_stop():
@@ -248,24 +296,28 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
         example_per_second = labels_val.shape[0] / seconds_per_batch
         examples_processed += labels_val.shape[0]
 
-        iteration_info_dict = evl_metrics.accumulate(predictions_val,
-                                                     labels_val, loss_val)
-        iteration_info_dict["examples_per_second"] = example_per_second
-
-        iterinfo = utils.AddGlobalStepSummary(
-            summary_writer,
-            global_step_val,
-            iteration_info_dict,
-            summary_scope="Eval")
-        logging.info("examples_processed: %d | %s", examples_processed,
-                     iterinfo)
+        async_metrics.accumulate(
+            predictions_val, labels_val, loss_val,
+            {"examples_per_second": example_per_second,
+             "examples_processed": examples_processed})
+        seconds = log_iteration_infos(summary_writer, global_step_val,
+                                      async_metrics.pop_finished())
+        accumulate_seconds += seconds[0]
+        wait_seconds += seconds[1]
 
     except tf.errors.OutOfRangeError as e:
       logging.info(
           "Done with batched inference. Now calculating global performance "
           "metrics.")
+      seconds = log_iteration_infos(summary_writer, global_step_val,
+                                    async_metrics.pop_finished(wait=True))
+      accumulate_seconds += seconds[0]
+      wait_seconds += seconds[1]
+      logging.info("Metrics: %.2fs, %.0f%% overlapped with the inference.",
+                   accumulate_seconds, 100 * max(
+                       0.0, 1.0 - wait_seconds / max(accumulate_seconds, 1e-9)))
       # calculate the metrics for the entire epoch
-      epoch_info_dict = evl_metrics.get()
+      epoch_info_dict = async_metrics.get()
       epoch_info_dict["epoch_id"] = global_step_val
 
       summary_writer.add_summary(summary_val, global_step_val)
@@ -282,6 +334,7 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
 
     coord.request_stop()
     coord.join(threads, stop_grace_period_secs=10)
+    async_metrics.close()
 
     return global_step_val
 
@@ -293,9 +346,14 @@ def evaluate():
     feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
         FLAGS.feature_names, FLAGS.feature_sizes)
 
-    if FLAGS.frame_features:
+    if FLAGS.frame_features and FLAGS.frame_batch_reader:
+      reader = readers.YT8MFrameFeatureBatchReader(feature_names=feature_names,
+                                                   feature_sizes=feature_sizes,
+                                                   dequantize=not FLAGS.quantized_frames)
+    elif FLAGS.frame_features:
       reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                              feature_sizes=feature_sizes)
+                                              feature_sizes=feature_sizes,
+                                              dequantize=not FLAGS.quantized_frames)
     else:
       reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                    feature_sizes=feature_sizes)
@@ -326,7 +384,8 @@ def evaluate():
     summary_writer = tf.summary.FileWriter(
         FLAGS.train_dir, graph=tf.get_default_graph())
 
-    evl_metrics = eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k)
+    evl_metrics = eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k,
+                                              FLAGS.gap_histogram_bins)
 
     last_global_step_val = -1
     while True:
@@ -2298,6 +2298,8 @@ class LstmNoOutputModel(models.BaseModel):
 
 class LstmModel(models.BaseModel):
 
+  variable_frames = True
+
   def create_model(self, model_input, vocab_size, num_frames, **unused_params):
       """Creates a model which uses a stack of LSTMs to represent the video.
 
@@ -3755,6 +3757,8 @@ class LstmDivideModel(models.BaseModel):
 
 class LstmDivideRebuildModel(models.BaseModel):
 
+    variable_frames = True
+
     def create_model(self, model_input, vocab_size, num_frames, **unused_params):
         """Creates a model which uses a stack of LSTMs to represent the video.
 
@@ -3924,6 +3928,8 @@ class LstmResidualModel(models.BaseModel):
 
 class LstmNoiseModel(models.BaseModel):
 
+    variable_frames = True
+
     def create_model(self, model_input, vocab_size, num_frames, **unused_params):
         """Creates a model which uses a stack of LSTMs to represent the video.
 
@@ -52,6 +52,16 @@ if __name__ == '__main__':
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "frame_batch_reader", False,
+      "If set, frame-level features are read by the *FeatureBatchReader, which "
+      "reads and decodes blocks of SequenceExamples per op. It needs "
+      "--quantized_frames.")
+  flags.DEFINE_bool(
+      "quantized_frames", False,
+      "If set, frame-level features are kept as uint8 in the input queues and "
+      "dequantized in the graph right before the model, which takes about 4x "
+      "less queue memory.")
   flags.DEFINE_integer(
       "batch_size", 1024,
       "How many examples to process per batch.")
@@ -113,6 +123,9 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
                             batch_size=batch_size,
                             allow_smaller_final_batch=True,
                             enqueue_many=True))
+    if video_batch.dtype == tf.uint8:
+      # frame features were kept quantized through the input queue
+      video_batch = readers.dequantize_frames(video_batch, num_frames_batch)
     return video_id_batch, video_batch, num_frames_batch
 
 def inference(reader, train_dir, data_pattern, out_file_location, batch_size, top_k):
@@ -182,9 +195,14 @@ def main(unused_argv):
   feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
       FLAGS.feature_names, FLAGS.feature_sizes)
 
-  if FLAGS.frame_features:
+  if FLAGS.frame_features and FLAGS.frame_batch_reader:
+    reader = readers.YT8MFrameFeatureBatchReader(feature_names=feature_names,
+                                                 feature_sizes=feature_sizes,
+                                                 dequantize=not FLAGS.quantized_frames)
+  elif FLAGS.frame_features:
     reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                            feature_sizes=feature_sizes)
+                                            feature_sizes=feature_sizes,
+                                            dequantize=not FLAGS.quantized_frames)
   else:
     reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                  feature_sizes=feature_sizes)
@@ -17,5 +17,9 @@
 class BaseModel(object):
   """Inherit from this class when implementing new models."""
 
+  # Whether create_model accepts frame-level input without a static number of
+  # frames, as the batches of --bucket_boundaries in train.py.
+  variable_frames = False
+
   def create_model(self, unused_model_input, **unused_params):
     raise NotImplementedError()
@@ -55,6 +55,38 @@ def resize_axis(tensor, axis, new_size, fill_value=0):
   resized.set_shape(new_shape)
   return resized
 
+def dequantize_frames(quantized_matrix,
+                      num_frames,
+                      max_quantized_value=2,
+                      min_quantized_value=-2):
+  """Dequantizes a batch of padded byte frame features.
+
+  The padded frames (beyond num_frames) are set to 0, so that the result is
+  identical to dequantizing each video first and padding it afterwards.
+
+  Args:
+    quantized_matrix: A uint8 tensor of shape [batch, max_frames, feature_size].
+    num_frames: An int32 tensor of shape [batch] with the valid frame counts.
+    max_quantized_value: the maximum of the quantized value.
+    min_quantized_value: the minimum of the quantized value.
+
+  Returns:
+    A float32 tensor with the same shape as quantized_matrix.
+  """
+  quantized_matrix = tf.convert_to_tensor(quantized_matrix)
+  shape = tf.shape(quantized_matrix)
+  feature_matrix = utils.Dequantize(tf.cast(quantized_matrix, tf.float32),
+                                    max_quantized_value,
+                                    min_quantized_value)
+  # select frames with a [batch * max_frames] mask to avoid tiling the mask
+  feature_matrix = tf.reshape(feature_matrix, [-1, shape[2]])
+  frame_mask = tf.reshape(tf.sequence_mask(num_frames, shape[1]), [-1])
+  feature_matrix = tf.where(frame_mask, feature_matrix,
+                            tf.zeros_like(feature_matrix))
+  feature_matrix = tf.reshape(feature_matrix, shape)
+  feature_matrix.set_shape(quantized_matrix.get_shape())
+  return feature_matrix
+
 class BaseReader(object):
   """Inherit from this class when implementing new readers."""
 
@@ -137,7 +169,8 @@ class YT8MFrameFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["inc3"],
-               max_frames=300):
+               max_frames=300,
+               dequantize=True):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -145,6 +178,8 @@ class YT8MFrameFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      dequantize: if False, the frame features are returned as uint8 and
+        should be dequantized later with dequantize_frames.
     """
 
     assert len(feature_names) == len(feature_sizes), \
@@ -155,6 +190,7 @@ class YT8MFrameFeatureReader(BaseReader):
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.max_frames = max_frames
+    self.dequantize = dequantize
 
   def get_video_matrix(self,
                        features,
@@ -175,14 +211,16 @@ class YT8MFrameFeatureReader(BaseReader):
       feature_matrix: matrix of all frame-features
       num_frames: number of frames in the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
+    decoded_features = tf.reshape(tf.decode_raw(features, tf.uint8),
+                                  [-1, feature_size])
 
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
-    feature_matrix = utils.Dequantize(decoded_features,
-                                      max_quantized_value,
-                                      min_quantized_value)
+    if self.dequantize:
+      feature_matrix = utils.Dequantize(tf.cast(decoded_features, tf.float32),
+                                        max_quantized_value,
+                                        min_quantized_value)
+    else:
+      feature_matrix = decoded_features
     feature_matrix = resize_axis(feature_matrix, 0, max_frames)
     return feature_matrix, num_frames
 
@@ -258,6 +296,100 @@ class YT8MFrameFeatureReader(BaseReader):
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames
 
+class YT8MFrameFeatureBatchReader(YT8MFrameFeatureReader):
+  """Reads blocks of TFRecords of SequenceExamples as uint8 frames.
+
+  Up to batch_size records are read with a single read_up_to, then parsed and
+  decoded by one op each for the whole block, instead of one record per step.
+  The frames are always returned as uint8, so the reader is meant to be used
+  with --quantized_frames and dequantize_frames in the graph. The outputs are
+  the same as those of YT8MFrameFeatureReader(dequantize=False).
+
+  tf.io.parse_sequence_example is needed, i.e. Tensorflow 1.13 or higher.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[1024],
+               feature_names=["inc3"],
+               max_frames=300,
+               dequantize=False):
+    """Construct a YT8MFrameFeatureBatchReader.
+
+    Args:
+      num_classes: a positive integer for the number of classes.
+      feature_sizes: positive integer(s) for the feature dimensions as a list.
+      feature_names: the feature name(s) in the tensorflow record as a list.
+      max_frames: the maximum number of frames to process.
+      dequantize: must be False, the frame features are returned as uint8.
+    """
+    if dequantize:
+      raise ValueError("%s returns uint8 frames, it needs --quantized_frames."
+                       % self.__class__.__name__)
+    super(YT8MFrameFeatureBatchReader, self).__init__(
+        num_classes=num_classes, feature_sizes=feature_sizes,
+        feature_names=feature_names, max_frames=max_frames, dequantize=False)
+
+  def context_features(self):
+    """Returns the context features to parse, besides the labels."""
+    return {"video_id": tf.FixedLenFeature([], tf.string)}
+
+  def prepare_reader(self, filename_queue, batch_size=8):
+    """Creates a single reader thread for blocks of YouTube8M SequenceExamples.
+
+    Args:
+      filename_queue: A tensorflow queue of filename locations.
+      batch_size: the maximum number of records read per step.
+
+    Returns:
+      A tuple of video indexes, uint8 video features, labels, and padding
+      data, followed by the other context features.
+    """
+    reader = tf.TFRecordReader()
+    _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+
+    context_features = self.context_features()
+    context_features["labels"] = tf.VarLenFeature(tf.int64)
+    contexts, features, lengths = tf.io.parse_sequence_example(
+        serialized_examples,
+        context_features=context_features,
+        sequence_features={
+            feature_name : tf.FixedLenSequenceFeature([], dtype=tf.string)
+            for feature_name in self.feature_names
+        })
+
+    # read ground truth labels
+    batch_labels = tf.sparse_to_indicator(contexts["labels"], self.num_classes)
+
+    num_features = len(self.feature_names)
+    assert num_features > 0, "No feature selected: feature_names is empty!"
+
+    # the frames past the end of a video are empty strings, decode them as 0
+    num_examples = tf.shape(serialized_examples)[0]
+    feature_matrices = [None] * num_features
+    for feature_index in range(num_features):
+      feature_size = self.feature_sizes[feature_index]
+      frames = features[self.feature_names[feature_index]]
+      frames = tf.where(tf.equal(frames, ""),
+                        tf.fill(tf.shape(frames), "\0" * feature_size),
+                        frames)
+      decoded_features = tf.reshape(tf.decode_raw(frames, tf.uint8),
+                                    [num_examples, -1, feature_size])
+      feature_matrices[feature_index] = resize_axis(decoded_features, 1,
+                                                    self.max_frames)
+
+    # cap the number of frames at self.max_frames
+    batch_frames = tf.minimum(
+        tf.cast(lengths[self.feature_names[0]], tf.int32), self.max_frames)
+
+    # concatenate different features
+    batch_video_matrix = tf.concat(feature_matrices, 2)
+
+    return (contexts["video_id"], batch_video_matrix, batch_labels,
+            batch_frames) + tuple(
+                contexts[name] for name in sorted(self.context_features())
+                if name != "video_id")
+
 class YT8MAggregatedDistillationFeatureReader(BaseReader):
   """Reads TFRecords of pre-aggregated Examples.
 
@@ -388,7 +520,8 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["inc3"],
-               max_frames=300):
+               max_frames=300,
+               dequantize=True):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -396,6 +529,8 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      dequantize: if False, the frame features are returned as uint8 and
+        should be dequantized later with dequantize_frames.
     """
 
     assert len(feature_names) == len(feature_sizes), \
@@ -406,6 +541,7 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.max_frames = max_frames
+    self.dequantize = dequantize
 
   def get_video_matrix(self,
                        features,
@@ -426,14 +562,16 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
       feature_matrix: matrix of all frame-features
       num_frames: number of frames in the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
+    decoded_features = tf.reshape(tf.decode_raw(features, tf.uint8),
+                                  [-1, feature_size])
 
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
-    feature_matrix = utils.Dequantize(decoded_features,
-                                      max_quantized_value,
-                                      min_quantized_value)
+    if self.dequantize:
+      feature_matrix = utils.Dequantize(tf.cast(decoded_features, tf.float32),
+                                        max_quantized_value,
+                                        min_quantized_value)
+    else:
+      feature_matrix = decoded_features
     feature_matrix = resize_axis(feature_matrix, 0, max_frames)
     return feature_matrix, num_frames
 
@@ -511,4 +649,14 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames, batch_predictions
 
+class YT8MFrameDistillationFeatureBatchReader(YT8MFrameFeatureBatchReader):
+  """Reads blocks of TFRecords of SequenceExamples with distilled predictions.
+
+  The batch version of YT8MFrameDistillationFeatureReader with uint8 frames,
+  see YT8MFrameFeatureBatchReader.
+  """
 
+  def context_features(self):
+    """Returns the context features to parse, besides the labels."""
+    return {"video_id": tf.FixedLenFeature([], tf.string),
+            "predictions": tf.FixedLenFeature([self.num_classes], tf.float32)}
@@ -55,6 +55,23 @@ if __name__ == "__main__":
       "Otherwise, --train_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "frame_batch_reader", False,
+      "If set, frame-level features are read by the *FeatureBatchReader, which "
+      "reads and decodes blocks of SequenceExamples per op. It needs "
+      "--quantized_frames.")
+  flags.DEFINE_bool(
+      "quantized_frames", False,
+      "If set, frame-level features are kept as uint8 in the input queues and "
+      "dequantized in the graph right before the model, which takes about 4x "
+      "less queue memory.")
+  flags.DEFINE_string(
+      "bucket_boundaries", "",
+      "Comma separated upper bounds of num_frames, e.g. '60,120,180,240'. If "
+      "set, frame-level videos of similar length are batched together and each "
+      "batch is only padded to its bucket boundary. Only use it with models "
+      "that accept a variable number of frames (variable_frames = True, e.g. "
+      "LSTMs using dynamic_rnn), train.py refuses the others.")
   flags.DEFINE_bool(
       "frame_only", False,
       "If set, then --train_data_pattern must be frame-level features. "
@@ -114,6 +131,9 @@ if __name__ == "__main__":
   # Other flags.
   flags.DEFINE_integer("num_readers", 8,
                        "How many threads to use for reading input files.")
+  flags.DEFINE_integer("queue_capacity_batches", 5,
+                       "Capacity of the shuffle queue in number of batches, "
+                       "can be raised when --quantized_frames is set.")
   flags.DEFINE_string("optimizer", "AdamOptimizer",
                       "What optimizer class to use.")
   flags.DEFINE_string("gradient", None,
@@ -188,15 +208,109 @@ def get_input_data_tensors(reader,
         reader.prepare_reader(filename_queue) for _ in range(num_readers)
     ]
 
+    if FLAGS.bucket_boundaries:
+      bucket_boundaries = map(int, FLAGS.bucket_boundaries.split(","))
+      return bucket_batch_join(
+          training_data,
+          batch_size=batch_size,
+          bucket_boundaries=bucket_boundaries)
+
     return tf.train.shuffle_batch_join(
         training_data,
         batch_size=batch_size,
-        capacity=FLAGS.batch_size * 5,
+        capacity=FLAGS.batch_size * FLAGS.queue_capacity_batches,
         min_after_dequeue=FLAGS.batch_size,
         allow_smaller_final_batch=True,
         enqueue_many=True)
 
 
+def bucket_batch_join(training_data, batch_size, bucket_boundaries):
+  """Batches frame-level examples of similar length together.
+
+  Every reader puts its examples into a shuffling queue per bucket, the bucket
+  of the smallest boundary not less than their num_frames, and the frame axis
+  is cut to that boundary on the way in. A thread per bucket then takes
+  batches of batch_size examples out of its queue, and the training step
+  takes the next batch of any bucket. Models thus do not spend time on the
+  padded frames beyond the boundary.
+
+  The frame axis of the returned video matrix has no static size, so the
+  model must accept a variable number of frames (BaseModel.variable_frames).
+
+  The bucket index and the padding ratio of each batch are added to the
+  "bucket_id" and "padding_ratio" collections.
+
+  Args:
+    training_data: A list of tensor tuples produced by reader.prepare_reader.
+      The video matrix and num_frames are expected at index 1 and 3.
+    batch_size: How many examples to process at a time.
+    bucket_boundaries: A sorted list of upper bounds of num_frames. Videos
+      longer than the last boundary go to an extra bucket padded to
+      max_frames.
+
+  Returns:
+    A tuple of batched tensors in the same order as the reader outputs.
+  """
+  max_frames, feature_size = training_data[0][1].get_shape().as_list()[1:]
+  frame_limits = list(bucket_boundaries) + [max_frames]
+  logging.info("Bucketing frames by num_frames <= %s.", str(frame_limits))
+
+  # the capacity of the shuffle queue of get_input_data_tensors, split into
+  # the buckets
+  bucket_capacity = max(
+      FLAGS.batch_size * FLAGS.queue_capacity_batches // len(frame_limits),
+      3 * batch_size)
+  dtypes = [tensor.dtype for tensor in training_data[0]]
+  bucket_queues = []
+  for frame_limit in frame_limits:
+    shapes = [tensor.get_shape()[1:] for tensor in training_data[0]]
+    shapes[1] = tf.TensorShape([frame_limit, feature_size])
+    bucket_queues.append(tf.RandomShuffleQueue(
+        capacity=bucket_capacity,
+        min_after_dequeue=batch_size,
+        dtypes=dtypes,
+        shapes=shapes))
+
+  # a single enqueue op per reader feeds all the buckets
+  enqueue_ops = []
+  for tensors in training_data:
+    which_bucket = tf.reduce_sum(tf.cast(
+        tf.greater(tf.expand_dims(tensors[3], 1), frame_limits[:-1]),
+        tf.int32), axis=1)
+    bucket_enqueue_ops = []
+    for bucket_index, queue in enumerate(bucket_queues):
+      in_bucket = tf.equal(which_bucket, bucket_index)
+      examples = [tf.boolean_mask(tensor, in_bucket) for tensor in tensors]
+      examples[1] = examples[1][:, :frame_limits[bucket_index], :]
+      bucket_enqueue_ops.append(queue.enqueue_many(examples))
+    enqueue_ops.append(tf.group(*bucket_enqueue_ops))
+  tf.train.add_queue_runner(tf.train.QueueRunner(
+      bucket_queues[0], enqueue_ops,
+      close_op=tf.group(*[queue.close() for queue in bucket_queues]),
+      cancel_op=tf.group(*[queue.close(cancel_pending_enqueues=True)
+                           for queue in bucket_queues])))
+
+  # the batches of every bucket, without a static number of frames
+  batch_queue = tf.FIFOQueue(capacity=len(frame_limits),
+                             dtypes=[tf.int32] + dtypes)
+  tf.train.add_queue_runner(tf.train.QueueRunner(batch_queue, [
+      batch_queue.enqueue([bucket_index] + queue.dequeue_up_to(batch_size))
+      for bucket_index, queue in enumerate(bucket_queues)]))
+  batch = batch_queue.dequeue()
+  bucket_id, batch = batch[0], batch[1:]
+  for tensor, example in zip(batch, training_data[0]):
+    if tensor is batch[1]:
+      tensor.set_shape([None, None, feature_size])
+    else:
+      tensor.set_shape([None] + example.get_shape().as_list()[1:])
+
+  padding_ratio = 1.0 - tf.cast(tf.reduce_sum(batch[3]), tf.float32) / tf.cast(
+      tf.size(batch[3]) * tf.shape(batch[1])[1], tf.float32)
+  tf.add_to_collection("bucket_id", bucket_id)
+  tf.add_to_collection("padding_ratio", padding_ratio)
+  return tuple(batch)
+
+
 def find_class_by_name(name, modules):
   """Searches the provided modules for the named class and returns it."""
   modules = [getattr(module, name, None) for module in modules]
@@ -273,6 +387,9 @@ def build_graph(reader,
               batch_size=batch_size,
               num_readers=num_readers,
               num_epochs=num_epochs))
+  if model_input_raw.dtype == tf.uint8:
+    # frame features were kept quantized through the input queues
+    model_input_raw = readers.dequantize_frames(model_input_raw, num_frames)
   tf.summary.histogram("model/input_raw", model_input_raw)
   
   feature_dim = len(model_input_raw.get_shape()) - 1
@@ -496,6 +613,11 @@ class Trainer(object):
         train_op = tf.get_collection("train_op")[0]
         init_op = tf.global_variables_initializer()
 
+        bucketing = len(tf.get_collection("bucket_id")) > 0
+        if bucketing:
+          bucket_id = tf.get_collection("bucket_id")[0]
+          padding_ratio = tf.get_collection("padding_ratio")[0]
+
     sv = tf.train.Supervisor(
         graph,
         logdir=self.train_dir,
@@ -509,13 +631,21 @@ class Trainer(object):
     logging.info("%s: Starting managed session.", task_as_string(self.task))
     with sv.managed_session(target, config=self.config) as sess:
 
+      # bucket index -> [batches, seconds, padding ratio sum]
+      bucket_stats = {}
       try:
         logging.info("%s: Entering training loop.", task_as_string(self.task))
         while not sv.should_stop():
 
           batch_start_time = time.time()
-          _, global_step_val, loss_val, reg_loss_val, predictions_val, labels_val = sess.run(
-              [train_op, global_step, loss, reg_loss, predictions, labels])
+          if bucketing:
+            (_, global_step_val, loss_val, reg_loss_val, predictions_val,
+             labels_val, bucket_id_val, padding_ratio_val) = sess.run(
+                [train_op, global_step, loss, reg_loss, predictions, labels,
+                 bucket_id, padding_ratio])
+          else:
+            _, global_step_val, loss_val, reg_loss_val, predictions_val, labels_val = sess.run(
+                [train_op, global_step, loss, reg_loss, predictions, labels])
           seconds_per_batch = time.time() - batch_start_time
 
           if self.is_master:
@@ -543,6 +673,21 @@ class Trainer(object):
             sv.summary_writer.add_summary(
                 utils.MakeSummary("global_step/Examples/Second",
                                   examples_per_second), global_step_val)
+            if bucketing:
+              stats = bucket_stats.setdefault(bucket_id_val, [0, 0.0, 0.0])
+              stats[0] += 1
+              stats[1] += seconds_per_batch
+              stats[2] += padding_ratio_val
+              logging.info(
+                  "%s: bucket %d | Seconds/Batch: %.3f Padding: %.3f",
+                  task_as_string(self.task), bucket_id_val,
+                  seconds_per_batch, padding_ratio_val)
+              sv.summary_writer.add_summary(
+                  utils.MakeSummary("bucket_%d/Seconds_Per_Batch" % bucket_id_val,
+                                    seconds_per_batch), global_step_val)
+              sv.summary_writer.add_summary(
+                  utils.MakeSummary("bucket_%d/Padding_Ratio" % bucket_id_val,
+                                    padding_ratio_val), global_step_val)
             sv.summary_writer.flush()
 
       except tf.errors.OutOfRangeError:
@@ -550,6 +695,12 @@ class Trainer(object):
                      task_as_string(self.task))
 
     logging.info("%s: Exited training loop.", task_as_string(self.task))
+    for bucket_index in sorted(bucket_stats.keys()):
+      batches, seconds, padding = bucket_stats[bucket_index]
+      logging.info(
+          "%s: bucket %d | Batches: %d Seconds/Batch: %.3f Padding: %.3f",
+          task_as_string(self.task), bucket_index, batches,
+          seconds / batches, padding / batches)
     sv.Stop()
 
   def start_server_if_distributed(self):
@@ -615,9 +766,14 @@ class Trainer(object):
         FLAGS.feature_names, FLAGS.feature_sizes)
     if FLAGS.distillation_features:
         print("distillation readers")
-        if FLAGS.frame_features:
+        if FLAGS.frame_features and FLAGS.frame_batch_reader:
+            reader = readers.YT8MFrameDistillationFeatureBatchReader(
+                feature_names=feature_names, feature_sizes=feature_sizes,
+                dequantize=not FLAGS.quantized_frames)
+        elif FLAGS.frame_features:
             reader = readers.YT8MFrameDistillationFeatureReader(
-                feature_names=feature_names, feature_sizes=feature_sizes)
+                feature_names=feature_names, feature_sizes=feature_sizes,
+                dequantize=not FLAGS.quantized_frames)
         else:
             reader = readers.YT8MAggregatedDistillationFeatureReader(
                 feature_names=feature_names, feature_sizes=feature_sizes)
@@ -626,9 +782,14 @@ class Trainer(object):
           if FLAGS.frame_only:
               reader = readers.YT8MFrameFeatureOnlyReader(
                   feature_names=feature_names, feature_sizes=feature_sizes)
+          elif FLAGS.frame_batch_reader:
+              reader = readers.YT8MFrameFeatureBatchReader(
+                  feature_names=feature_names, feature_sizes=feature_sizes,
+                  dequantize=not FLAGS.quantized_frames)
           else:
               reader = readers.YT8MFrameFeatureReader(
-                  feature_names=feature_names, feature_sizes=feature_sizes)
+                  feature_names=feature_names, feature_sizes=feature_sizes,
+                  dequantize=not FLAGS.quantized_frames)
         else:
           reader = readers.YT8MAggregatedFeatureReader(
               feature_names=feature_names, feature_sizes=feature_sizes)
@@ -636,6 +797,10 @@ class Trainer(object):
     # Find the model.
     model = find_class_by_name(FLAGS.model,
                                [frame_level_models, video_level_models])()
+    if FLAGS.bucket_boundaries and not model.variable_frames:
+      raise ValueError(
+          "Model '%s' needs a static number of frames, it cannot be trained "
+          "with --bucket_boundaries." % FLAGS.model)
     label_loss_fn = find_class_by_name(FLAGS.label_loss, [losses])()
     optimizer_class = find_class_by_name(FLAGS.optimizer, [tf.train])
 